@@ -5,6 +5,7 @@ import cv2
 from PIL import Image, ImageTk
 
 from components.state_canvas import StateCanvas
+from utils.frame import fit_size, get_processing_size, to_processing_resolution
 
 if TYPE_CHECKING:
     from components.root_window import RootWindow
@@ -17,16 +18,23 @@ class FrameCanvas(StateCanvas):
         self.image = None
 
         self.frame_count = 0
+        # detection runs at this resolution, the preview is scaled separately in show_frame
+        self.processing_size = get_processing_size(window.settings)
 
     def get_frame(self):
         ok, frame = self.window.cap.read()
         if not ok:
             raise Exception("Could not read frame")
-        frame = self.resize_frame(frame)
+        frame = to_processing_resolution(self.crop_frame(frame), self.processing_size)
         self.frame_count += 1
         return frame, self.frame_count
 
+    # overridden by canvases that only care about the area of interest
+    def crop_frame(self, frame):
+        return frame
+
     def show_frame(self, frame):
+        frame = self.fit_preview(frame)
         # fix colors
         rgb_image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         pil_image = Image.fromarray(rgb_image)
@@ -59,17 +67,14 @@ class FrameCanvas(StateCanvas):
             # operating on destroyed canvas
             pass
 
-    def resize_frame(self, frame):
-        original_height, original_width = frame.shape[:2]
-        aspect_ratio = original_width / original_height
-        if (self.window.width / aspect_ratio) > self.window.height:
-            new_width = int(self.window.height * aspect_ratio)
-            new_height = self.window.height
-        else:
-            new_height = int(self.window.width / aspect_ratio)
-            new_width = self.window.width
-
-        frame = cv2.resize(frame, (new_width, new_height))
+    # scales a frame to fit the window for display
+    def fit_preview(self, frame):
+        (height, width) = frame.shape[:2]
+        (new_width, new_height) = fit_size(
+            width, height, self.window.width, self.window.height
+        )
+        if (new_width, new_height) != (width, height):
+            frame = cv2.resize(frame, (new_width, new_height))
         self.resize(new_width, new_height)
         return frame
 
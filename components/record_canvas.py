@@ -1,3 +1,4 @@
+import datetime
 import tkinter as tk
 from os import getcwd, path
 from tkinter import filedialog
@@ -7,13 +8,21 @@ from components.debug_frame import DebugFrame
 from components.frame_canvas import FrameCanvas
 from components.tuning.motion import TuneMotionFrame
 from custom_types.motion import MotionEventHandler
+from detection.checkpoint import BackgroundCheckpoint, make_checkpoint_key
+from detection.drift import open_drift_tracker
 from handlers.debug import DebugHandler
+from handlers.event_log import EventLogHandler, get_event_log_dir
 from handlers.file_interval import FileIntervalHandler
 from handlers.frame import FrameHandler
+from pipeline.archive import get_archive_dir, open_archive
+from pipeline.writer import open_writer
 
 if TYPE_CHECKING:
     from components.root_window import RootWindow
 
+# seconds rows can wait to be written before we warn about it
+BACKLOG_WARNING_LAG = 5
+
 
 class RecordCanvas(FrameCanvas):
     def __init__(self, window: "RootWindow"):
@@ -21,6 +30,7 @@ class RecordCanvas(FrameCanvas):
         self.hidden = False
         self.filename = None
         self.output_path = None
+        self.writer = None
 
         try:
             grid = window.app_state["grid"]
@@ -36,27 +46,59 @@ class RecordCanvas(FrameCanvas):
             ) or filedialog.asksaveasfilename(defaultextension=".txt")
             if self.filename == "":
                 raise ValueError("No output file selected")
+            self.writer = open_writer(
+                fsync=window.settings.get("recording.fsync"),
+                fsync_interval=window.settings.get("recording.fsync_interval"),
+                image_workers=window.settings.get("recording.image_workers"),
+                error_queue=window.errors,
+            )
+            # shared by all outputs, so that their timestamps line up
+            start_time = datetime.datetime.now()
+            record_images = window.app_state.get("record_images")
+            archive = None
+            if record_images and window.settings.get("recording.image_mode") == "video":
+                archive = self.make_archive(start_time)
+                record_images = False
             handler = FileIntervalHandler(
                 grid,
                 self.filename,
                 cleanup_queue=window.cleanup,
-                error_queue=window.errors,
+                writer=self.writer,
+                archive=archive,
                 interval=window.settings.get("recording.interval"),
-                record_images=window.app_state.get("record_images"),
+                record_images=record_images,
+                base_interval=window.settings.get("recording.base_interval"),
+                activity_interval=window.settings.get("recording.activity_interval"),
+                start_time=start_time,
             )
-            handler.start()
+            if window.settings.get("recording.event_log"):
+                handler = self.make_event_log(handler, start_time)
         # wrap with debug handler to enable visualization
         debug_handler = DebugHandler(grid, handler)
-        self.frame_handler = FrameHandler(grid, window.settings, debug_handler)
+        self.frame_handler = FrameHandler(
+            grid,
+            window.settings,
+            debug_handler,
+            checkpoint=self.make_checkpoint(grid),
+            drift=self.make_drift_tracker(grid),
+        )
+        window.cleanup.put(self.frame_handler.close)
+        # corrections we've already handled, see update_drift
+        self.drift_corrections = 0
 
         # components
         # controls
         self.control_frame = tk.Frame(self.window)
         self.path_label = None
         self.hide_button = None
+        self.backlog_label = None
         self.stop_button = tk.Button(
             self.control_frame, text="Stop", command=self.window.state_manager.idle
         )
+        # only shows text when the plate has moved too far to follow, see update_drift
+        self.drift_label = tk.Label(self.control_frame, fg="red")
+        # only shows text when the background model couldn't be saved, see update_checkpoint
+        self.checkpoint_label = tk.Label(self.control_frame, fg="red")
         # show these buttons when recording to a file
         if self.filename is not None:
             if self.filename.startswith(getcwd()):
@@ -69,6 +111,8 @@ class RecordCanvas(FrameCanvas):
             self.hide_button = tk.Button(
                 self.control_frame, text="Hide", command=self.toggle_hide
             )
+            # only shows text when storage is falling behind, see update_backlog
+            self.backlog_label = tk.Label(self.control_frame, fg="red")
 
         # toggle debug display
         self.debug_frame = DebugFrame(window, debug_handler)
@@ -84,13 +128,77 @@ class RecordCanvas(FrameCanvas):
         self.hidden_frame = tk.Frame(self.window)
         tk.Label(self.hidden_frame, text="Hidden").grid()
 
+    # records frames into video segments next to the output file, see pipeline/archive.py
+    def make_archive(self, start_time: datetime.datetime):
+        settings = self.window.settings
+        return open_archive(
+            get_archive_dir(self.filename, start_time),
+            # the fastest the loop can run, since processing adds to the delay between frames
+            # segments are encoded at the rate that's actually measured, this is only a fallback
+            1000 / self.window.frame_delay,
+            self.writer,
+            segment_duration=settings.get("recording.segment_duration"),
+            decimation=settings.get("recording.archive_decimation"),
+            codec=settings.get("recording.archive_codec"),
+        )
+
+    # logs every motion event next to the output file, see handlers/event_log.py
+    def make_event_log(self, handler, start_time):
+        settings = self.window.settings
+        return EventLogHandler(
+            get_event_log_dir(self.filename),
+            handler,
+            grid=self.window.app_state["grid"],
+            start_time=start_time,
+            max_bytes=settings.get("recording.event_log_max_bytes"),
+            max_duration=settings.get("recording.event_log_max_duration"),
+            cleanup_queue=self.window.cleanup,
+            # events get their own writer, so they can't hold up the output file
+            writer=open_writer(
+                fsync=settings.get("recording.fsync"),
+                fsync_interval=settings.get("recording.fsync_interval"),
+                error_queue=self.window.errors,
+            ),
+        )
+
+    # restores the background model from a previous run with the same setup, see detection/checkpoint.py
+    def make_checkpoint(self, grid):
+        directory = self.window.settings.get("motion.checkpoint_dir")
+        if directory is None:
+            return None
+        key = make_checkpoint_key(
+            self.window.source,
+            self.window.app_state.get("border"),
+            grid,
+            self.processing_size,
+            self.window.settings.get("motion.method"),
+        )
+        return BackgroundCheckpoint(directory, key)
+
+    # follows the plate if it drifts during the recording, see detection/drift.py
+    def make_drift_tracker(self, grid):
+        settings = self.window.settings
+        reference = self.window.app_state.get("scan_frame")
+        if not settings.get("drift.interval") or reference is None:
+            return None
+        return open_drift_tracker(
+            reference,
+            grid,
+            interval=settings.get("drift.interval"),
+            min_shift=settings.get("drift.min_shift"),
+            max_shift=settings.get("drift.max_shift"),
+        )
+
     def layout(self):
         super().grid()
         self.control_frame.grid(row=1, column=0)
         if self.filename is not None:
             self.path_label.grid(row=0, column=0)
             self.hide_button.grid(row=0, column=1)
+            self.backlog_label.grid(row=1, column=0, columnspan=3)
         self.stop_button.grid(row=0, column=2)
+        self.drift_label.grid(row=2, column=0, columnspan=3)
+        self.checkpoint_label.grid(row=3, column=0, columnspan=3)
         self.debug_frame.layout(row=2)
         if self.tuning_frame is not None:
             self.tuning_frame.layout(row=3)
@@ -109,7 +217,7 @@ class RecordCanvas(FrameCanvas):
             self.hidden_frame.grid(row=0, column=0)
         self.debug_frame.toggle_hidden()
 
-    def resize_frame(self, frame):
+    def crop_frame(self, frame):
         try:
             border = self.window.app_state["border"]
             (x, y, w, h) = border
@@ -117,12 +225,57 @@ class RecordCanvas(FrameCanvas):
         except KeyError:
             pass
 
-        return super().resize_frame(frame)
+        return frame
+
+    def update_backlog(self):
+        stats = self.writer.stats()
+        text = ""
+        if stats["lag"] > BACKLOG_WARNING_LAG or stats["images_dropped"] > 0:
+            text = (
+                f"Storage is falling behind: {stats['backlog']} rows waiting "
+                f"({stats['lag']:.0f}s), {stats['images_dropped']} images dropped"
+            )
+        if self.backlog_label.cget("text") != text:
+            self.backlog_label.config(text=text)
+
+    def update_drift(self):
+        stats = self.frame_handler.drift.stats()
+        if stats["corrections"] != self.drift_corrections:
+            self.drift_corrections = stats["corrections"]
+            # the checkpoint is keyed by where the wells were, so it has to follow them
+            self.frame_handler.motion_detector.checkpoint = self.make_checkpoint(
+                self.frame_handler.grid
+            )
+        text = ""
+        if stats["moved"]:
+            text = (
+                f"The plate has moved by {stats['shift']:.0f}px since the scan, "
+                "stop and scan again to keep tracking it"
+            )
+        if self.drift_label.cget("text") != text:
+            self.drift_label.config(text=text)
+
+    def update_checkpoint(self):
+        motion_detector = self.frame_handler.motion_detector
+        text = ""
+        if motion_detector.checkpoints_failed > 0:
+            text = (
+                "Could not save the background model "
+                f"({motion_detector.checkpoints_failed} times): {motion_detector.checkpoint_error}"
+            )
+        if self.checkpoint_label.cget("text") != text:
+            self.checkpoint_label.config(text=text)
 
     def update(self):
         frame, frame_count = self.get_frame()
-        self.frame_handler.handle(frame, frame_count)
+        display_frame = self.frame_handler.handle(frame, frame_count)
+        if self.writer is not None:
+            self.update_backlog()
+        if self.frame_handler.drift is not None:
+            self.update_drift()
+        if self.frame_handler.motion_detector.checkpoint is not None:
+            self.update_checkpoint()
         if self.hidden:
             self.delete_frame()
         else:
-            self.show_frame(frame)
+            self.show_frame(display_frame)
@@ -4,10 +4,9 @@ import traceback
 from tkinter import messagebox
 from typing import Any, Callable
 
-import cv2
-
 from components.state_canvas import StateCanvas
 from components.state_manager import StateManager
+from pipeline.capture import open_capture
 from utils.app_settings import AppSettings
 from utils.arg_parser import arg_parser
 from utils.get_webcams import get_webcams
@@ -65,6 +64,8 @@ class RootWindow(tk.Tk):
             callback()
         if self.after_id is not None:
             self.after_cancel(self.after_id)
+        if self.cap is not None:
+            self.cap.release()
         self.is_running = False
         self.destroy()
 
@@ -83,11 +84,13 @@ class RootWindow(tk.Tk):
         if self.cap is not None:
             self.cap.release()
             self.cap = None
-        cap = cv2.VideoCapture(source)
-        cap.open(source)
-        if not cap.isOpened():
-            raise IOError(f"Unable to open video source: {source}")
-        self.cap = cap
+        self.source = source
+        # frames are read on a background thread, see pipeline/capture.py
+        self.cap = open_capture(
+            source,
+            policy=self.settings.get("video.capture_policy"),
+            buffer_size=self.settings.get("video.buffer_size"),
+        )
 
     # because tkinter elements are tied to a window on creation,
     # we use a factory function to create the canvas
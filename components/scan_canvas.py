@@ -1,4 +1,5 @@
 import tkinter as tk
+from functools import partial
 from tkinter import messagebox
 from typing import TYPE_CHECKING
 
@@ -6,7 +7,18 @@ import cv2
 
 from components.frame_canvas import FrameCanvas
 from detection.border import BorderDetector
-from detection.grids import GridDetector
+from detection.calibration import (
+    Calibration,
+    CalibrationStore,
+    apply_motion_settings,
+    get_motion_settings,
+    make_fingerprint,
+)
+from detection.grids import DetectionCancelled
+from detection.median import MedianFrame
+from pipeline.grid_search import GridSearch, open_grid_search
+from utils.frame import to_processing_resolution
+from utils.overlay import Overlay
 
 if TYPE_CHECKING:
     from components.root_window import RootWindow
@@ -21,19 +33,27 @@ class ScanCanvas(FrameCanvas):
 
         self.hidden = False
         self.border_detector = BorderDetector()
-
-        def start_recording():
-            # only set grid here now that it's confirmed
-            self.window.app_state["grid"] = self.grid
-            self.window.app_state["record_images"] = self.record_images.get()
-            self.window.state_manager.record()
+        # with more than one frame, the border and grid are detected on their median, see start_scan
+        self.scan_frames = int(window.settings.get("scan.frames") or 1)
+        self.median_frame = None
+        # boxes that were recorded before skip the scan, see restore_calibration
+        self.calibrations = self.make_calibration_store()
+        # the frame the grid was detected on, and the shape of the raw frames, for saving the calibration
+        self.scan_frame = None
+        self.frame_shape = None
+        self.restored = False
+        # grid detection runs on background threads, see detect_grid_in
+        self.grid_search: GridSearch | None = None
+        window.cleanup.put(self.cancel_detection)
+        # the wells and dimensions are only drawn again when the grid changes, see utils/overlay.py
+        self.overlay = Overlay(self.draw_grid)
 
         self.button_frame = tk.Frame()
         self.rescan_button = tk.Button(
             self.button_frame, text="Rescan", command=self.detect_grid
         )
         self.record_button = tk.Button(
-            self.button_frame, text="Record", command=start_recording
+            self.button_frame, text="Record", command=self.start_recording
         )
         # start disabled
         self.record_button.config(state=tk.DISABLED)
@@ -48,10 +68,17 @@ class ScanCanvas(FrameCanvas):
             variable=self.record_images,
         )
 
-        self.detect_grid()
-        if window.tuning_mode == "motion":
-            # need to schedule this to avoid updating a dead canvas
-            self.window.after_idle(start_recording)
+        if not self.restore_calibration():
+            self.detect_grid()
+
+    def start_recording(self):
+        # only set grid here now that it's confirmed
+        self.save_calibration()
+        self.window.app_state["grid"] = self.grid
+        # the frame the grid was detected on, which drift tracking compares against
+        self.window.app_state["scan_frame"] = self.scan_frame
+        self.window.app_state["record_images"] = self.record_images.get()
+        self.window.state_manager.record()
 
     def layout(self):
         super().grid()
@@ -63,47 +90,191 @@ class ScanCanvas(FrameCanvas):
 
     def get_frame(self):
         frame, frame_count = super().get_frame()
+        if self.median_frame is not None:
+            cv2.putText(
+                frame,
+                f"Scanning {len(self.median_frame)}/{self.scan_frames}",
+                (10, 30),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                1,
+                (0, 255, 0),
+                thickness=2,
+            )
+            return frame, frame_count
+        if self.grid_search is not None:
+            cv2.putText(
+                frame,
+                f"Detecting grid {self.grid_search.get_progress():.0%}",
+                (10, 30),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                1,
+                (0, 255, 0),
+                thickness=2,
+            )
+            return frame, frame_count
         if self.grid is None:
             return frame, frame_count
 
+        self.overlay.apply(frame, key=(self.grid, self.grid.version, self.restored))
+        return frame, frame_count
+
+    def draw_grid(self, image):
         for row in self.grid.rows:
             for item in row.items:
                 (start_point, end_point) = item.bounds
                 cv2.rectangle(
-                    frame,
+                    image,
                     (int(start_point[0]), int(start_point[1])),
                     (int(end_point[0]), int(end_point[1])),
                     (0, 255, 0),
                     thickness=1,
                 )
         cv2.putText(
-            frame,
-            f"{len(self.grid.rows)}x{len(self.grid.rows[0].items)}",
+            image,
+            f"{len(self.grid.rows)}x{len(self.grid.rows[0].items)}"
+            + (" (saved)" if self.restored else ""),
             (10, 30),
             cv2.FONT_HERSHEY_SIMPLEX,
             1,
             (0, 255, 0),
             thickness=2,
         )
-        return frame, frame_count
 
     def detect_grid(self):
-        frame = self.get_frame()[0]
-        grid_detector = GridDetector(frame)
+        if self.scan_frames > 1:
+            self.start_scan()
+        else:
+            # without the grid drawn on it, and copied since the search outlives the capture buffer
+            self.detect_grid_in(super().get_frame()[0].copy())
+
+    # the result comes back through finish_detection, while the preview keeps running
+    def detect_grid_in(self, frame):
+        self.cancel_detection()
+        self.grid = None
+        self.record_button.config(state=tk.DISABLED)
+        self.rescan_button.config(text="Stop", command=self.cancel_detection)
+        self.grid_search = open_grid_search(frame, on_done=self.schedule_finish)
+
+    # called from a worker thread, so the result is handed to the Tk thread instead of used here
+    # by the time it runs there, detect_grid_in has returned and set self.grid_search
+    def schedule_finish(self, search: GridSearch):
+        try:
+            self.window.after_idle(partial(self.finish_detection, search))
+        except (RuntimeError, tk.TclError):
+            # the window was closed while detection was running
+            pass
+
+    def finish_detection(self, search: GridSearch):
+        # a search that was cancelled or replaced by a newer one
+        if search is not self.grid_search:
+            return
+        self.grid_search = None
+        self.rescan_button.config(text="Rescan", command=self.detect_grid)
+        if search.grid is None:
+            if not isinstance(search.error, DetectionCancelled):
+                messagebox.showwarning("Detection Failed", str(search.error))
+            return
+        self.scan_frame = search.frame
+        self.restored = False
+        self.use_grid(search.grid)
+
+    def cancel_detection(self):
+        if self.grid_search is None:
+            return
+        self.grid_search.cancel()
+        self.grid_search = None
         try:
-            self.grid = grid_detector.detect()
-            self.record_button.config(state=tk.NORMAL)
-        except Exception as e:
-            messagebox.showwarning("Detection Failed", str(e))
+            self.rescan_button.config(text="Rescan", command=self.detect_grid)
+        except tk.TclError:
+            # already destroyed, see RootWindow.wipe
+            pass
+
+    def use_grid(self, grid, auto_record=False):
+        self.grid = grid
+        self.record_button.config(state=tk.NORMAL)
+        if auto_record or self.window.tuning_mode == "motion":
+            # need to schedule this to avoid updating a dead canvas
+            self.window.after_idle(self.start_recording)
+
+    def make_calibration_store(self):
+        directory = self.window.settings.get("calibration.directory")
+        if directory is None:
+            return None
+        return CalibrationStore(directory, self.window.source)
+
+    # uses the saved border and grid if the camera is looking at a box it has recorded before
+    def restore_calibration(self):
+        if self.calibrations is None or not self.calibrations.exists():
+            return False
+        ok, frame = self.window.cap.read()
+        if not ok:
+            return False
+        calibration = self.calibrations.find(frame, self.processing_size)
+        if calibration is None:
+            return False
+        self.window.app_state["border"] = calibration.border
+        apply_motion_settings(self.window.settings, calibration.motion)
+        # kept for drift tracking, so it can't share memory with the capture buffer
+        self.scan_frame = calibration.crop(frame).copy()
+        self.frame_shape = calibration.frame_shape
+        self.restored = True
+        self.use_grid(
+            calibration.grid,
+            auto_record=self.window.settings.get("calibration.auto_record"),
+        )
+        return True
+
+    def save_calibration(self):
+        if (
+            self.calibrations is None
+            or self.grid is None
+            or self.scan_frame is None
+            or "border" not in self.window.app_state
+        ):
+            return
+        self.calibrations.save(
+            Calibration(
+                self.window.app_state["border"],
+                self.grid,
+                make_fingerprint(self.scan_frame),
+                self.frame_shape,
+                self.processing_size,
+                motion=get_motion_settings(self.window.settings),
+            )
+        )
+
+    # collects the next scan_frames frames (see crop_frame), and detects the border and grid on their median
+    # so that a fly on the rim of a well or a noisy frame doesn't throw detection off
+    def start_scan(self):
+        self.cancel_detection()
+        self.grid = None
+        self.record_button.config(state=tk.DISABLED)
+        self.window.app_state.pop("border", None)
+        self.median_frame = MedianFrame(self.scan_frames)
+
+    def finish_scan(self):
+        frame = self.median_frame.get()
+        self.median_frame = None
+        (x, y, w, h) = self.border_detector.get_border(frame)
+        self.window.app_state["border"] = (x, y, w, h)
+        self.detect_grid_in(
+            to_processing_resolution(frame[y : y + h, x : x + w], self.processing_size)
+        )
 
-    def resize_frame(self, frame):
+    def crop_frame(self, frame):
+        self.frame_shape = frame.shape[:2]
+        if self.median_frame is not None:
+            self.median_frame.add(frame)
+            # the border isn't known until the scan is done
+            return frame
         try:
             (x, y, w, h) = self.window.app_state["border"]
         except KeyError:
             (x, y, w, h) = self.border_detector.get_border(frame)
             self.window.app_state["border"] = (x, y, w, h)
-        frame = frame[y : y + h, x : x + w]
-        return super().resize_frame(frame)
+        return frame[y : y + h, x : x + w]
 
     def update(self):
         super().update()
+        if self.median_frame is not None and self.median_frame.is_full:
+            self.finish_scan()
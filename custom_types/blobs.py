@@ -0,0 +1,37 @@
+import numpy as np
+
+# struct of arrays describing the blobs (connected components) found in a motion mask
+# row i of each array belongs to the same blob, so a whole frame can be processed with NumPy at once
+
+
+class Blobs:
+    def __init__(self, centers, areas, bounds):
+        # (n, 2) float64 array of x, y centroids
+        self.centers = centers
+        # (n,) int32 array of areas in pixels
+        self.areas = areas
+        # (n, 4) int32 array of x, y, w, h bounding boxes, same as cv2.boundingRect
+        self.bounds = bounds
+
+    def __len__(self):
+        return len(self.areas)
+
+    @staticmethod
+    def empty():
+        return Blobs(
+            np.empty((0, 2), np.float64),
+            np.empty(0, np.int32),
+            np.empty((0, 4), np.int32),
+        )
+
+    @staticmethod
+    def concat(blobs_list: list["Blobs"]):
+        if len(blobs_list) == 1:
+            return blobs_list[0]
+        if len(blobs_list) == 0:
+            return Blobs.empty()
+        return Blobs(
+            np.concatenate([blobs.centers for blobs in blobs_list]),
+            np.concatenate([blobs.areas for blobs in blobs_list]),
+            np.concatenate([blobs.bounds for blobs in blobs_list]),
+        )
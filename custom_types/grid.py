@@ -1,5 +1,8 @@
+import math
 from typing import List, Tuple
 
+import numpy as np
+
 from custom_types.contour import ContourBounds
 from custom_types.geometry import Rectangle
 
@@ -12,10 +15,10 @@ class GridComponent:
             raise Exception(f"GridComponent {self} does not have bounds")
         (x, y, w, h) = contour_bounds
         return (
-            start_point[0] <= x <= end_point[0]
-            and start_point[1] <= y <= end_point[1]
-            and x + w <= start_point[0] + end_point[0]
-            and y + h <= start_point[1] + end_point[1]
+            start_point[0] <= x
+            and start_point[1] <= y
+            and x + w <= end_point[0]
+            and y + h <= end_point[1]
         )
 
 
@@ -63,6 +66,17 @@ class Grid(GridComponent):
     def __init__(self, rows: List[Row]):
         self.rows = rows
         self.bounds = self.calculate_bounds()
+        # items by their index in the output, see GridDetector.detect
+        self.items: List[Item | None] = []
+        for row in self.rows:
+            for item in row.items:
+                if item.index >= len(self.items):
+                    self.items.extend([None] * (item.index + 1 - len(self.items)))
+                self.items[item.index] = item
+        # built on demand, see get_labels
+        self.labels = None
+        # bumped whenever items move, so anything drawn from the grid knows to draw it again
+        self.version = 0
 
     def calculate_bounds(self):
         if len(self.rows) == 0:
@@ -88,6 +102,87 @@ class Grid(GridComponent):
                 return row
         return None
 
+    # image where each pixel holds the index of the item it belongs to, or -1 if it's outside every item
+    # pixel (px, py) belongs to an item if x1 <= px < x2 and y1 <= py < y2
+    # if items overlap, the first one (in row order) wins, same as find_row / find_item
+    def get_labels(self, frame_shape):
+        shape = tuple(frame_shape[:2])
+        if self.labels is not None and self.labels.shape == shape:
+            return self.labels
+        labels = np.full(shape, -1, np.int32)
+        for row in reversed(self.rows):
+            for item in reversed(row.items):
+                ((x1, y1), (x2, y2)) = item.bounds
+                labels[
+                    max(0, math.ceil(y1)) : max(0, math.ceil(y2)),
+                    max(0, math.ceil(x1)) : max(0, math.ceil(x2)),
+                ] = item.index
+        self.labels = labels
+        return labels
+
+    # returns the index of the item containing each (x, y) point, or -1
+    def find_items(self, points, frame_shape):
+        labels = self.get_labels(frame_shape)
+        points = np.floor(np.asarray(points, np.float64).reshape(-1, 2)).astype(np.intp)
+        (x, y) = (points[:, 0], points[:, 1])
+        inside = (x >= 0) & (y >= 0) & (x < labels.shape[1]) & (y < labels.shape[0])
+        indices = np.full(len(points), -1, np.int32)
+        indices[inside] = labels[y[inside], x[inside]]
+        return indices
+
+    # moves the center of every item by a 2x3 affine matrix (see detection/drift.py), keeping its size
+    def transform(self, matrix):
+        matrix = np.asarray(matrix, np.float64)
+        for row in self.rows:
+            for item in row.items:
+                ((x1, y1), (x2, y2)) = item.bounds
+                (x, y) = matrix @ ((x1 + x2) / 2, (y1 + y2) / 2, 1)
+                (half_width, half_height) = ((x2 - x1) / 2, (y2 - y1) / 2)
+                item.bounds = (
+                    (x - half_width, y - half_height),
+                    (x + half_width, y + half_height),
+                )
+            row.bounds = row.calculate_bounds()
+        self.bounds = self.calculate_bounds()
+        self.labels = None
+        self.version += 1
+
     @property
     def dimensions(self):
         return (len(self.rows), len(self.rows[0].items))
+
+    # plain lists and numbers, so the grid can be saved as JSON and rebuilt with from_dict
+    def to_dict(self):
+        return {
+            "rows": [
+                [
+                    {
+                        "index": int(item.index),
+                        "coords": [int(value) for value in item.coords],
+                        "bounds": [
+                            [float(value) for value in point] for point in item.bounds
+                        ],
+                    }
+                    for item in row.items
+                ]
+                for row in self.rows
+            ]
+        }
+
+    @staticmethod
+    def from_dict(data: dict):
+        return Grid(
+            [
+                Row(
+                    [
+                        Item(
+                            tuple(tuple(point) for point in item["bounds"]),
+                            item["index"],
+                            tuple(item["coords"]),
+                        )
+                        for item in row
+                    ]
+                )
+                for row in data["rows"]
+            ]
+        )
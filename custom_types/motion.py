@@ -1,16 +1,26 @@
-import cv2
+from typing import List
 
+import numpy as np
+
+from custom_types.contour import ContourBounds
 from detection.grids import Item
-from utils.geometry import calculate_distance_between, get_contour_center
+from utils.geometry import calculate_distance_between
 
 
 class MotionPoint:
-    def __init__(self, contour, item: Item, frame_count: int):
-        self.contour = contour
+    def __init__(
+        self,
+        center: tuple[float, float],
+        area: float,
+        bounds: ContourBounds,
+        item: Item,
+        frame_count: int,
+    ):
+        self.center = center
+        self.area = area
+        self.bounds = bounds
         self.item = item
         self.frame_count = frame_count
-        self.center = get_contour_center(contour)
-        self.area = cv2.contourArea(contour)
 
     def distance_to(self, other: "MotionPoint"):
         return calculate_distance_between(self.center, other.center)
@@ -28,9 +38,93 @@ class MotionEvent:
         self.distance = point.distance_to(last_point)
 
 
+# all motion events of a single frame, as struct-of-arrays columns (row i of each array is event i)
+# this lets handlers process a whole frame at once instead of one event at a time
+class MotionBatch:
+    def __init__(
+        self,
+        items: List[Item | None],
+        frame_count: int,
+        time: float,
+        frame,
+        raw_frame,
+        indices,
+        centers,
+        areas,
+        bounds,
+        last_centers,
+        last_areas,
+        last_bounds,
+        last_frame_counts,
+        distances=None,
+    ):
+        # grid items by index, used to look up the item of each event
+        self.items = items
+        self.frame_count = frame_count
+        # when the frame was captured, in seconds
+        # only differences matter, so this can be monotonic time or video time
+        self.time = time
+        self.frame = frame
+        self.raw_frame = raw_frame
+
+        # (n,) well index of each event, see Grid.items
+        self.indices = indices
+        # current point: (n, 2) x / y centers, (n,) areas, (n, 4) x / y / w / h bounds
+        self.centers = centers
+        self.areas = areas
+        self.bounds = bounds
+        # last point in the same well, plus the frame it was seen on
+        self.last_centers = last_centers
+        self.last_areas = last_areas
+        self.last_bounds = last_bounds
+        self.last_frame_counts = last_frame_counts
+        # (n,) distance between the last and current point
+        # can be passed in when it's already known, e.g. when replaying an event log
+        if distances is None:
+            distances = np.hypot(
+                centers[:, 0] - last_centers[:, 0], centers[:, 1] - last_centers[:, 1]
+            )
+        self.distances = distances
+
+    def __len__(self):
+        return len(self.indices)
+
+    # converts the batch into individual events, for handlers that only implement handle
+    def events(self):
+        for i in range(len(self)):
+            item = self.items[self.indices[i]]
+            point = MotionPoint(
+                tuple(self.centers[i].tolist()),
+                int(self.areas[i]),
+                tuple(self.bounds[i].tolist()),
+                item,
+                self.frame_count,
+            )
+            last_point = MotionPoint(
+                tuple(self.last_centers[i].tolist()),
+                int(self.last_areas[i]),
+                tuple(self.last_bounds[i].tolist()),
+                item,
+                int(self.last_frame_counts[i]),
+            )
+            yield MotionEvent(point, last_point, item, self.frame, self.raw_frame)
+
+
 class MotionEventHandler:
+    # handlers declare what they need from each frame, so FrameHandler can skip the work otherwise
+    # raw_frame is an unmodified, read-only frame, and is None unless needs_raw_frame is set
+    needs_raw_frame = False
+    # frame is a copy of the frame for display purposes, and is None unless draws_on_frame is set
+    draws_on_frame = False
+
     def __init__(self) -> None:
         self.on_frame = None
 
     def handle(self, event: MotionEvent) -> None:
         pass
+
+    # called once per frame with all of its events
+    # override this to process them in bulk, otherwise each one is passed to handle
+    def handle_frame(self, batch: MotionBatch) -> None:
+        for event in batch.events():
+            self.handle(event)
@@ -0,0 +1,155 @@
+from typing import TYPE_CHECKING
+
+import cv2
+import numpy as np
+
+if TYPE_CHECKING:
+    from detection.motion import MotionDetector
+
+# background models take a grayscale frame and return a foreground mask (0 or 255)
+# they're selected via motion.method in settings.json, see BACKGROUND_MODELS below
+# each model reads its parameters from the detector, so that tuning works the same for all of them
+
+# KNN is the most robust, but also by far the most expensive (in both CPU and memory, especially at high histories)
+# if lighting is stable, running_average or diff are much cheaper and often good enough
+
+# models can also export their state as an image and restore it later, see detection/checkpoint.py
+# OpenCV doesn't expose the samples of its subtractors, so those export their background image instead,
+# which then has to be applied a few times before the subtractor stops treating everything as foreground
+SEED_ITERATIONS = 5
+
+
+class BackgroundModel:
+    def __init__(self, detector: "MotionDetector"):
+        self.detector = detector
+
+    def apply(self, gray):
+        raise NotImplementedError
+
+    # returns an array that set_state can restore the model from, or None if there's nothing to save yet
+    def get_state(self):
+        return None
+
+    def set_state(self, state):
+        pass
+
+
+class SubtractorModel(BackgroundModel):
+    subtractor: cv2.BackgroundSubtractor
+
+    def apply(self, gray):
+        return self.subtractor.apply(gray)
+
+    def get_state(self):
+        return self.subtractor.getBackgroundImage()
+
+    def set_state(self, state):
+        for _ in range(SEED_ITERATIONS):
+            self.subtractor.apply(state)
+
+
+class KNNModel(SubtractorModel):
+    def __init__(self, detector: "MotionDetector"):
+        super().__init__(detector)
+        self.subtractor = cv2.createBackgroundSubtractorKNN(
+            history=detector.history,
+            dist2Threshold=detector.dist2_threshold,
+            detectShadows=False,
+        )
+
+
+class MOG2Model(SubtractorModel):
+    def __init__(self, detector: "MotionDetector"):
+        super().__init__(detector)
+        self.subtractor = cv2.createBackgroundSubtractorMOG2(
+            history=detector.history,
+            varThreshold=detector.var_threshold,
+            detectShadows=False,
+        )
+
+
+# keeps a single float image as the background, so it's a fraction of the cost of KNN / MOG2
+# it starts out as a cumulative average and switches to an exponential one once it's seen `history` frames
+class RunningAverageModel(BackgroundModel):
+    def __init__(self, detector: "MotionDetector"):
+        super().__init__(detector)
+        self.background = None
+        self.frame_count = 0
+        # reused across frames
+        self.background_u8 = None
+        self.diff = None
+
+    def apply(self, gray):
+        if self.background is None or self.background.shape != gray.shape:
+            self.background = gray.astype(np.float32)
+            self.background_u8 = gray.copy()
+            self.diff = np.empty_like(gray)
+            self.frame_count = 1
+            return np.zeros(gray.shape, np.uint8)
+
+        cv2.convertScaleAbs(self.background, dst=self.background_u8)
+        cv2.absdiff(gray, self.background_u8, dst=self.diff)
+        _, mask = cv2.threshold(
+            self.diff, self.detector.diff_threshold, 255, cv2.THRESH_BINARY
+        )
+        self.frame_count += 1
+        alpha = 1 / min(self.frame_count, max(self.detector.history, 1))
+        cv2.accumulateWeighted(gray, self.background, alpha)
+        return mask
+
+    def get_state(self):
+        return self.background
+
+    def set_state(self, state):
+        self.background = np.array(state, np.float32)
+        self.background_u8 = np.empty(state.shape, np.uint8)
+        self.diff = np.empty(state.shape, np.uint8)
+        # treat the restored background as fully warmed up
+        self.frame_count = max(self.detector.history, 1)
+
+
+# compares each frame to the previous one, so it only picks up flies while they're moving
+class FrameDiffModel(BackgroundModel):
+    def __init__(self, detector: "MotionDetector"):
+        super().__init__(detector)
+        self.last_frame = None
+
+    def apply(self, gray):
+        # small caveat: we drop the first frame
+        # if we use this and want to get really picky about timing, we'll want to wait before recording
+        if self.last_frame is None or self.last_frame.shape != gray.shape:
+            self.last_frame = gray.copy()
+            return np.zeros(gray.shape, np.uint8)
+
+        diff = cv2.absdiff(self.last_frame, gray)
+        _, mask = cv2.threshold(
+            diff, self.detector.diff_threshold, 255, cv2.THRESH_BINARY
+        )
+        # we use dilation, since we want to expand the area of motion for contour detection
+        mask = cv2.dilate(mask, None, iterations=2)
+        np.copyto(self.last_frame, gray)
+        return mask
+
+    def get_state(self):
+        return self.last_frame
+
+    def set_state(self, state):
+        self.last_frame = np.array(state, np.uint8)
+
+
+BACKGROUND_MODELS = {
+    "knn": KNNModel,
+    "mog2": MOG2Model,
+    "running_average": RunningAverageModel,
+    "diff": FrameDiffModel,
+}
+
+
+def make_background_model(method: str, detector: "MotionDetector"):
+    try:
+        model_class = BACKGROUND_MODELS[method]
+    except KeyError:
+        raise ValueError(
+            f"Invalid method: {method}. Valid methods are: {', '.join(BACKGROUND_MODELS)}."
+        )
+    return model_class(detector)
@@ -0,0 +1,208 @@
+import copy
+import hashlib
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from custom_types.grid import Grid
+from utils.frame import to_processing_resolution
+
+# this class saves the border and grid of each flybox a camera has seen to disk,
+# so that the scan can be skipped when the same camera is pointed at the same box again (e.g. after a reboot)
+
+# calibrations are stored per camera source, in a single JSON file (see get_calibration_file)
+# each one holds a fingerprint of the (cropped) frame the grid was detected on: a thumbnail of its edges (gradient magnitude)
+# a live frame is cropped to each saved border, and a calibration is only used if the fingerprints match,
+# which takes a few milliseconds and fails once the box or camera has moved by 2 pixels
+# edges are used rather than brightness, since they move out of place with the plate, while a blurry thumbnail barely changes
+# a restored grid isn't corrected by drift tracking (the live frame becomes the reference), so this has to be strict
+# the motion settings are saved along with it, since they're usually tuned for a specific box
+
+CALIBRATION_VERSION = 2
+FINGERPRINT_SIZE = (128, 128)
+# correlation between fingerprints, from -1 to 1
+# on the fixture video, frames of the same box are above 0.96 (flies move, so they're never 1),
+# a 1 pixel move is around 0.94, and 2 pixels or more drops below 0.9
+MIN_SIMILARITY = 0.93
+# calibrations kept per source, the one that was saved longest ago is dropped first
+MAX_CALIBRATIONS = 8
+# motion settings that belong to the machine rather than the box, so they aren't saved
+MACHINE_MOTION_SETTINGS = ["checkpoint_dir", "checkpoint_interval", "workers"]
+
+
+def get_calibration_file(directory: str, source: str | int | None):
+    key = hashlib.sha1(str(source).encode()).hexdigest()[:16]
+    return os.path.join(directory, f"calibration_{key}.json")
+
+
+# frame should already be cropped and at processing resolution, like the one the grid was detected on
+def make_fingerprint(frame):
+    if len(frame.shape) == 3:
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    frame = frame.astype(np.float32)
+    edges = cv2.magnitude(
+        cv2.Sobel(frame, cv2.CV_32F, 1, 0), cv2.Sobel(frame, cv2.CV_32F, 0, 1)
+    )
+    edges = cv2.resize(edges, FINGERPRINT_SIZE, interpolation=cv2.INTER_AREA)
+    # stretched to 0-255 to be stored as bytes, which doesn't change the correlation
+    return cv2.normalize(edges, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
+
+
+# normalized cross-correlation, so it doesn't change with brightness or contrast
+def compare_fingerprints(a, b):
+    a = np.asarray(a, np.float64) - np.mean(a)
+    b = np.asarray(b, np.float64) - np.mean(b)
+    norm = np.linalg.norm(a) * np.linalg.norm(b)
+    if norm == 0:
+        return 0.0
+    return float(np.sum(a * b) / norm)
+
+
+class Calibration:
+    def __init__(
+        self,
+        border: tuple,
+        grid: Grid,
+        fingerprint,
+        frame_shape: tuple,
+        processing_size: tuple | None,
+        motion: dict | None = None,
+        saved_at: float | None = None,
+    ):
+        self.border = tuple(int(value) for value in border)
+        self.grid = grid
+        self.fingerprint = np.asarray(fingerprint, np.uint8)
+        # shape of the raw frame, since the border is in its coordinates
+        self.frame_shape = tuple(int(value) for value in frame_shape[:2])
+        self.processing_size = (
+            tuple(processing_size) if processing_size is not None else None
+        )
+        self.motion = motion or {}
+        self.saved_at = saved_at if saved_at is not None else time.time()
+
+    # the cropped frame at processing resolution, as it was when the grid was detected
+    def crop(self, frame):
+        (x, y, w, h) = self.border
+        return to_processing_resolution(
+            frame[y : y + h, x : x + w], self.processing_size
+        )
+
+    # similarity of a raw frame to the one this was calibrated on, see compare_fingerprints
+    def compare(self, frame):
+        if tuple(frame.shape[:2]) != self.frame_shape:
+            return -1.0
+        return compare_fingerprints(
+            self.fingerprint, make_fingerprint(self.crop(frame))
+        )
+
+    def to_dict(self):
+        return {
+            "border": list(self.border),
+            "grid": self.grid.to_dict(),
+            "fingerprint": self.fingerprint.tolist(),
+            "frame_shape": list(self.frame_shape),
+            "processing_size": (
+                list(self.processing_size) if self.processing_size is not None else None
+            ),
+            "motion": self.motion,
+            "saved_at": self.saved_at,
+        }
+
+    @staticmethod
+    def from_dict(data: dict):
+        return Calibration(
+            data["border"],
+            Grid.from_dict(data["grid"]),
+            data["fingerprint"],
+            data["frame_shape"],
+            data["processing_size"],
+            motion=data.get("motion"),
+            saved_at=data.get("saved_at"),
+        )
+
+
+class CalibrationStore:
+    def __init__(self, directory: str, source: str | int | None):
+        self.directory = directory
+        self.source = source
+        self.file = get_calibration_file(directory, source)
+
+    # returns an empty list if there's nothing usable
+    def load(self):
+        try:
+            with open(self.file, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return []
+        if data.get("version") != CALIBRATION_VERSION or data.get("source") != str(
+            self.source
+        ):
+            return []
+        try:
+            return [Calibration.from_dict(item) for item in data["calibrations"]]
+        except (KeyError, TypeError, ValueError):
+            return []
+
+    def exists(self):
+        return os.path.exists(self.file)
+
+    # returns the calibration that matches a raw frame best, or None if none of them match
+    # processing_size has to be the same, since the grid is in processing coordinates
+    def find(self, frame, processing_size: tuple | None):
+        best = None
+        best_similarity = MIN_SIMILARITY
+        for calibration in self.load():
+            if calibration.processing_size != (
+                tuple(processing_size) if processing_size is not None else None
+            ):
+                continue
+            similarity = calibration.compare(frame)
+            if similarity >= best_similarity:
+                best = calibration
+                best_similarity = similarity
+        return best
+
+    # replaces any saved calibration of the same box
+    def save(self, calibration: Calibration):
+        calibrations = [calibration]
+        for saved in self.load():
+            if len(calibrations) >= MAX_CALIBRATIONS:
+                break
+            if (
+                saved.frame_shape == calibration.frame_shape
+                and compare_fingerprints(saved.fingerprint, calibration.fingerprint)
+                >= MIN_SIMILARITY
+            ):
+                continue
+            calibrations.append(saved)
+
+        os.makedirs(self.directory, exist_ok=True)
+        # write to a temporary file first, so that a crash mid-write doesn't lose every calibration
+        temp_file = f"{self.file}.tmp"
+        with open(temp_file, "w") as f:
+            json.dump(
+                {
+                    "version": CALIBRATION_VERSION,
+                    "source": str(self.source),
+                    "calibrations": [item.to_dict() for item in calibrations],
+                },
+                f,
+            )
+        os.replace(temp_file, self.file)
+
+
+# the motion settings to save with a calibration
+def get_motion_settings(settings):
+    return {
+        key: copy.deepcopy(value)
+        for key, value in (settings.get("motion") or {}).items()
+        if key not in MACHINE_MOTION_SETTINGS
+    }
+
+
+def apply_motion_settings(settings, motion: dict):
+    for key, value in motion.items():
+        settings.set(f"motion.{key}", value)
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import time
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from custom_types.grid import Grid
+
+if TYPE_CHECKING:
+    from detection.motion import MotionDetector
+
+# this class saves the state of a MotionDetector's background models to disk and restores it later,
+# so that restarting the app (or recovering from a crash) doesn't need a long warm-up period
+
+# each checkpoint is a directory with a metadata file and one .npy file per array
+# arrays are written and read as memory maps, so saving doesn't need an extra copy of the state
+# and loading only reads what's actually used
+# checkpoints are keyed by everything that changes the shape or meaning of the state (see make_checkpoint_key),
+# so a checkpoint is only ever restored for the same camera, border, grid and method
+
+CHECKPOINT_VERSION = 1
+METADATA_FILE = "checkpoint.json"
+
+
+def make_checkpoint_key(
+    source: str | int | None,
+    border: tuple | None,
+    grid: Grid,
+    processing_size: tuple[int, int] | None,
+    method: str,
+):
+    items = [
+        [round(value) for point in item.bounds for value in point]
+        for row in grid.rows
+        for item in row.items
+    ]
+    data = json.dumps(
+        {
+            "source": str(source),
+            "border": list(border) if border is not None else None,
+            "items": items,
+            "processing_size": processing_size,
+            "method": method,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha1(data.encode()).hexdigest()[:16]
+
+
+def write_array(path: str, array):
+    # write to a temporary file first, so that a crash mid-write doesn't leave a broken checkpoint
+    temp_path = f"{path}.tmp"
+    target = np.lib.format.open_memmap(
+        temp_path, mode="w+", dtype=array.dtype, shape=array.shape
+    )
+    target[...] = array
+    target.flush()
+    del target
+    os.replace(temp_path, path)
+
+
+class BackgroundCheckpoint:
+    def __init__(self, directory: str, key: str):
+        self.key = key
+        # each key gets its own directory, so setups don't overwrite each other
+        self.directory = os.path.join(directory, key)
+        self.metadata_file = os.path.join(self.directory, METADATA_FILE)
+
+    def array_path(self, name: str):
+        return os.path.join(self.directory, f"{name}.npy")
+
+    def save(self, detector: "MotionDetector"):
+        os.makedirs(self.directory, exist_ok=True)
+        bands = []
+        for i, band in enumerate(detector.bands):
+            state = band.bg_model.get_state() if band.bg_model is not None else None
+            if state is not None and state.size > 0:
+                write_array(self.array_path(f"band_{i}_state"), state)
+            else:
+                state = None
+            recent = list(band.recent_frames()) if band.recent is not None else []
+            if len(recent) > 0:
+                write_array(
+                    self.array_path(f"band_{i}_recent"),
+                    np.stack([frame for frame, _ in recent]),
+                )
+            bands.append(
+                {
+                    "state": state is not None,
+                    "recent_means": [float(mean) for _, mean in recent],
+                    "last_mean": (
+                        float(band.last_mean) if band.last_mean is not None else None
+                    ),
+                    "gain": band.gain,
+                }
+            )
+
+        # metadata goes last, since it's what makes the checkpoint valid
+        temp_file = f"{self.metadata_file}.tmp"
+        with open(temp_file, "w") as f:
+            json.dump(
+                {
+                    "version": CHECKPOINT_VERSION,
+                    "key": self.key,
+                    "method": detector.method,
+                    "frame_shape": list(detector.frame_shape),
+                    "saved_at": time.time(),
+                    "bands": bands,
+                },
+                f,
+            )
+        os.replace(temp_file, self.metadata_file)
+
+    # returns None if there's no usable checkpoint
+    def load(self):
+        try:
+            with open(self.metadata_file, "r") as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (
+            metadata.get("version") != CHECKPOINT_VERSION
+            or metadata.get("key") != self.key
+        ):
+            return None
+
+        try:
+            for i, band in enumerate(metadata["bands"]):
+                band["state"] = (
+                    np.load(self.array_path(f"band_{i}_state"), mmap_mode="r")
+                    if band["state"]
+                    else None
+                )
+                band["recent"] = (
+                    np.load(self.array_path(f"band_{i}_recent"), mmap_mode="r")
+                    if len(band["recent_means"]) > 0
+                    else None
+                )
+        except (OSError, ValueError, KeyError):
+            return None
+        return metadata
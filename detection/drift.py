@@ -0,0 +1,242 @@
+import math
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+
+import cv2
+import numpy as np
+
+from custom_types.grid import Grid
+
+# this class keeps track of how far the plate has drifted since the grid was detected
+# over a long recording, the box can creep by a few pixels (thermal expansion, a bumped table, a sagging mount),
+# and since wells are fixed rectangles, flies near the rim end up in the wrong well or in none at all
+
+# every `interval` seconds, a grayscale copy of the frame is compared to the reference frame (the one the grid was detected on)
+# the plate is split into quadrants, and each one is matched with cv2.phaseCorrelate, which finds sub-pixel shifts
+# in a couple of FFTs and barely notices flies, since they're a tiny part of each quadrant
+# the shifts of the quadrants are then fitted with a rotation and translation (see fit_rigid),
+# which is accurate for the fraction of a degree a plate can turn without being picked up
+# the comparison runs on a background thread, so the frame loop only pays for the grayscale copy
+
+# moves of up to max_shift pixels are applied to the grid in place (see Grid.transform and FrameHandler.move_grid)
+# anything larger usually means the box was moved on purpose, so it's flagged instead (see stats) and should be rescanned
+
+DEFAULT_INTERVAL = 300
+# moves smaller than this aren't worth rebuilding the wells for
+DEFAULT_MIN_SHIFT = 1
+DEFAULT_MAX_SHIFT = 10
+# peak of the phase correlation, from 0 to 1
+# the same plate is usually above 0.4, while unrelated frames (or the lights being off) are below 0.1
+MIN_RESPONSE = 0.2
+# quadrants per side
+REGIONS = 2
+IDENTITY = np.array([[1, 0, 0], [0, 1, 0]], np.float64)
+
+
+# (x1, y1, x2, y2) of each region the plate is split into, in frame coordinates
+def make_regions(grid: Grid, frame_shape):
+    ((x1, y1), (x2, y2)) = grid.bounds
+    (height, width) = frame_shape[:2]
+    x1 = max(0, math.floor(x1))
+    y1 = max(0, math.floor(y1))
+    x2 = min(width, math.ceil(x2))
+    y2 = min(height, math.ceil(y2))
+    if x2 - x1 < REGIONS or y2 - y1 < REGIONS:
+        raise ValueError("Grid is outside of the frame")
+    xs = np.linspace(x1, x2, REGIONS + 1).astype(int)
+    ys = np.linspace(y1, y2, REGIONS + 1).astype(int)
+    return [
+        (xs[i], ys[j], xs[i + 1], ys[j + 1])
+        for j in range(REGIONS)
+        for i in range(REGIONS)
+    ]
+
+
+# least squares rotation and translation that moves `points` onto `moved`, as a 2x3 affine matrix
+def fit_rigid(points, moved):
+    points = np.asarray(points, np.float64)
+    moved = np.asarray(moved, np.float64)
+    center = points.mean(axis=0)
+    moved_center = moved.mean(axis=0)
+    (a, b) = (points - center, moved - moved_center)
+    angle = math.atan2(
+        np.sum(a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0]),
+        np.sum(a[:, 0] * b[:, 0] + a[:, 1] * b[:, 1]),
+    )
+    rotation = np.array(
+        [[math.cos(angle), -math.sin(angle)], [math.sin(angle), math.cos(angle)]]
+    )
+    translation = moved_center - rotation @ center
+    return np.column_stack((rotation, translation))
+
+
+# the 2x3 affine matrix of applying `first`, then `second`
+def compose(second, first):
+    return (np.vstack((second, (0, 0, 1))) @ np.vstack((first, (0, 0, 1))))[:2]
+
+
+def invert(matrix):
+    return cv2.invertAffineTransform(np.asarray(matrix, np.float64))
+
+
+class DriftEstimator:
+    def __init__(self, reference, grid: Grid):
+        if len(reference.shape) == 3:
+            reference = cv2.cvtColor(reference, cv2.COLOR_BGR2GRAY)
+        self.frame_shape = reference.shape[:2]
+        self.regions = make_regions(grid, self.frame_shape)
+        # (reference patch, window) of each region, as float32 like phaseCorrelate wants
+        self.patches = []
+        for x1, y1, x2, y2 in self.regions:
+            patch = reference[y1:y2, x1:x2].astype(np.float32)
+            window = cv2.createHanningWindow((x2 - x1, y2 - y1), cv2.CV_32F)
+            self.patches.append((patch, window))
+
+    # returns (matrix, response), where matrix moves the reference frame onto `gray`,
+    # or None if too few regions matched to tell
+    def estimate(self, gray):
+        if gray.shape[:2] != self.frame_shape:
+            return None, 0.0
+        points = []
+        moved = []
+        responses = []
+        for (x1, y1, x2, y2), (patch, window) in zip(self.regions, self.patches):
+            ((dx, dy), response) = cv2.phaseCorrelate(
+                patch, gray[y1:y2, x1:x2].astype(np.float32), window
+            )
+            responses.append(response)
+            if response < MIN_RESPONSE:
+                continue
+            center = ((x1 + x2) / 2, (y1 + y2) / 2)
+            points.append(center)
+            moved.append((center[0] + dx, center[1] + dy))
+        response = float(np.median(responses))
+        if len(points) == 0:
+            return None, response
+        if len(points) == 1:
+            # a single region only tells us the translation
+            (dx, dy) = np.subtract(moved[0], points[0])
+            return np.array([[1, 0, dx], [0, 1, dy]], np.float64), response
+        return fit_rigid(points, moved), response
+
+
+class DriftTracker:
+    def __init__(
+        self,
+        reference,
+        grid: Grid,
+        interval=DEFAULT_INTERVAL,
+        min_shift=DEFAULT_MIN_SHIFT,
+        max_shift=DEFAULT_MAX_SHIFT,
+        clock: Callable[[], float] = time.monotonic,
+        executor: ThreadPoolExecutor | None = None,
+    ):
+        if interval <= 0:
+            raise ValueError("Interval must be positive")
+        self.estimator = DriftEstimator(reference, grid)
+        self.interval = interval
+        self.min_shift = min_shift
+        self.max_shift = max_shift
+        self.clock = clock
+        # without an executor, checks run on the calling thread, which keeps headless runs deterministic
+        self.executor = executor
+        self.future: Future | None = None
+        self.last_check_time = clock()
+
+        # corners of the plate when the grid was detected, used to measure how far a move shifts the wells
+        ((x1, y1), (x2, y2)) = grid.bounds
+        self.corners = np.array([(x1, y1, 1), (x2, y1, 1), (x1, y2, 1), (x2, y2, 1)])
+        # what has been applied to the grid so far, relative to the reference frame
+        self.applied = IDENTITY
+
+        # counters
+        self.checks = 0
+        self.failed_checks = 0
+        self.corrections = 0
+        # the latest estimate
+        self.shift = 0.0
+        self.angle = 0.0
+        self.response = 0.0
+        # whether the plate has moved by more than max_shift
+        self.moved = False
+
+    def stats(self):
+        return {
+            "checks": self.checks,
+            "failed": self.failed_checks,
+            "corrections": self.corrections,
+            "shift": self.shift,
+            "angle": self.angle,
+            "response": self.response,
+            "moved": self.moved,
+        }
+
+    # furthest any corner of the plate is from where it was, between two placements relative to the reference frame
+    def get_distance(self, matrix, start=IDENTITY):
+        moved = self.corners @ np.asarray(matrix).T - self.corners @ start.T
+        return float(np.max(np.hypot(moved[:, 0], moved[:, 1])))
+
+    # call on every frame, from the thread that owns the grid
+    # returns a 2x3 affine matrix to move the grid by (see Grid.transform), or None if it should stay where it is
+    def update(self, frame):
+        correction = None
+        if self.future is not None and self.future.done():
+            correction = self.handle_estimate(*self.future.result())
+            self.future = None
+        current_time = self.clock()
+        if self.future is None and current_time - self.last_check_time >= self.interval:
+            self.last_check_time = current_time
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            if self.executor is None:
+                correction = self.handle_estimate(*self.estimator.estimate(gray))
+            else:
+                self.future = self.executor.submit(self.estimator.estimate, gray)
+        return correction
+
+    def handle_estimate(self, matrix, response):
+        self.checks += 1
+        self.response = response
+        if matrix is None:
+            self.failed_checks += 1
+            return None
+        self.shift = self.get_distance(matrix)
+        self.angle = math.degrees(math.atan2(matrix[1, 0], matrix[0, 0]))
+        self.moved = self.shift > self.max_shift
+        if self.moved:
+            return None
+        if self.get_distance(matrix, self.applied) < self.min_shift:
+            return None
+        # the grid is already at `applied`, so it only needs to make up the difference
+        correction = compose(matrix, invert(self.applied))
+        self.applied = matrix
+        self.corrections += 1
+        return correction
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+
+def open_drift_tracker(
+    reference,
+    grid: Grid,
+    interval: float | None = None,
+    min_shift: float | None = None,
+    max_shift: float | None = None,
+    clock: Callable[[], float] = time.monotonic,
+    background=True,
+):
+    return DriftTracker(
+        reference,
+        grid,
+        interval=interval or DEFAULT_INTERVAL,
+        min_shift=min_shift if min_shift is not None else DEFAULT_MIN_SHIFT,
+        max_shift=max_shift if max_shift is not None else DEFAULT_MAX_SHIFT,
+        clock=clock,
+        executor=(
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="drift")
+            if background
+            else None
+        ),
+    )
@@ -1,16 +1,20 @@
+from typing import Callable
+
 import cv2
 import numpy as np
 
 from custom_types.grid import Grid, Item, Row
+from detection.lattice import fit_lattice
 
 # this class is responsible for detecting a grid of items
 # the basic algorithm is as follows:
-# 1. run a crude circle detection on the image
+# 1. run a crude circle detection on a downsampled copy of the image
 # 2. get the average radius of the detected circles
-# 3. update the average radius and keep running until it converges
-# 4. use the converged radius to run a more accurate circle detection
-# 5. convert each circle into a rectangular grid item
-# 6. sort the items into rows and columns
+# 3. if there weren't enough circles, try again on a less downsampled copy
+# 4. use the estimated radius to run a more accurate circle detection at full resolution
+# 5. fit a lattice to the circles to sort them into rows and columns (see detection/lattice.py),
+#    which also fills in wells that weren't detected and drops circles that aren't wells
+# 6. convert each circle into a rectangular grid item
 
 # ideally, this should have adjustable trackbars to allow for easy tuning,
 # but for now you can have fun playing around with the constants below
@@ -30,23 +34,17 @@ SHOULD_APPLY_BILATERAL_FILTER = False
 # for the initial detection, we want to be conservative
 INITIAL_DETECTION_PARAM_1 = 40
 INITIAL_DETECTION_PARAM_2 = 50
-# these values should be loose, since the initial detection is very crude
-INITIAL_DETECTION_LOWER_BOUND = 0.5
-INITIAL_DETECTION_UPPER_BOUND = 1.5
 
 # these are used as a starting point for the first detection phase
 # and don't influence the final detected circle count
 MAX_INITIAL_CIRCLES = 96 * 2
+# also the number of circles a downsampled copy needs to find for its estimate to be used
 MIN_INITIAL_CIRCLES = 12
-# give up after this many iterations
-MAX_ITERATIONS = 100
-# point at which we consider the average radius to have converged
-# lowering increases accuracy, but increases runtime
-# and also increases the chance of getting stuck in a local minimum
-CONVERGENCE_THRESHOLD = 0.0005
-# if our new average is much larger than the old average,
-# we most likely have a bad detection, so we use this to ignore it
-FILTER_AVERAGE_THRESHOLD = 1.05
+# the first detection phase runs on the image pyramid (see make_pyramid),
+# which is downsampled by half until its shorter side would drop below this size
+# the wide range of radii makes this phase slow at full resolution,
+# while the final detection only searches a narrow range and corrects the estimate anyway
+PYRAMID_MIN_SIZE = 240
 
 # for our final detection, we're using the estimated average radius
 # so we can keep these values tighter
@@ -64,15 +62,47 @@ FINAL_DETECTION_PARAM_2 = 20
 AVERAGE_RADIUS_ALPHA = 0.75
 
 
+# raised by detect when `cancelled` returns True, see GridDetector
+class DetectionCancelled(Exception):
+    pass
+
+
 class GridDetector:
-    def __init__(self, frame):
+    def __init__(
+        self,
+        frame,
+        final_param_1=FINAL_DETECTION_PARAM_1,
+        final_param_2=FINAL_DETECTION_PARAM_2,
+        progress: Callable[[int, int], None] | None = None,
+        cancelled: Callable[[], bool] | None = None,
+    ):
         self.frame = frame
+        # see FINAL_DETECTION_PARAM_1 and FINAL_DETECTION_PARAM_2, which pipeline/grid_search.py varies
+        self.final_param_1 = final_param_1
+        self.final_param_2 = final_param_2
+        # called with (steps done, total steps) as detection goes along, e.g. from a worker thread
+        self.progress = progress
+        # checked between steps, since a single HoughCircles call can't be interrupted
+        self.cancelled = cancelled
         if SHOULD_EQUALIZE_HISTOGRAM:
             self.clahe = cv2.createCLAHE(clipLimit=4, tileGridSize=(8, 8))
         self.processed_frame = None
         self.circles = None
         self.average_radius = None
+        self.lattice = None
         self.grid = None
+        # how well the circles fit the grid, see get_score
+        self.score = None
+        # one per pyramid level, plus the final detection and the lattice fit
+        self.steps = 0
+        self.steps_done = 0
+
+    def advance(self, steps=1):
+        if self.cancelled is not None and self.cancelled():
+            raise DetectionCancelled("Detection cancelled")
+        self.steps_done += steps
+        if self.progress is not None:
+            self.progress(self.steps_done, self.steps)
 
     def process_frame(self):
         # implementation detail: I tried using the average of the first X frames,
@@ -86,44 +116,45 @@ class GridDetector:
             processed_frame = cv2.bilateralFilter(processed_frame, 9, 75, 75)
         return processed_frame
 
+    # copies of the processed frame, each half the size of the one before it
+    def make_pyramid(self):
+        pyramid = [self.processed_frame]
+        while min(pyramid[-1].shape[0], pyramid[-1].shape[1]) // 2 >= PYRAMID_MIN_SIZE:
+            pyramid.append(cv2.pyrDown(pyramid[-1]))
+        return pyramid
+
     def get_approximate_average_radius(self):
-        max_radius = int(
-            min(self.frame.shape[0], self.frame.shape[1]) / MIN_INITIAL_CIRCLES
-        )
-        min_radius = int(
-            min(self.frame.shape[0], self.frame.shape[1]) / MAX_INITIAL_CIRCLES
-        )
-        min_dist = min_radius * 2
-        iterations = 0
-        last_average_radius = float("inf")
-        while iterations < MAX_ITERATIONS:
-            iterations += 1
+        pyramid = self.make_pyramid()
+        self.steps = len(pyramid) + 2
+        # coarse to fine: the smallest copy is usually enough,
+        # and larger ones are only used if it doesn't find enough circles
+        for level in reversed(range(len(pyramid))):
+            self.advance()
+            image = pyramid[level]
+            scale = 2**level
+            size = min(image.shape[0], image.shape[1])
+            max_radius = int(size / MIN_INITIAL_CIRCLES)
+            min_radius = max(int(size / MAX_INITIAL_CIRCLES), 1)
             detected = cv2.HoughCircles(
-                self.processed_frame,
+                image,
                 cv2.HOUGH_GRADIENT,
                 1,
-                min_dist,
+                min_radius * 2,
                 param1=INITIAL_DETECTION_PARAM_1,
-                param2=INITIAL_DETECTION_PARAM_2,
+                # smaller circles get fewer votes, so the threshold shrinks with them
+                param2=INITIAL_DETECTION_PARAM_2 / scale,
                 minRadius=min_radius,
                 maxRadius=max_radius,
             )
             if detected is None:
                 continue
-            average_radius = np.average(detected[0, :, 2])
-            if average_radius > last_average_radius * FILTER_AVERAGE_THRESHOLD:
+            if level > 0 and len(detected[0]) < MIN_INITIAL_CIRCLES:
                 continue
-            if abs(average_radius - last_average_radius) < CONVERGENCE_THRESHOLD:
-                break
+            # the finer levels are skipped
+            self.advance(level)
+            return np.average(detected[0, :, 2]) * scale
 
-            min_radius = int(average_radius * INITIAL_DETECTION_UPPER_BOUND)
-            max_radius = int(average_radius * INITIAL_DETECTION_LOWER_BOUND)
-            min_dist = min_radius * 2
-            last_average_radius = average_radius
-
-        if last_average_radius == float("inf"):
-            raise Exception("No circles detected")
-        return last_average_radius
+        raise Exception("No circles detected")
 
     def detect_circles(self):
         approximate_average_radius = self.get_approximate_average_radius()
@@ -135,8 +166,8 @@ class GridDetector:
             cv2.HOUGH_GRADIENT,
             1,
             min_dist,
-            param1=FINAL_DETECTION_PARAM_1,
-            param2=FINAL_DETECTION_PARAM_2,
+            param1=self.final_param_1,
+            param2=self.final_param_2,
             minRadius=min_radius,
             maxRadius=max_radius,
         )
@@ -148,56 +179,62 @@ class GridDetector:
     def detect(self):
         self.processed_frame = self.process_frame()
         self.circles = self.detect_circles()
-        self.average_radius = np.average(self.circles[:, 2])
-
-        grid = [[]]
-        for x, y, radius in sorted(self.circles, key=lambda circle: circle[1]):
-            radius = (radius * (1 - AVERAGE_RADIUS_ALPHA)) + (
-                self.average_radius * AVERAGE_RADIUS_ALPHA
-            )
-            item = (
-                (
-                    x - radius,
-                    y - radius,
-                ),
-                (
-                    x + radius,
-                    y + radius,
-                ),
-            )
-            row = grid[-1]
-            # case 1: no items in row yet, so we can't make a comparison
-            if len(row) == 0:
-                row.append(item)
-                continue
-            # case 2: item is too far from last item on the y axis, so we're in a new row
-            last_item = row[-1]
-            distance = item[1][1] - last_item[1][1]
-            is_in_new_row = distance > self.average_radius
-            if is_in_new_row:
-                grid.append([item])
-                continue
-            # case 3: item is close enough to last item, so we're still in the same row
-            row.append(item)
-
-        # sort each row by x coordinate
-        for row in grid:
-            row.sort(key=lambda item: item[0][0])
-
-        # convert each raw element into a class instance
-        total_rows = len(grid)
-        for row_index, row in enumerate(grid):
-            for col_index, item in enumerate(row):
+        self.advance()
+        (self.lattice, coords) = fit_lattice(
+            self.circles[:, :2], np.average(self.circles[:, 2])
+        )
+        is_on_lattice = coords[:, 0] >= 0
+        self.average_radius = np.average(self.circles[is_on_lattice, 2])
+        self.score = self.get_score(is_on_lattice)
+
+        circles = {
+            (row, col): circle
+            for circle, (row, col) in zip(self.circles, coords)
+            if row >= 0
+        }
+        grid = []
+        for row_index in range(self.lattice.rows):
+            row = []
+            for col_index in range(self.lattice.cols):
+                if (row_index, col_index) in circles:
+                    (x, y, radius) = circles[(row_index, col_index)]
+                else:
+                    # the well wasn't detected, so it goes where the lattice says it should be
+                    (x, y) = self.lattice.get_center(row_index, col_index)
+                    radius = self.average_radius
+                radius = (radius * (1 - AVERAGE_RADIUS_ALPHA)) + (
+                    self.average_radius * AVERAGE_RADIUS_ALPHA
+                )
                 # this is the index of each well in the output,
                 # meaning we go down each column, then over to the next row
-                index = col_index * total_rows + row_index
-                row[col_index] = Item(
-                    item,
-                    index,
-                    (row_index, col_index),
+                index = col_index * self.lattice.rows + row_index
+                row.append(
+                    Item(
+                        (
+                            (
+                                x - radius,
+                                y - radius,
+                            ),
+                            (
+                                x + radius,
+                                y + radius,
+                            ),
+                        ),
+                        index,
+                        (row_index, col_index),
+                    )
                 )
-            grid[row_index] = Row(row)
+            grid.append(Row(row))
         grid = Grid(grid)
 
         self.grid = grid
+        self.advance()
         return grid
+
+    # circles that fit the lattice, minus wells that had to be filled in and circles that were dropped
+    # so a grid where every well was found, and nothing else, scores the number of wells
+    def get_score(self, is_on_lattice):
+        found = np.count_nonzero(is_on_lattice)
+        missing = self.lattice.rows * self.lattice.cols - found
+        dropped = len(is_on_lattice) - found
+        return int(found - missing - dropped)
@@ -0,0 +1,156 @@
+import numpy as np
+
+# this class models the wells of a plate as a regular lattice,
+# where well (row, col) is centered at origin + col * col_step + row * row_step
+# the steps are vectors, so a rotated (or slightly skewed) plate is handled the same way as a straight one
+
+# fitting it to detected circles (see fit_lattice) gives every circle a row and column,
+# rejects circles that don't sit on the lattice, and tells us where the circles that weren't detected should be
+# the basic algorithm is as follows:
+# 1. estimate the steps from the median vector between each circle and its nearest neighbors (see get_steps)
+# 2. try every circle as the origin, and keep the one that puts the most circles on the lattice
+# 3. refine the origin and steps with least squares on the circles that are on the lattice
+# 4. drop outer rows and columns that are mostly empty, since they're usually made of spurious circles
+
+# a circle is on the lattice if it's within this fraction of a step from its lattice point (on both axes)
+LATTICE_TOLERANCE = 0.25
+# rounds of least squares refinement
+REFINE_ITERATIONS = 2
+# outer rows and columns are dropped while less than this fraction of their circles were detected
+MIN_EDGE_SUPPORT = 0.5
+
+
+class Lattice:
+    def __init__(self, origin, col_step, row_step, rows: int, cols: int):
+        self.origin = np.asarray(origin, np.float64)
+        self.col_step = np.asarray(col_step, np.float64)
+        self.row_step = np.asarray(row_step, np.float64)
+        self.rows = rows
+        self.cols = cols
+
+    @property
+    def dimensions(self):
+        return (self.rows, self.cols)
+
+    def get_center(self, row, col):
+        return self.origin + col * self.col_step + row * self.row_step
+
+    # (col, row) lattice coordinates of each (x, y) point, as floats
+    def get_coords(self, points):
+        basis = np.column_stack((self.col_step, self.row_step))
+        points = np.asarray(points, np.float64).reshape(-1, 2)
+        return (points - self.origin) @ np.linalg.inv(basis).T
+
+
+# median step to the nearest neighbor to the right (col_step) and below (row_step)
+# either one is None if no circle has a neighbor in that direction
+def get_steps(centers, radius: float):
+    vectors = centers[np.newaxis, :, :] - centers[:, np.newaxis, :]
+    (dx, dy) = (vectors[..., 0], vectors[..., 1])
+    distances = np.hypot(dx, dy)
+    # ignores each circle itself, and duplicates of it
+    is_neighbor = distances >= radius
+    steps = []
+    for cone in ((dx > 0) & (np.abs(dy) < dx), (dy > 0) & (np.abs(dx) < dy)):
+        cone_distances = np.where(cone & is_neighbor, distances, np.inf)
+        nearest = np.argmin(cone_distances, axis=1)
+        has_neighbor = np.isfinite(cone_distances[np.arange(len(centers)), nearest])
+        if not np.any(has_neighbor):
+            steps.append(None)
+            continue
+        nearest_vectors = vectors[np.arange(len(centers)), nearest][has_neighbor]
+        steps.append(np.median(nearest_vectors, axis=0))
+    return steps
+
+
+# returns (col, row) coordinates of each point, and whether it's on the lattice
+def snap(coords):
+    rounded = np.round(coords)
+    is_inlier = np.all(np.abs(coords - rounded) < LATTICE_TOLERANCE, axis=-1)
+    return rounded.astype(np.int64), is_inlier
+
+
+# fits a lattice to circle centers, where radius is the average radius of the circles
+# returns the lattice and the (row, col) of each circle, which is (-1, -1) if it was rejected
+def fit_lattice(centers, radius: float):
+    centers = np.asarray(centers, np.float64).reshape(-1, 2)
+    if len(centers) == 0:
+        raise Exception("No circles detected")
+
+    (col_step, row_step) = get_steps(centers, radius)
+    # a single row or column only tells us one step, so the other one is assumed to be perpendicular
+    if col_step is None and row_step is None:
+        col_step = np.array([radius * 2, 0.0])
+    if col_step is None:
+        col_step = np.array([row_step[1], -row_step[0]])
+    if row_step is None:
+        row_step = np.array([-col_step[1], col_step[0]])
+    basis = np.column_stack((col_step, row_step))
+    if abs(np.linalg.det(basis)) < radius**2:
+        raise Exception("Unable to fit a grid to the detected circles")
+
+    # coordinates of every circle relative to every other circle
+    inverse = np.linalg.inv(basis)
+    relative = (centers[np.newaxis, :, :] - centers[:, np.newaxis, :]) @ inverse.T
+    (_, is_inlier) = snap(relative)
+    # ties (e.g. when every circle is on the lattice) go to the origin with the smallest error
+    errors = np.where(
+        is_inlier, np.abs(relative - np.round(relative)).sum(axis=-1), 0
+    ).sum(axis=1)
+    counts = is_inlier.sum(axis=1)
+    best = np.lexsort((errors, -counts))[0]
+    lattice = Lattice(centers[best], col_step, row_step, 1, 1)
+
+    for _ in range(REFINE_ITERATIONS):
+        (coords, is_inlier) = snap(lattice.get_coords(centers))
+        design = np.column_stack(
+            (np.ones(np.count_nonzero(is_inlier)), coords[is_inlier])
+        )
+        (solution, _, rank, _) = np.linalg.lstsq(design, centers[is_inlier], rcond=None)
+        # a single row or column can't be refined, since one of the steps is unknown
+        if rank < 3:
+            break
+        lattice = Lattice(solution[0], solution[1], solution[2], 1, 1)
+
+    lattice_coords = lattice.get_coords(centers)
+    (coords, is_inlier) = snap(lattice_coords)
+    errors = np.abs(lattice_coords - coords).sum(axis=1)
+    # only the closest circle is kept for each lattice point
+    for i in np.argsort(errors):
+        if not is_inlier[i]:
+            continue
+        duplicates = is_inlier & np.all(coords == coords[i], axis=1)
+        duplicates[i] = False
+        is_inlier[duplicates] = False
+
+    return trim_lattice(lattice, coords, is_inlier)
+
+
+def trim_lattice(lattice: Lattice, coords, is_inlier):
+    while True:
+        (min_col, min_row) = coords[is_inlier].min(axis=0)
+        (max_col, max_row) = coords[is_inlier].max(axis=0)
+        (cols, rows) = (max_col - min_col + 1, max_row - min_row + 1)
+        # (support, axis, value) for each edge, where axis 0 is columns and 1 is rows
+        edges = []
+        if cols > 1:
+            for col in (min_col, max_col):
+                count = np.count_nonzero(is_inlier & (coords[:, 0] == col))
+                edges.append((count / rows, 0, col))
+        if rows > 1:
+            for row in (min_row, max_row):
+                count = np.count_nonzero(is_inlier & (coords[:, 1] == row))
+                edges.append((count / cols, 1, row))
+        if not edges:
+            break
+        (support, axis, value) = min(edges)
+        if support >= MIN_EDGE_SUPPORT:
+            break
+        is_inlier &= coords[:, axis] != value
+
+    # moved so the first well is (0, 0)
+    origin = lattice.get_center(min_row, min_col)
+    lattice = Lattice(origin, lattice.col_step, lattice.row_step, int(rows), int(cols))
+    row_col = np.column_stack((coords[:, 1] - min_row, coords[:, 0] - min_col))
+    row_col[~is_inlier] = -1
+    return lattice, row_col
@@ -0,0 +1,42 @@
+import numpy as np
+
+# this class combines several frames into one by taking the median of each pixel over time,
+# so that anything that's only there for a few frames (a fly sitting on the rim of a well, sensor noise)
+# disappears from the frame that's used for border and grid detection
+
+# frames are copied into a fixed ring of buffers that's allocated from the first frame,
+# so memory stays bounded no matter how many frames are added, and only the most recent ones are used
+# np.partition only sorts each pixel as far as it needs to find the middle value, which is faster than np.median
+# with an even number of frames, the upper of the two middle values is used, so the result is still a real pixel value
+
+
+class MedianFrame:
+    def __init__(self, size: int):
+        if size < 1:
+            raise ValueError("Size must be at least 1")
+        self.size = size
+        self.frames = None
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    @property
+    def is_full(self):
+        return self.count >= self.size
+
+    # the frame is copied, so the caller can reuse it afterwards (e.g. a capture buffer)
+    def add(self, frame):
+        if self.frames is None or self.frames.shape[1:] != frame.shape:
+            # also starts over if the resolution changes
+            self.frames = np.empty((self.size,) + frame.shape, frame.dtype)
+            self.count = 0
+        self.frames[self.count % self.size] = frame
+        self.count += 1
+
+    def get(self):
+        count = len(self)
+        if count == 0:
+            raise Exception("No frames to combine")
+        middle = count // 2
+        return np.partition(self.frames[:count], middle, axis=0)[middle]
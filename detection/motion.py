@@ -1,97 +1,434 @@
 import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
 
 import cv2
 import numpy as np
 
+from custom_types.blobs import Blobs
+from custom_types.grid import Grid
+from detection.backgrounds import BACKGROUND_MODELS, make_background_model
+from detection.checkpoint import BackgroundCheckpoint
+from detection.wells import WellTiles
 from utils.app_settings import AppSettings
 
+DEFAULT_METHOD = "knn"
+
+# what to do with the background model when the lighting changes (see motion.bg_reinit_mode):
+# "reset": throw the model away and start from scratch, which takes a while to settle
+# "gain": keep the model and scale incoming frames so their brightness matches what it has learned
+# "reseed": start a new model, but seed it with recent frames scaled to the new brightness
+RESET = "reset"
+GAIN = "gain"
+RESEED = "reseed"
+REINIT_MODES = [RESET, GAIN, RESEED]
+# same as default_settings.json, for settings files that don't have it
+# the other modes are opt-in until they've been validated on real recordings
+DEFAULT_REINIT_MODE = RESET
+# past this, scaling amplifies too much noise (e.g. lights off), so "gain" falls back to reseeding
+MAX_GAIN = 2
+
+# when a grid is given and mask_wells is on, the detector splits its rows into bands (one per worker),
+# each with its own background model, and runs them concurrently
+# the whole frame isn't split, since blobs crossing the edge of a band would be cut in two,
+# so without packed wells there's a single band and motion.workers has no effect
+# OpenCV releases the GIL, so this scales with the number of cores
+# each band always runs on the same thread, since OpenCV's RNG (used by the KNN subtractor) is per-thread
+# with a seed, even a single band gets a thread of its own, so that seeding doesn't touch the caller's RNG
+
+
+class MotionBand:
+    def __init__(
+        self,
+        wells: WellTiles | None = None,
+        executor: ThreadPoolExecutor | None = None,
+    ):
+        # without wells, the band covers the whole frame
+        self.wells = wells
+        # without an executor, the band runs on the calling thread
+        self.executor = executor
+        self.bg_model = None
+        self.last_mean = None
+        self.last_init_time = float("-inf")
+        # applied to frames before they reach the model, see GAIN above
+        self.gain = 1.0
+        self.scaled = None
+        # ring of recent grayscale frames and their means, used to reseed the model
+        self.recent = None
+        self.recent_means = []
+        self.recent_index = 0
+
+    def remember(self, gray, mean, size: int):
+        if size <= 0:
+            return
+        if self.recent is None or self.recent.shape[1:] != gray.shape:
+            self.recent = np.empty((size,) + gray.shape, np.uint8)
+            self.recent_means = []
+            self.recent_index = 0
+        np.copyto(self.recent[self.recent_index], gray)
+        if len(self.recent_means) < size:
+            self.recent_means.append(mean)
+        else:
+            self.recent_means[self.recent_index] = mean
+        self.recent_index = (self.recent_index + 1) % size
+
+    # oldest first, and none unless frames are remembered (see GAIN and RESEED above)
+    def recent_frames(self):
+        if self.recent is None:
+            return
+        count = len(self.recent_means)
+        start = self.recent_index if count == len(self.recent) else 0
+        for i in range(count):
+            index = (start + i) % len(self.recent)
+            yield self.recent[index], self.recent_means[index]
+
+    def apply_gain(self, gray):
+        if self.gain == 1:
+            return gray
+        if self.scaled is None or self.scaled.shape != gray.shape:
+            self.scaled = np.empty_like(gray)
+        return cv2.convertScaleAbs(gray, dst=self.scaled, alpha=self.gain)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
 
 class MotionDetector:
-    def make_bg_subtractor(self):
-        current_time = time.time()
-        # only make a new subtractor if we haven't done so recently
-        # this improves performance and also helps the subtractor react faster to changes
-        if current_time - self.last_init_time < self.bg_reinit_throttle:
-            return self.bg_subtractor
-
-        self.last_init_time = current_time
-        return cv2.createBackgroundSubtractorKNN(
-            history=self.history,
-            dist2Threshold=self.dist2_threshold,
-            detectShadows=False,
-        )
+    def make_bg_model(self, band: MotionBand):
+        current_time = self.clock()
+        # only make a new model if we haven't done so recently
+        # this improves performance and also helps the model react faster to changes
+        if (
+            band.bg_model is not None
+            and current_time - band.last_init_time < self.bg_reinit_throttle
+        ):
+            return band.bg_model
 
-    def __init__(self, settings: AppSettings):
+        band.last_init_time = current_time
+        band.gain = 1.0
+        return make_background_model(self.method, self)
+
+    def reseed_bg_model(self, band: MotionBand, mean):
+        bg_model = self.make_bg_model(band)
+        if bg_model is band.bg_model or band.recent is None:
+            return bg_model
+        # feed recent frames to the new model as if they had been captured under the new lighting
+        scaled = np.empty_like(band.recent[0])
+        for frame, frame_mean in band.recent_frames():
+            alpha = mean / frame_mean if frame_mean > 0 else 1
+            bg_model.apply(cv2.convertScaleAbs(frame, dst=scaled, alpha=alpha))
+        return bg_model
+
+    def restore_checkpoint(self):
+        saved = self.checkpoint.load()
+        if (
+            saved is None
+            or saved["method"] != self.method
+            or tuple(saved["frame_shape"]) != self.frame_shape
+            or len(saved["bands"]) != len(self.bands)
+        ):
+            return False
+        try:
+            for band, saved_band in zip(self.bands, saved["bands"]):
+                band.bg_model = make_background_model(self.method, self)
+                band.last_init_time = self.clock()
+                band.last_mean = saved_band["last_mean"]
+                band.gain = saved_band["gain"]
+                if saved_band["state"] is not None:
+                    band.bg_model.set_state(saved_band["state"])
+                if saved_band["recent"] is None:
+                    continue
+                for frame, mean in zip(
+                    saved_band["recent"], saved_band["recent_means"]
+                ):
+                    band.remember(frame, mean, self.bg_reseed_frames)
+                    band.bg_model.apply(band.apply_gain(frame))
+        except (cv2.error, ValueError):
+            # the saved state doesn't fit the current wells, so start from scratch
+            for band in self.bands:
+                band.bg_model = None
+            return False
+        return True
+
+    def save_checkpoint(self):
+        if self.checkpoint is None or self.frame_shape is None:
+            return
+        self.last_checkpoint_time = self.clock()
+        try:
+            self.checkpoint.save(self)
+            self.checkpoints_saved += 1
+        except OSError as e:
+            # not worth stopping a recording over, so it's only counted and shown in the UI
+            self.checkpoints_failed += 1
+            self.checkpoint_error = e
+
+    def update_checkpoint(self):
+        current_time = self.clock()
+        if self.last_checkpoint_time is None:
+            self.last_checkpoint_time = current_time
+        elif current_time - self.last_checkpoint_time >= self.checkpoint_interval:
+            self.save_checkpoint()
+
+    def reinit_bg_model(self, band: MotionBand, mean):
+        if self.bg_reinit_mode == GAIN and mean > 0:
+            # keep the brightness the model sees where it was before the change
+            gain = band.gain * band.last_mean / mean
+            if 1 / MAX_GAIN <= gain <= MAX_GAIN:
+                band.gain = gain
+                return band.bg_model
+        if self.bg_reinit_mode == RESET:
+            return self.make_bg_model(band)
+        return self.reseed_bg_model(band, mean)
+
+    def __init__(
+        self,
+        settings: AppSettings,
+        clock: Callable[[], float] = time.monotonic,
+        grid: Grid | None = None,
+        seed: int | None = None,
+        checkpoint: BackgroundCheckpoint | None = None,
+    ):
         self.settings = settings
-        self.last_mean = None
-        self.last_init_time = 0
 
-        # keep these hardcoded for now
-        self.method = "BG_SUBTRACTOR"
+        # when a grid is given, background subtraction only runs on the wells
+        self.grid = grid
+        # headless runs pass in the video time so that reinitialization is deterministic
+        self.clock = clock
+        # seeds the RNG of worker threads, see MotionBand
+        self.seed = seed
+        # when given, background models are restored from it on the first frame and saved to it periodically
+        self.checkpoint = checkpoint
+        self.checkpoint_interval = self.settings.get("motion.checkpoint_interval") or 0
+        self.last_checkpoint_time = None
+        self.checkpoints_saved = 0
+        self.checkpoints_failed = 0
+        # the last error saving a checkpoint
+        self.checkpoint_error = None
+
+        # see detection/backgrounds.py for available methods
+        self.method = self.settings.get("motion.method") or DEFAULT_METHOD
+        if self.method not in BACKGROUND_MODELS:
+            raise ValueError(f"Invalid method: {self.method}")
+        # keep this hardcoded for now
         self.operation = cv2.MORPH_CLOSE
 
         self.kernel_size = self.settings.get("motion.kernel_size")
         self.blur_size = self.settings.get("motion.blur_size")
         self.history = self.settings.get("motion.history")
         self.dist2_threshold = self.settings.get("motion.dist2_threshold")
+        self.var_threshold = self.settings.get("motion.var_threshold")
         self.diff_threshold = self.settings.get("motion.diff_threshold")
         self.bg_reinit_threshold = self.settings.get("motion.bg_reinit_threshold")
         self.bg_reinit_throttle = self.settings.get("motion.bg_reinit_throttle")
+        self.bg_reinit_mode = (
+            self.settings.get("motion.bg_reinit_mode") or DEFAULT_REINIT_MODE
+        )
+        if self.bg_reinit_mode not in REINIT_MODES:
+            raise ValueError(f"Invalid reinit mode: {self.bg_reinit_mode}")
+        self.bg_reseed_frames = self.settings.get("motion.bg_reseed_frames") or 0
+        self.mask_wells = self.settings.get("motion.mask_wells")
+        self.workers = self.settings.get("motion.workers") or 1
+        if self.workers > 1 and (self.grid is None or not self.mask_wells):
+            warnings.warn(
+                "motion.workers has no effect without motion.mask_wells and a grid"
+            )
 
         self.kernel = np.ones((self.kernel_size, self.kernel_size), np.uint8)
-        self.bg_subtractor = self.make_bg_subtractor()
+        # built on the first frame, since wells are clipped to the frame size
+        self.frame_shape = None
+        self.bands = [MotionBand()]
+
+    def make_bands(self, frame_shape):
+        if self.grid is None or not self.mask_wells:
+            return self.add_executors([MotionBand()])
+        rows = list(self.grid.rows)
+        count = max(1, min(self.workers, len(rows)))
+        bands = []
+        for i in range(count):
+            band_rows = rows[i * len(rows) // count : (i + 1) * len(rows) // count]
+            wells = WellTiles(Grid(band_rows), frame_shape)
+            if len(wells) > 0:
+                bands.append(MotionBand(wells))
+        if len(bands) == 0:
+            bands = [MotionBand()]
+        return self.add_executors(bands)
+
+    def add_executors(self, bands: list[MotionBand]):
+        # with a single band, there's nothing to parallelize, unless it has to run on a seeded thread
+        if len(bands) > 1 or self.seed is not None:
+            for band in bands:
+                band.executor = self.make_executor()
+        return bands
 
-    def get_bg_mask(self, gray):
-        mask = self.bg_subtractor.apply(gray)
+    def make_executor(self):
+        if self.seed is None:
+            return ThreadPoolExecutor(max_workers=1)
+        return ThreadPoolExecutor(
+            max_workers=1, initializer=cv2.setRNGSeed, initargs=(self.seed,)
+        )
+
+    def get_bands(self, frame):
+        if self.frame_shape != frame.shape[:2]:
+            self.close_bands()
+            self.frame_shape = frame.shape[:2]
+            self.bands = self.make_bands(frame.shape)
+            if self.checkpoint is not None:
+                self.restore_checkpoint()
+        return self.bands
+
+    # rebuilds the bands after the grid has moved by a 2x3 affine matrix (see detection/drift.py)
+    # each background model is moved along with the wells, so it doesn't have to warm up again,
+    # and whatever the old wells didn't cover is filled in from the current frame
+    def move_grid(self, matrix, frame):
+        if self.frame_shape is None:
+            # nothing has been built yet
+            return
+        (height, width) = self.frame_shape
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        old_bands = self.bands
+        self.bands = self.make_bands(frame.shape)
+        if len(self.bands) == len(old_bands):
+            for old_band, band in zip(old_bands, self.bands):
+                band.last_mean = old_band.last_mean
+                band.gain = old_band.gain
+                state = None
+                if old_band.bg_model is not None:
+                    state = old_band.bg_model.get_state()
+                if state is None or state.size == 0:
+                    continue
+                if old_band.wells is not None:
+                    # moved back to where the old wells were, so it lines up with the state
+                    background = cv2.warpAffine(
+                        band.apply_gain(gray).astype(state.dtype),
+                        cv2.invertAffineTransform(matrix),
+                        (width, height),
+                        borderMode=cv2.BORDER_REPLICATE,
+                    )
+                    state = old_band.wells.unpack(state, out=background)
+                state = cv2.warpAffine(
+                    state, matrix, (width, height), borderMode=cv2.BORDER_REPLICATE
+                )
+                if band.wells is not None:
+                    state = band.wells.pack(state)
+                band.bg_model = make_background_model(self.method, self)
+                band.last_init_time = self.clock()
+                band.bg_model.set_state(state)
+        for band in old_bands:
+            band.close()
+
+    # (x1, y1, x2, y2) of the part of the mask that morphology needs to run on
+    # the margin makes sure that it behaves the same as if it ran on the whole frame
+    def get_mask_region(self, wells: WellTiles, mask):
+        margin = self.kernel_size + max(self.blur_size, 0)
+        (x1, y1, x2, y2) = wells.bounds
+        (height, width) = mask.shape[:2]
+        return (
+            max(0, x1 - margin),
+            max(0, y1 - margin),
+            min(width, x2 + margin),
+            min(height, y2 + margin),
+        )
+
+    def get_bg_mask(self, gray, band: MotionBand):
+        mask = band.bg_model.apply(gray)
+        offset = (0, 0)
+        if band.wells is not None:
+            mask = band.wells.unpack(mask)
+            (x1, y1, x2, y2) = self.get_mask_region(band.wells, mask)
+            mask = mask[y1:y2, x1:x2]
+            offset = (x1, y1)
         mask = cv2.morphologyEx(mask, self.operation, self.kernel, iterations=1)
         if self.blur_size > 0:
             mask = cv2.medianBlur(mask, self.blur_size)
-        return mask
+        return mask, offset
 
-    def find_contours(self, frame):
+    def find_contours(self, frame, offset=(0, 0)):
         (contours, _) = cv2.findContours(
-            frame, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
+            frame, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=offset
         )
         return contours
 
-    def detect_with_bg_subtractor(self, frame):
+    # same as find_contours, but returns centroids, areas and bounds for all blobs as arrays in a single call
+    def find_blobs(self, frame, offset=(0, 0)):
+        (_, _, stats, centroids) = cv2.connectedComponentsWithStats(
+            frame, connectivity=8
+        )
+        # label 0 is the background
+        bounds = stats[1:, :4].copy()
+        bounds[:, :2] += offset
+        # components are labeled top to bottom, but findContours returns them roughly bottom to top
+        # FrameHandler is sensitive to order when a well has more than one blob, so match findContours
+        return Blobs(
+            (centroids[1:] + offset)[::-1],
+            stats[1:, cv2.CC_STAT_AREA][::-1],
+            bounds[::-1],
+        )
+
+    def detect_band(self, frame, band: MotionBand, extract: Callable):
+        if band.wells is not None:
+            frame = band.wells.pack(frame)
         gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        mean = np.mean(gray)
-        if abs(mean - (self.last_mean or mean)) > self.bg_reinit_threshold:
-            # reinitialize the bg subtractor on lighting changes
-            self.bg_subtractor = self.make_bg_subtractor()
+        # with mask_wells, this is the mean of the wells only, see detection/wells.py
+        mean = band.wells.mean(gray) if band.wells is not None else np.mean(gray)
+        if band.bg_model is None:
+            band.bg_model = self.make_bg_model(band)
+        elif (
+            band.last_mean is not None
+            and abs(mean - band.last_mean) > self.bg_reinit_threshold
+        ):
+            # reinitialize the bg model on lighting changes
+            band.bg_model = self.reinit_bg_model(band, mean)
             # it's tempting to want to avoid contour detection altogether in this case,
             # but for whatever reason it leads to more false positives once detection resumes
-        mask = self.get_bg_mask(gray)
-        contours = self.find_contours(mask)
-        self.last_mean = mean
+        if self.bg_reinit_mode == RESEED or self.bg_reinit_mode == GAIN:
+            band.remember(gray, mean, self.bg_reseed_frames)
+        (mask, offset) = self.get_bg_mask(band.apply_gain(gray), band)
+        results = extract(mask, offset)
+        band.last_mean = mean
+        return results
+
+    # returns the results of `extract` for each band
+    def detect_bands(self, frame, extract: Callable):
+        bands = self.get_bands(frame)
+        if bands[0].executor is None:
+            results = [self.detect_band(frame, bands[0], extract)]
+        else:
+            futures = [
+                band.executor.submit(self.detect_band, frame, band, extract)
+                for band in bands
+            ]
+            results = [future.result() for future in futures]
+        if self.checkpoint is not None:
+            self.update_checkpoint()
+        return results
+
+    def detect_with_bg_subtractor(self, frame):
+        contours = []
+        for band_contours in self.detect_bands(frame, self.find_contours):
+            contours.extend(band_contours)
         return contours
 
-    def detect_with_diff(self, frame):
-        # NOTE: not currently functioning
-        # small caveat: we drop the first frame
-        # if we use this and want to get really picky about timing, we'll want to wait before recording
-        if self.last_frame is None:
-            self.last_frame = frame.copy()
-            return []
+    def detect(self, frame):
+        return self.detect_with_bg_subtractor(frame)
 
-        grayA = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        grayB = cv2.cvtColor(self.last_frame, cv2.COLOR_BGR2GRAY)
-        diff = cv2.absdiff(grayB, grayA)
-        _, thresh = cv2.threshold(diff, self.diff_threshold, 255, cv2.THRESH_BINARY)
-        # we use dilation instead of closing, since we want to expand the area of motion for contour detection
-        thresh = cv2.dilate(thresh, iterations=2)
+    def detect_blobs(self, frame):
+        return Blobs.concat(self.detect_bands(frame, self.find_blobs))
 
-        self.last_frame = frame.copy()
-        return self.find_contours(thresh)
+    def close_bands(self):
+        for band in self.bands:
+            band.close()
 
-    def detect(self, frame):
-        if self.method == "BG_SUBTRACTOR":
-            return self.detect_with_bg_subtractor(frame)
-        elif self.method == "DIFF":
-            raise NotImplementedError("DIFF method not currently implemented")
-        else:
-            raise ValueError(f"Invalid method: {self.method}")
+    def stats(self):
+        return {
+            "checkpoints": self.checkpoints_saved,
+            "checkpoints_failed": self.checkpoints_failed,
+        }
+
+    def close(self):
+        self.save_checkpoint()
+        self.close_bands()
 
     # debug methods used to tune motion detection
     def update_kernel_size(self, size):
@@ -108,21 +445,18 @@ class MotionDetector:
             size += 1
         self.blur_size = size
 
+    def reset_bg_models(self):
+        for band in self.bands:
+            band.bg_model = make_background_model(self.method, self)
+            band.gain = 1.0
+
     def update_history(self, history):
         self.history = int(history)
-        self.bg_subtractor = cv2.createBackgroundSubtractorKNN(
-            history=self.history,
-            dist2Threshold=self.dist2_threshold,
-            detectShadows=False,
-        )
+        self.reset_bg_models()
 
     def update_dist2_threshold(self, dist2_threshold):
         self.dist2_threshold = int(dist2_threshold)
-        self.bg_subtractor = cv2.createBackgroundSubtractorKNN(
-            history=self.history,
-            dist2Threshold=self.dist2_threshold,
-            detectShadows=False,
-        )
+        self.reset_bg_models()
 
     def save_settings(self):
         self.settings.set("motion.kernel_size", self.kernel_size)
@@ -0,0 +1,100 @@
+import math
+
+import cv2
+import numpy as np
+
+from custom_types.grid import Grid
+
+# this class packs the wells of a grid into a smaller image, so that background subtraction skips
+# everything outside of them (borders, gaps between wells), which FrameHandler would discard anyway
+# this changes what the background model sees, so results aren't the same as on the full frame:
+# - MOG2 treats every pixel independently, so its masks match the full frame pixel for pixel
+# - KNN schedules the updates of each pixel's samples with draws from OpenCV's global RNG, in scan order,
+#   so with fewer pixels every pixel gets different draws, and its masks differ (~10% of foreground pixels on the fixture)
+# - the mean brightness that triggers a reinit (see MotionDetector.detect_band) only covers the wells,
+#   so lighting changes outside of them don't count, and flies make up more of it
+# this is why it's off by default (motion.mask_wells)
+
+# wells are laid out row by row, in the same order as the grid
+# morphology and contour detection still run on the unpacked mask (in frame coordinates),
+# so a blob can't bleed into a neighboring well just because the wells are packed tightly
+
+
+class WellTiles:
+    def __init__(self, grid: Grid, frame_shape):
+        self.frame_shape = frame_shape[:2]
+        (frame_height, frame_width) = self.frame_shape
+
+        # (source y, source x, height, width, packed y, packed x)
+        self.tiles = []
+        packed_y = 0
+        packed_width = 0
+        for row in grid.rows:
+            packed_x = 0
+            row_height = 0
+            for item in row.items:
+                ((x1, y1), (x2, y2)) = item.bounds
+                x1 = max(0, math.floor(x1))
+                y1 = max(0, math.floor(y1))
+                x2 = min(frame_width, math.ceil(x2))
+                y2 = min(frame_height, math.ceil(y2))
+                if x2 <= x1 or y2 <= y1:
+                    continue
+                (height, width) = (y2 - y1, x2 - x1)
+                self.tiles.append((y1, x1, height, width, packed_y, packed_x))
+                packed_x += width
+                row_height = max(row_height, height)
+            packed_y += row_height
+            packed_width = max(packed_width, packed_x)
+        self.packed_shape = (packed_y, packed_width)
+        # number of pixels in the wells, which is less than the packed image when wells differ in size
+        self.area = sum(tile[2] * tile[3] for tile in self.tiles)
+
+        # reused across frames
+        self.packed = None
+        self.mask = np.zeros(self.frame_shape, np.uint8)
+
+    def __len__(self):
+        return len(self.tiles)
+
+    @property
+    def bounds(self):
+        # (x1, y1, x2, y2) of the area covered by the wells in the frame
+        return (
+            min(tile[1] for tile in self.tiles),
+            min(tile[0] for tile in self.tiles),
+            max(tile[1] + tile[3] for tile in self.tiles),
+            max(tile[0] + tile[2] for tile in self.tiles),
+        )
+
+    @property
+    def coverage(self):
+        # fraction of the frame that ends up in the packed image
+        (height, width) = self.frame_shape
+        return self.area / (height * width)
+
+    def pack(self, frame):
+        shape = self.packed_shape + frame.shape[2:]
+        if self.packed is None or self.packed.shape != shape:
+            self.packed = np.zeros(shape, frame.dtype)
+        for y, x, height, width, packed_y, packed_x in self.tiles:
+            self.packed[
+                packed_y : packed_y + height, packed_x : packed_x + width
+            ] = frame[y : y + height, x : x + width]
+        return self.packed
+
+    # mean of a packed single-channel image, over the wells only
+    # the padding between tiles is never written to, so it's 0 and doesn't add to the sum
+    def mean(self, packed):
+        return cv2.sumElems(packed)[0] / self.area
+
+    # copies a packed single-channel mask back into frame coordinates
+    # pixels outside the wells are always 0, unless they're copied into `out` instead
+    def unpack(self, packed_mask, out=None):
+        if out is None:
+            out = self.mask
+        for y, x, height, width, packed_y, packed_x in self.tiles:
+            out[y : y + height, x : x + width] = packed_mask[
+                packed_y : packed_y + height, packed_x : packed_x + width
+            ]
+        return out
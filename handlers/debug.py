@@ -1,9 +1,8 @@
 import cv2
-import numpy as np
 
 from custom_types.grid import Grid
-from custom_types.motion import MotionEventHandler
-from handlers.frame import MotionEvent
+from custom_types.motion import MotionBatch, MotionEventHandler
+from utils.overlay import Overlay
 
 # this class wraps a motion event handler to add debug info
 # at the moment, we're using it to show the detected fly and well
@@ -45,72 +44,81 @@ class DebugHandler(MotionEventHandler):
         self.handler = handler
         self.options = DebugOptions()
 
-        if self.options.draw_index:
-            self.overlay = None
-            self.on_frame = self.draw_indices
+        # indices only change with the grid, so they're drawn once and blended onto every frame,
+        # while flies and distances are drawn into a separate layer for each batch, see utils/overlay.py
+        self.overlay = Overlay(self.draw_indices)
+        self.on_frame = self.draw_overlay
 
-    def draw_indices(self, frame):
+    @property
+    def needs_raw_frame(self):
+        return self.handler.needs_raw_frame
+
+    @property
+    def draws_on_frame(self):
+        return not self.options.hidden
+
+    def draw_indices(self, image):
         if not self.options.draw_index:
             return
 
-        if self.overlay is None:
-            self.overlay = np.zeros(frame.shape, dtype=np.uint8)
-            for row in self.grid.rows:
-                for item in row.items:
-                    cv2.putText(
-                        self.overlay,
-                        str(item.index + 1),
-                        (int(item.bounds[0][0]), int(item.bounds[0][1])),
-                        cv2.FONT_HERSHEY_SIMPLEX,
-                        INDEX_THICKNESS,
-                        INDEX_COLOR,
-                    )
-
-        cv2.bitwise_or(frame, self.overlay, frame)
-
-    def draw_well(self, event: MotionEvent):
-        (start, end) = event.point.item.bounds
+        for row in self.grid.rows:
+            for item in row.items:
+                cv2.putText(
+                    image,
+                    str(item.index + 1),
+                    (int(item.bounds[0][0]), int(item.bounds[0][1])),
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    INDEX_THICKNESS,
+                    INDEX_COLOR,
+                )
+
+    def draw_overlay(self, frame):
+        # the grid version changes when it's moved, see Grid.transform
+        self.overlay.apply(frame, key=(self.grid.version, self.options.draw_index))
+
+    def draw_well(self, batch: MotionBatch, i: int):
+        (start, end) = batch.items[batch.indices[i]].bounds
         (x1, y1) = start
         (x2, y2) = end
-        cv2.rectangle(
-            event.frame,
+        self.overlay.rectangle(
             (int(x1), int(y1)),
             (int(x2), int(y2)),
             WELL_COLOR,
             WELL_THICKNESS,
         )
 
-    def draw_fly(self, event: MotionEvent):
-        cv2.drawContours(
-            event.frame, [event.point.contour], -1, FLY_COLOR, FLY_THICKNESS
-        )
-        cv2.drawContours(
-            event.frame,
-            [event.last_point.contour],
-            -1,
-            LAST_FLY_COLOR,
-            LAST_FLY_THICKNESS,
+    def draw_fly(self, batch: MotionBatch, i: int):
+        # blobs don't keep their outlines, so we draw their bounding boxes
+        (x, y, w, h) = batch.bounds[i].tolist()
+        self.overlay.rectangle((x, y), (x + w, y + h), FLY_COLOR, FLY_THICKNESS)
+        (x, y, w, h) = batch.last_bounds[i].tolist()
+        self.overlay.rectangle(
+            (x, y), (x + w, y + h), LAST_FLY_COLOR, LAST_FLY_THICKNESS
         )
 
-    def draw_distance(self, event: MotionEvent):
-        cv2.line(
-            event.frame,
-            (int(event.point.center[0]), int(event.point.center[1])),
-            (int(event.last_point.center[0]), int(event.last_point.center[1])),
+    def draw_distance(self, batch: MotionBatch, i: int):
+        (x1, y1) = batch.centers[i]
+        (x2, y2) = batch.last_centers[i]
+        self.overlay.line(
+            (int(x1), int(y1)),
+            (int(x2), int(y2)),
             DISTANCE_COLOR,
             DISTANCE_THICKNESS,
         )
 
-    def handle(self, event: MotionEvent):
-        self.handler.handle(event)
+    def handle_frame(self, batch: MotionBatch):
+        self.handler.handle_frame(batch)
         if self.options.hidden:
             return
 
-        if self.options.draw_well:
-            self.draw_well(event)
-        if self.options.draw_fly:
-            self.draw_fly(event)
-        if self.options.draw_distance:
-            self.draw_distance(event)
+        self.overlay.clear(batch.frame.shape)
+        for i in range(len(batch)):
+            if self.options.draw_well:
+                self.draw_well(batch, i)
+            if self.options.draw_fly:
+                self.draw_fly(batch, i)
+            if self.options.draw_distance:
+                self.draw_distance(batch, i)
         if self.options.print_events:
-            print(event)
+            for event in batch.events():
+                print(event)
@@ -0,0 +1,215 @@
+import datetime
+import glob
+import json
+import os
+
+import numpy as np
+
+from custom_types.grid import Grid
+from custom_types.motion import MotionBatch, MotionEventHandler
+from pipeline.writer import AsyncWriter, open_writer
+
+# this class wraps a motion event handler to log every motion event into compact binary files,
+# so that motion can be re-analyzed later (e.g. with a different interval) without running detection again
+
+# each file starts with a header (see HEADER_DTYPE), followed by fixed-size records (see EVENT_DTYPE),
+# so it can be read back as a numpy.memmap without any parsing, see read_event_log
+# frames without events get a single record with a well of NO_WELL, so that the time of every frame is known
+# files are rotated once they reach max_bytes, or once they cover max_duration seconds
+# the grid is saved next to them (see get_grid_file), since it's needed to put wells in output order
+
+MAGIC = b"FLYEVTS"
+VERSION = 1
+HEADER_DTYPE = np.dtype(
+    [
+        ("magic", "S8"),
+        ("version", "<u4"),
+        ("record_size", "<u4"),
+        # time of the first frame, see MotionBatch.time
+        ("start", "<f8"),
+        # wall-clock time of the first frame, in microseconds since 1970 (without a time zone)
+        ("start_time", "<i8"),
+    ]
+)
+EVENT_DTYPE = np.dtype(
+    [
+        ("time", "<f8"),
+        # stored at full precision, so that replayed totals match the live ones exactly
+        ("distance", "<f8"),
+        ("x", "<f4"),
+        ("y", "<f4"),
+        ("area", "<u4"),
+        ("frame", "<u4"),
+        ("well", "<u2"),
+    ]
+)
+NO_WELL = np.iinfo(np.uint16).max
+
+DEFAULT_MAX_BYTES = 1 << 30
+DEFAULT_MAX_DURATION = 24 * 60 * 60
+
+EPOCH = datetime.datetime(1970, 1, 1)
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def make_header(start: float, start_time: datetime.datetime):
+    header = np.zeros(1, HEADER_DTYPE)
+    header["magic"] = MAGIC
+    header["version"] = VERSION
+    header["record_size"] = EVENT_DTYPE.itemsize
+    header["start"] = start
+    header["start_time"] = (start_time - EPOCH) // MICROSECOND
+    return header
+
+
+def get_start_time(header):
+    return EPOCH + int(header["start_time"]) * MICROSECOND
+
+
+# returns the header and a read-only memmap of the records
+# a partial record at the end (e.g. after a crash) is ignored
+def read_event_log(path: str):
+    header = np.fromfile(path, HEADER_DTYPE, count=1)
+    if (
+        len(header) == 0
+        or header["magic"][0] != MAGIC
+        or header["version"][0] != VERSION
+        or header["record_size"][0] != EVENT_DTYPE.itemsize
+    ):
+        raise ValueError(f"Invalid event log: {path}")
+    count = (os.path.getsize(path) - HEADER_DTYPE.itemsize) // EVENT_DTYPE.itemsize
+    if count == 0:
+        # can't map an empty range
+        return header[0], np.empty(0, EVENT_DTYPE)
+    records = np.memmap(
+        path, EVENT_DTYPE, mode="r", offset=HEADER_DTYPE.itemsize, shape=(count,)
+    )
+    return header[0], records
+
+
+# event logs go next to the output file, like recorded images
+def get_event_log_dir(filename: str):
+    return os.path.join(os.path.dirname(filename), "events")
+
+
+# event log files in the order they were written, optionally only those of one session
+def list_event_logs(directory: str, session: str = "*"):
+    return sorted(glob.glob(os.path.join(directory, f"events_{session}_*.bin")))
+
+
+# sessions are named after their start time, see EventLogHandler.rotate
+def get_session(path: str):
+    return os.path.basename(path).split("_")[1]
+
+
+def get_grid_file(directory: str, session: str):
+    return os.path.join(directory, f"grid_{session}.json")
+
+
+def read_grid(directory: str, session: str):
+    with open(get_grid_file(directory, session), "r") as f:
+        return Grid.from_dict(json.load(f))
+
+
+class EventLogHandler(MotionEventHandler):
+    def __init__(
+        self,
+        directory: str,
+        handler: MotionEventHandler | None = None,
+        grid: Grid | None = None,
+        start_time: datetime.datetime | None = None,
+        max_bytes=DEFAULT_MAX_BYTES,
+        max_duration=DEFAULT_MAX_DURATION,
+        writer: AsyncWriter | None = None,
+        cleanup_queue=None,
+        error_queue=None,
+    ):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.handler = handler or MotionEventHandler()
+        self.grid = grid
+        # wall-clock time of the first frame, set from the first frame unless given
+        self.start_time = start_time
+        self.max_bytes = max_bytes
+        self.max_duration = max_duration
+        self.writer = writer or open_writer(error_queue=error_queue)
+        if cleanup_queue is not None:
+            cleanup_queue.put(self.close)
+
+        # the same header goes into every file, set on the first frame
+        self.header = None
+        self.file_index = -1
+        self.filename = None
+        self.file_bytes = 0
+        self.file_start = None
+        self.records_written = 0
+
+    @property
+    def needs_raw_frame(self):
+        return self.handler.needs_raw_frame
+
+    @property
+    def draws_on_frame(self):
+        return self.handler.draws_on_frame
+
+    @property
+    def on_frame(self):
+        return self.handler.on_frame
+
+    def handle_frame(self, batch: MotionBatch):
+        self.handler.handle_frame(batch)
+        self.log(batch)
+
+    def make_records(self, batch: MotionBatch):
+        if len(batch) == 0:
+            records = np.zeros(1, EVENT_DTYPE)
+            records["well"] = NO_WELL
+        else:
+            records = np.empty(len(batch), EVENT_DTYPE)
+            records["distance"] = batch.distances
+            records["x"] = batch.centers[:, 0]
+            records["y"] = batch.centers[:, 1]
+            records["area"] = batch.areas
+            records["well"] = batch.indices
+        records["time"] = batch.time
+        records["frame"] = batch.frame_count
+        return records
+
+    def log(self, batch: MotionBatch):
+        if self.start_time is None:
+            self.start_time = datetime.datetime.now()
+        if self.header is None:
+            self.header = make_header(batch.time, self.start_time).tobytes()
+        if (
+            self.filename is None
+            or self.file_bytes >= self.max_bytes
+            or batch.time - self.file_start >= self.max_duration
+        ):
+            self.rotate(batch.time)
+        data = self.make_records(batch).tobytes()
+        self.writer.write(self.filename, data)
+        self.file_bytes += len(data)
+        self.records_written += len(data) // EVENT_DTYPE.itemsize
+
+    def rotate(self, time: float):
+        if self.filename is not None:
+            self.writer.close_file(self.filename)
+        self.file_index += 1
+        session = self.start_time.strftime("%Y%m%d%H%M%S")
+        if self.file_index == 0 and self.grid is not None:
+            self.writer.create(
+                get_grid_file(self.directory, session), json.dumps(self.grid.to_dict())
+            )
+        self.filename = os.path.join(
+            self.directory, f"events_{session}_{self.file_index:05d}.bin"
+        )
+        self.file_start = time
+        # replaces a file from an earlier run with the same name
+        self.writer.create(self.filename, self.header)
+        self.file_bytes = len(self.header)
+
+    # waits for everything to be written
+    def close(self):
+        if self.filename is not None:
+            self.writer.close_file(self.filename)
+        self.writer.close()
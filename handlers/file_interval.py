@@ -1,13 +1,15 @@
 import datetime
 import os
-from threading import Timer
 
-import cv2
+import numpy as np
 
 from custom_types.grid import Grid
-from custom_types.motion import MotionEvent, MotionEventHandler
+from custom_types.motion import MotionBatch, MotionEvent, MotionEventHandler
+from handlers.intervals import IntervalBins
+from pipeline.archive import VideoArchive
+from pipeline.writer import AsyncWriter, open_writer
 
-# this class handles motion events and flushes them to the specified file at the specified interval
+# this class handles motion events and writes them to the specified file at the specified interval
 
 # output file options
 # see the make_row method for more info
@@ -15,68 +17,158 @@ DATE_FORMAT = "%d %b %y"
 TIME_FORMAT = "%H:%M:00"
 DELIMITER = "\t"
 
+# the activity file is written next to the output file, e.g. output.txt -> output_activity.txt
+# its intervals are usually shorter than a minute, so it keeps the seconds
+ACTIVITY_SUFFIX = "_activity"
+ACTIVITY_TIME_FORMAT = "%H:%M:%S"
 
-# captures motion events and flushes them to the specified file at the specified interval
+
+def get_activity_file(filename: str):
+    root, ext = os.path.splitext(filename)
+    return f"{root}{ACTIVITY_SUFFIX}{ext}"
+
+
+# a file that gets one row per interval
+class IntervalOutput:
+    def __init__(self, filename: str, interval: float, time_format: str):
+        self.filename = filename
+        self.interval = interval
+        self.time_format = time_format
+        self.index = 0
+        self.last_flush = None
+
+
+# captures motion events and writes them to one or more files, each at its own interval
+# intervals are timed by the frames themselves (see handlers/intervals.py), not by a timer,
+# so everything runs on the thread that handles frames and there's nothing to lock
+# rows and images are handed off to a writer thread (see pipeline/writer.py), so slow storage never blocks detection
 class FileIntervalHandler(MotionEventHandler):
     def __init__(
         self,
         grid: Grid,
         filename: str,
         interval,
+        record_images=False,
+        base_interval=1,
+        activity_interval=None,
+        start_time: datetime.datetime | None = None,
+        writer: AsyncWriter | None = None,
         cleanup_queue=None,
         error_queue=None,
-        record_images=False,
+        archive: VideoArchive | None = None,
     ):
-        self.timer = None
+        super().__init__()
         self.grid = grid
-        self.error_queue = error_queue
-        if cleanup_queue is not None:
-            cleanup_queue.put(self.cancel)
         self.raw_frame = None
-
-        self.distances = self.make_distances()
-        self.max_x = max(key[0] for key in self.distances)
-        self.max_y = max(key[1] for key in self.distances)
+        # wall-clock time of the first frame, which interval timestamps are offset from
+        # set from the first frame unless the caller controls timing (e.g. headless mode)
+        self.start_time = start_time
 
         self.filename = filename
         self.record_images = record_images
+        # records every frame into video segments instead, see pipeline/archive.py
+        self.archive = archive
+        # interval the archive last marked the start of
+        self.archive_interval = None
+        self.needs_raw_frame = record_images or archive is not None
         if self.record_images:
             self.frames_dir = os.path.join(os.path.dirname(filename), "frames")
             os.makedirs(self.frames_dir, exist_ok=True)
         # TODO: move to schema in app settings
         self.interval = int(interval)
-        self.index = 0
-        self.last_flush = datetime.datetime.now()
+        # rows of the main output are whole seconds, so 0.5 would otherwise become an empty interval
+        if self.interval <= 0 or self.interval != float(interval):
+            raise ValueError(
+                f"Interval must be a positive whole number of seconds, got {interval}"
+            )
+        self.outputs = [IntervalOutput(filename, self.interval, TIME_FORMAT)]
+        if activity_interval is not None:
+            self.outputs.append(
+                IntervalOutput(
+                    get_activity_file(filename),
+                    activity_interval,
+                    ACTIVITY_TIME_FORMAT,
+                )
+            )
 
-        # immediately write file (provides better feedback, and helps catch errors)
-        with open(self.filename, "w") as f:
-            f.write("")
+        self.order = self.make_order()
+        wells = max(item.index for row in grid.rows for item in row.items) + 1
+        self.bins = IntervalBins(
+            wells,
+            base_interval,
+            [output.interval for output in self.outputs],
+        )
 
-    def start(self):
-        self.timer = Timer(self.interval, self.flush)
-        self.timer.start()
+        # immediately write files (provides better feedback, and helps catch errors)
+        for output in self.outputs:
+            with open(output.filename, "w") as f:
+                f.write("")
 
-    def cancel(self):
-        if self.timer is not None:
-            self.timer.cancel()
+        self.writer = writer or open_writer(error_queue=error_queue)
+        if cleanup_queue is not None:
+            cleanup_queue.put(self.close)
 
-    def handle(self, event: MotionEvent):
-        self.distances[event.item.coords] += event.distance
-        if self.record_images:
-            self.raw_frame = event.raw_frame
+    # number of intervals written to the main output file
+    @property
+    def index(self):
+        return self.outputs[0].index
 
-    def make_distances(self):
-        distances = {}
-        for row in self.grid.rows:
-            for item in row.items:
-                distances[item.coords] = 0
-        return distances
+    # distances of the base bin that's currently open
+    @property
+    def distances(self):
+        return self.bins.current
 
-    def make_row(self):
+    def handle(self, event: MotionEvent):
+        self.bins.current[event.item.index] += event.distance
+        if self.record_images:
+            self.raw_frame = event.raw_frame.copy()
+
+    def handle_frame(self, batch: MotionBatch):
+        # the frame belongs to the bin that contains its time,
+        # so every bin that ended before it has to be written first
+        if self.start_time is None:
+            self.start_time = datetime.datetime.now()
+        self.write_intervals(self.bins.advance(batch.time))
+        if self.archive is not None:
+            self.archive_frame(batch)
+        if len(batch) == 0:
+            return
+        self.bins.add(batch.indices, batch.distances)
+        if self.record_images:
+            # kept until the interval is written, by which time the capture buffer has been reused
+            self.raw_frame = batch.raw_frame.copy()
+
+    def archive_frame(self, batch: MotionBatch):
+        # the frame belongs to the main output's next interval, since the ones before it were just written
+        interval = self.index + 1
+        if interval != self.archive_interval:
+            self.archive.mark(interval)
+            self.archive_interval = interval
+        self.archive.add(batch.raw_frame, batch.time)
+
+    # well index for each column of the output, or -1 if there's no well at that position
+    # basically all downstream analysis is written with the order of flies
+    # by column, then row, i.e. 1A-H, 2A-H, etc.
+    def make_order(self):
+        indices = {
+            item.coords: item.index for row in self.grid.rows for item in row.items
+        }
+        max_row = max(coords[0] for coords in indices)
+        max_col = max(coords[1] for coords in indices)
+        return np.array(
+            [
+                indices.get((row, col), -1)
+                for col in range(max_col + 1)
+                for row in range(max_row + 1)
+            ],
+            np.intp,
+        )
+
+    def make_row(self, output: IntervalOutput, distances):
         row_parts = [
-            self.index,
-            self.last_flush.strftime(DATE_FORMAT),
-            self.last_flush.strftime(TIME_FORMAT),
+            output.index,
+            output.last_flush.strftime(DATE_FORMAT),
+            output.last_flush.strftime(output.time_format),
             1,  # monitor status (always 1)
             1,  # monitor number (should be user-specified in the future)
             0,  # unused
@@ -85,38 +177,38 @@ class FileIntervalHandler(MotionEventHandler):
             0,  # unused
             0,  # unused
         ]
-
-        """
-        Basically all downstream analysis 
-        is written with the order of flies 
-        by column, then row, i.e. 1A-H, 2A-H, etc.
-        """
-        for y in range(self.max_y + 1):
-            for x in range(self.max_x + 1):
-                coords = (x, y)
-                row_parts.append(int(self.distances[coords]))
+        # see make_order
+        values = np.where(self.order >= 0, distances[self.order], 0)
+        row_parts.extend(values.astype(np.int64).tolist())
 
         return DELIMITER.join(map(str, row_parts))
 
-    def write_data(self):
-        row = self.make_row()
-        with open(self.filename, "a") as f:
-            f.write(row + "\n")
-        if self.record_images:
-            timestamp = self.last_flush.strftime("%Y%m%d%H%M%S")
-            cv2.imwrite(
+    def write_data(self, output: IntervalOutput, distances):
+        row = self.make_row(output, distances)
+        self.writer.write(output.filename, row + "\n")
+        # images are only saved for the main output, and only once there's been motion
+        if (
+            self.record_images
+            and output is self.outputs[0]
+            and self.raw_frame is not None
+        ):
+            timestamp = output.last_flush.strftime("%Y%m%d%H%M%S")
+            self.writer.write_image(
                 os.path.join(self.frames_dir, f"{timestamp}.jpg"), self.raw_frame
             )
 
-    def flush(self):
-        self.index += 1
-        self.last_flush = datetime.datetime.now()
-        try:
-            self.write_data()
-            self.start()
-        except Exception as e:
-            # since we're running in a thread, we add them to the queue to be handled on the next loop
-            if self.error_queue is not None:
-                self.error_queue.put(e)
-
-        self.distances = self.make_distances()
+    # writes a row for each interval that ended, see IntervalBins.advance
+    # rows are timestamped with the end of their interval
+    def write_intervals(self, finished):
+        for i, end, distances in finished:
+            output = self.outputs[i]
+            output.index += 1
+            output.last_flush = self.start_time + datetime.timedelta(seconds=end)
+            self.write_data(output, distances)
+
+    # waits for everything to be written
+    def close(self):
+        if self.archive is not None:
+            # the archive writes its index through the writer, so it has to finish first
+            self.archive.close()
+        self.writer.close()
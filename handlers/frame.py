@@ -1,72 +1,174 @@
-from typing import Dict
+import time
+from typing import Callable
 
-import cv2
+import numpy as np
 
+from custom_types.blobs import Blobs
 from custom_types.grid import Grid
-from custom_types.motion import MotionEvent, MotionEventHandler, MotionPoint
+from custom_types.motion import MotionBatch, MotionEvent, MotionEventHandler
+from detection.checkpoint import BackgroundCheckpoint
+from detection.drift import DriftTracker
 from detection.motion import MotionDetector
 from utils.app_settings import AppSettings
 
 # this class handles motion detected in frames and emits motion events
 # at the moment, this class only handles a single motion event per grid item per frame,
 # so we can only handle one fly per well, but this can be changed in the future
-# see the logic in handle_contour for more info
+# see the logic in make_batch for more info
 
 
 class FrameHandler(MotionEvent):
-    def __init__(self, grid: Grid, settings: AppSettings, handler: MotionEventHandler):
+    def __init__(
+        self,
+        grid: Grid,
+        settings: AppSettings,
+        handler: MotionEventHandler,
+        clock: Callable[[], float] = time.monotonic,
+        seed: int | None = None,
+        checkpoint: BackgroundCheckpoint | None = None,
+        drift: DriftTracker | None = None,
+    ):
         self.grid = grid
-        self.motion_detector = MotionDetector(settings)
+        # timestamps frames, see MotionBatch.time
+        self.clock = clock
+        self.motion_detector = MotionDetector(
+            settings, clock=clock, grid=grid, seed=seed, checkpoint=checkpoint
+        )
         self.handler = handler
+        # when given, the grid follows the plate if it drifts during the recording
+        self.drift = drift
 
-        self.points: Dict[tuple, MotionPoint] = {}
-        self.average = 0
-
-    def find_item(self, contour):
-        bounds = cv2.boundingRect(contour)
-        row = self.grid.find_row(bounds)
-        if row is None:
-            return
-        return row.find_item(bounds)
+        # last point of each well, indexed by well index (see Grid.items)
+        # a last frame count of -1 means we haven't seen the well yet
+        wells = len(grid.items)
+        self.last_centers = np.zeros((wells, 2), np.float64)
+        self.last_areas = np.zeros(wells, np.int64)
+        self.last_bounds = np.zeros((wells, 4), np.int32)
+        self.last_frame_counts = np.full(wells, -1, np.int64)
 
-    def handle_contour(self, contour, frame, raw_frame, frame_count: int):
-        item = self.find_item(contour)
-        if item is None:
-            return
+        # reused across frames, see get_display_frame
+        self.display_frame = None
 
-        point = MotionPoint(contour, item, frame_count)
-        coords = point.item.coords
-        last_point = self.points.get(coords)
-        if last_point is None:
-            self.points[coords] = point
-            return
+    def make_batch(
+        self,
+        blobs: Blobs,
+        indices,
+        frame,
+        raw_frame,
+        frame_count: int,
+        frame_time: float,
+    ):
+        # group blobs by well, keeping detection order within each well
+        inside = np.flatnonzero(indices >= 0)
+        order = inside[np.argsort(indices[inside], kind="stable")]
+        wells = indices[order]
+        areas = blobs.areas[order].astype(np.int64)
 
         # if we have multiple points in the same frame, we only want to keep the largest one
         # we'll need to change this if we ever want to capture multiple flies in a single well
-        if point.frame_count == last_point.frame_count and point.area < last_point.area:
-            return
-
-        # emit event
-        event = MotionEvent(
-            point=point,
-            last_point=last_point,
-            item=item,
-            frame=frame,
-            raw_frame=raw_frame,
+        # blobs are handled in order, and each one that's at least as large as the ones before it
+        # replaces the last point of its well (and emits an event if there was one)
+        # offsetting by well makes the running maximum start over for each well
+        offset = wells.astype(np.int64) * (np.max(areas, initial=0) + 1)
+        kept = areas + offset >= np.maximum.accumulate(areas + offset)
+        order = order[kept]
+        wells = wells[kept]
+        centers = blobs.centers[order]
+        areas = areas[kept]
+        bounds = blobs.bounds[order]
+
+        # the first kept blob of each well follows the well's last point,
+        # and every other one follows the kept blob before it
+        first = np.ones(len(wells), bool)
+        first[1:] = wells[1:] != wells[:-1]
+        last_centers = np.empty_like(centers)
+        last_centers[1:] = centers[:-1]
+        last_centers[first] = self.last_centers[wells[first]]
+        last_areas = np.empty_like(areas)
+        last_areas[1:] = areas[:-1]
+        last_areas[first] = self.last_areas[wells[first]]
+        last_bounds = np.empty_like(bounds)
+        last_bounds[1:] = bounds[:-1]
+        last_bounds[first] = self.last_bounds[wells[first]]
+        last_frame_counts = np.full(len(wells), frame_count, np.int64)
+        last_frame_counts[first] = self.last_frame_counts[wells[first]]
+
+        # the last kept blob of each well becomes its new last point
+        last = np.ones(len(wells), bool)
+        last[:-1] = first[1:]
+        self.last_centers[wells[last]] = centers[last]
+        self.last_areas[wells[last]] = areas[last]
+        self.last_bounds[wells[last]] = bounds[last]
+        self.last_frame_counts[wells[last]] = frame_count
+
+        # wells we haven't seen before don't have a last point, so they can't emit an event yet
+        emit = last_frame_counts >= 0
+        return MotionBatch(
+            self.grid.items,
+            frame_count,
+            frame_time,
+            frame,
+            raw_frame,
+            wells[emit],
+            centers[emit],
+            areas[emit],
+            bounds[emit],
+            last_centers[emit],
+            last_areas[emit],
+            last_bounds[emit],
+            last_frame_counts[emit],
         )
-        self.handler.handle(event)
 
-        self.points[coords] = point
+    # handlers draw on a separate copy of the frame, so the frame used for detection is never modified
+    def get_display_frame(self, frame):
+        if self.display_frame is None or self.display_frame.shape != frame.shape:
+            self.display_frame = np.empty_like(frame)
+        np.copyto(self.display_frame, frame)
+        return self.display_frame
+
+    # moves the grid by a 2x3 affine matrix, along with everything that's in its coordinates
+    def move_grid(self, matrix, frame):
+        self.grid.transform(matrix)
+        self.motion_detector.move_grid(matrix, frame)
+        # flies moved with the plate, so that shouldn't count as distance
+        seen = self.last_frame_counts >= 0
+        centers = self.last_centers[seen]
+        moved = centers @ matrix[:, :2].T + matrix[:, 2]
+        self.last_centers[seen] = moved
+        self.last_bounds[seen, :2] += np.round(moved - centers).astype(np.int32)
 
+    # returns the frame to display, with anything handlers have drawn on it
+    # the frame is only valid until the next one is read (see utils/frame.py),
+    # so handlers that keep it have to copy it (e.g. for image recording)
     def handle(self, frame, frame_count: int):
-        contours = self.motion_detector.detect(frame)
-        # this is a copy of the original frame used for image recording
-        # don't modify it!
-        raw_frame = frame.copy()
-        for contour in contours:
-            self.handle_contour(contour, frame, raw_frame, frame_count)
-        # HACK: move this after contour detection so that changes to the frame don't affect detection
-        # the fact that the same frame is used for detection *and* display is itself bad,
-        # but this works for now
+        frame_time = self.clock()
+        if self.drift is not None:
+            correction = self.drift.update(frame)
+            if correction is not None:
+                self.move_grid(correction, frame)
+        blobs = self.motion_detector.detect_blobs(frame)
+        # only copy the frame if something is going to draw on it
+        display_frame = None
+        if self.handler.draws_on_frame:
+            display_frame = self.get_display_frame(frame)
+        raw_frame = None
+        if self.handler.needs_raw_frame:
+            # read-only, so handlers can't modify it by accident
+            raw_frame = frame.view()
+            raw_frame.flags.writeable = False
+        # blobs belong to the well that contains their center
+        indices = self.grid.find_items(blobs.centers, frame.shape)
+        batch = self.make_batch(
+            blobs, indices, display_frame, raw_frame, frame_count, frame_time
+        )
+        self.handler.handle_frame(batch)
+        if display_frame is None:
+            return frame
         if self.handler.on_frame:
-            self.handler.on_frame(frame)
+            self.handler.on_frame(display_frame)
+        return display_frame
+
+    def close(self):
+        self.motion_detector.close()
+        if self.drift is not None:
+            self.drift.close()
@@ -0,0 +1,56 @@
+import numpy as np
+
+# this class splits time into fixed base bins and aggregates them into one or more output intervals
+# bin boundaries are derived from the timestamps of the frames themselves (monotonic time when recording,
+# video time when processing files), so intervals never drift, no matter how long writing takes
+
+# each output interval has to be a multiple of the base interval
+# e.g. with a base interval of 1 s, a 60 s DAM output and a 10 s activity output can be produced in a single pass
+
+# a frame belongs to the base bin that contains its timestamp, so bins are half-open: [start, end)
+# a bin is closed by the first frame that falls after it, so a partial last interval is never emitted
+
+
+class IntervalBins:
+    def __init__(self, wells: int, base_interval: float, intervals: list[float]):
+        if base_interval <= 0:
+            raise ValueError("Base interval must be positive")
+        self.base_interval = base_interval
+        self.ratios = []
+        for interval in intervals:
+            ratio = round(interval / base_interval)
+            if ratio < 1 or abs(ratio * base_interval - interval) > 1e-9:
+                raise ValueError(
+                    f"Interval {interval} is not a multiple of the base interval {base_interval}"
+                )
+            self.ratios.append(ratio)
+
+        # distances of the base bin that's currently open, indexed by well index
+        self.current = np.zeros(wells, np.float64)
+        # distances of each output interval that's currently open
+        self.totals = np.zeros((len(intervals), wells), np.float64)
+        # timestamp of the first frame, which all boundaries are relative to
+        self.origin = None
+        self.closed_bins = 0
+
+    # closes every base bin that ends at or before `time`
+    # returns (output index, seconds since origin, distances) for each output interval that finished
+    def advance(self, time: float):
+        if self.origin is None:
+            self.origin = time
+            return []
+        finished = []
+        elapsed = time - self.origin
+        while elapsed >= (self.closed_bins + 1) * self.base_interval:
+            self.totals += self.current
+            self.current.fill(0)
+            self.closed_bins += 1
+            end = self.closed_bins * self.base_interval
+            for i, ratio in enumerate(self.ratios):
+                if self.closed_bins % ratio == 0:
+                    finished.append((i, end, self.totals[i].copy()))
+                    self.totals[i].fill(0)
+        return finished
+
+    def add(self, indices, distances):
+        np.add.at(self.current, indices, distances)
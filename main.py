@@ -1,12 +1,41 @@
-from components.root_window import RootWindow
+from utils.arg_parser import arg_parser
 
 # main entrypoint for the program
 # in the future, we could use something like this to package it into an executable:
 # https://pyinstaller.org/en/stable/
 
 
+def run_headless(args):
+    # imported here so that headless runs don't need a display
+    from pipeline.headless import HeadlessRunner
+    from utils.app_settings import AppSettings
+
+    settings = AppSettings(keep_defaults=args.get("keep_defaults") or False)
+    runner = HeadlessRunner(
+        settings, source=args.get("source"), output_file=args.get("output")
+    )
+    stats = runner.run()
+    print(
+        f"Processed {stats['frames']} frames into {stats['intervals']} intervals "
+        f"in {stats['seconds']:.1f}s ({stats['fps']:.1f} fps)"
+    )
+    writer = stats["writer"]
+    print(
+        f"Wrote {writer['bytes']} bytes and {writer['images']} images "
+        f"(max backlog {writer['max_backlog']}, max lag {writer['max_lag']:.2f}s, "
+        f"{writer['images_dropped']} images dropped)"
+    )
+
+
 def main():
-    root_window = RootWindow()
+    args = arg_parser()
+    if args.get("headless"):
+        run_headless(args)
+        return
+
+    from components.root_window import RootWindow
+
+    root_window = RootWindow(args)
     root_window.start()
 
 
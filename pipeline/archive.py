@@ -0,0 +1,276 @@
+import datetime
+import os
+import threading
+from collections import deque
+
+import cv2
+
+from pipeline.writer import AsyncWriter
+
+# this class records frames into a directory of fixed-length video segments, so that intervals can be re-analyzed later
+# frames are queued by the caller and encoded with cv2.VideoWriter on a thread of their own
+# an index file maps each interval to the segment and frame it starts on, see mark
+# each recording gets a directory of its own, named after its start time like event log sessions (see get_archive_dir),
+# and a directory that already holds an archive is never reused, since its segments would be overwritten
+
+# segments are split by frame time, so each one covers the same duration no matter the frame rate
+# every `decimation`th frame is kept, e.g. 30 with a 30 fps camera keeps about 1 frame per second
+# if encoding falls behind, the last frame is repeated instead of queuing up new ones,
+# so that frame offsets in the index stay correct
+
+# frames arrive as fast as the loop runs, which is slower than any fixed rate the caller could pass in
+# so each segment is encoded at the rate its first MEASURE_FRAMES frames actually arrived at
+# (the encoder waits for them before opening it), and `fps` is only used for segments with fewer frames
+# the real start, end and frame count of each segment go into a second file, see end_segment
+
+INDEX_FILE = "index.txt"
+INDEX_HEADER = "interval\tsegment\tframe\n"
+SEGMENTS_FILE = "segments.txt"
+# start and end are in seconds since the first frame
+SEGMENTS_HEADER = "segment\tstart\tend\tframes\n"
+# well below max_pending_frames, so frames aren't repeated while the encoder waits for them
+MEASURE_FRAMES = 10
+DEFAULT_SEGMENT_DURATION = 600
+DEFAULT_CODEC = "mp4v"
+# file extension for each codec, anything else goes into an .avi container
+CODEC_EXTENSIONS = {"mp4v": ".mp4", "avc1": ".mp4"}
+DEFAULT_MAX_PENDING_FRAMES = 64
+
+
+def get_archive_dir(filename: str, start_time: datetime.datetime):
+    session = start_time.strftime("%Y%m%d%H%M%S")
+    return os.path.join(os.path.dirname(filename), "archive", session)
+
+
+class VideoArchive:
+    def __init__(
+        self,
+        directory: str,
+        fps: float,
+        writer: AsyncWriter,
+        segment_duration=DEFAULT_SEGMENT_DURATION,
+        decimation=1,
+        codec=DEFAULT_CODEC,
+        max_pending_frames=DEFAULT_MAX_PENDING_FRAMES,
+    ):
+        if segment_duration <= 0:
+            raise ValueError("Segment duration must be positive")
+        if decimation < 1:
+            raise ValueError("Decimation must be at least 1")
+        self.directory = directory
+        # index rows and errors go through the output writer
+        self.writer = writer
+        self.segment_duration = segment_duration
+        self.decimation = int(decimation)
+        self.fps = fps / self.decimation
+        self.codec = codec
+        self.extension = CODEC_EXTENSIONS.get(codec, ".avi")
+        self.max_pending_frames = max_pending_frames
+
+        os.makedirs(directory, exist_ok=True)
+        self.index_file = os.path.join(directory, INDEX_FILE)
+        if os.path.exists(self.index_file):
+            raise FileExistsError(f"Archive already exists: {directory}")
+        # written immediately, like the output file
+        with open(self.index_file, "w") as f:
+            f.write(INDEX_HEADER)
+        self.segments_file = os.path.join(directory, SEGMENTS_FILE)
+        with open(self.segments_file, "w") as f:
+            f.write(SEGMENTS_HEADER)
+
+        # position of the next frame, only used by the thread that adds frames
+        self.frames_seen = 0
+        self.segment = -1
+        self.segment_end = None
+        self.offset = 0
+        self.first_time = None
+        self.segment_start = None
+        self.last_time = None
+        # interval that starts on the next kept frame
+        self.next_interval = None
+
+        # (segment, frame), where a frame of None repeats the last one
+        self.pending = deque()
+        # measured rate of each segment that hasn't been opened yet, see measure
+        self.segment_fps: dict[int, float] = {}
+        self.condition = threading.Condition()
+        self.thread = None
+        self.running = False
+
+        # counters
+        self.frames_written = 0
+        self.frames_repeated = 0
+        self.segments_written = 0
+
+    def stats(self):
+        with self.condition:
+            return {
+                "backlog": len(self.pending),
+                "frames": self.frames_written,
+                "repeated": self.frames_repeated,
+                "segments": self.segments_written,
+            }
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    # encodes everything that's still queued before returning
+    def close(self):
+        self.end_segment()
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def segment_name(self, segment: int):
+        return f"segment_{segment:05d}{self.extension}"
+
+    # records that `interval` starts on the next frame that's kept
+    def mark(self, interval: int):
+        self.next_interval = interval
+
+    # queues a frame captured at `time` (in seconds, see MotionBatch.time)
+    # the frame is encoded later, so the caller must not modify it afterwards
+    def add(self, frame, time: float):
+        self.frames_seen += 1
+        if (self.frames_seen - 1) % self.decimation != 0:
+            return
+        if self.segment_end is None or time >= self.segment_end:
+            self.end_segment(time)
+            self.segment += 1
+            self.offset = 0
+            self.segment_start = time
+            if self.segment_end is None:
+                self.first_time = time
+                self.segment_end = time
+            # keep segments aligned to the first frame, so they don't drift
+            while time >= self.segment_end:
+                self.segment_end += self.segment_duration
+        if self.next_interval is not None:
+            self.writer.write(
+                self.index_file,
+                f"{self.next_interval}\t{self.segment_name(self.segment)}\t{self.offset}\n",
+            )
+            self.next_interval = None
+
+        with self.condition:
+            if len(self.pending) >= self.max_pending_frames:
+                frame = None
+                self.frames_repeated += 1
+            else:
+                # the frame can be a view of the capture buffer, which is reused before it's encoded
+                frame = frame.copy()
+            self.pending.append((self.segment, frame))
+            self.condition.notify_all()
+        self.offset += 1
+        self.last_time = time
+        if self.offset == MEASURE_FRAMES:
+            self.measure()
+
+    # sets the frame rate of the current segment from the frames it has had so far
+    def measure(self):
+        fps = self.fps
+        if self.offset > 1 and self.last_time > self.segment_start:
+            fps = (self.offset - 1) / (self.last_time - self.segment_start)
+        with self.condition:
+            self.segment_fps.setdefault(self.segment, fps)
+            self.condition.notify_all()
+
+    # `end` is the time of the frame that starts the next segment, or None when the archive is closed
+    def end_segment(self, end: float | None = None):
+        if self.segment < 0:
+            return
+        # a segment with fewer than MEASURE_FRAMES frames
+        self.measure()
+        if end is None:
+            end = self.last_time
+        self.writer.write(
+            self.segments_file,
+            f"{self.segment_name(self.segment)}\t{self.segment_start - self.first_time:.3f}\t"
+            f"{end - self.first_time:.3f}\t{self.offset}\n",
+        )
+
+    def open_segment(self, segment: int, frame):
+        with self.condition:
+            # added frames keep the segment alive until its rate is known, see measure
+            while segment not in self.segment_fps:
+                self.condition.wait()
+            fps = self.segment_fps.pop(segment)
+        path = os.path.join(self.directory, self.segment_name(segment))
+        height, width = frame.shape[:2]
+        video = cv2.VideoWriter(
+            path,
+            cv2.VideoWriter_fourcc(*self.codec),
+            fps,
+            (width, height),
+            len(frame.shape) == 3,
+        )
+        if not video.isOpened():
+            raise IOError(f"Unable to open video writer: {path}")
+        return video
+
+    def run(self):
+        video = None
+        segment = None
+        last_frame = None
+        while True:
+            with self.condition:
+                while not self.pending and self.running:
+                    self.condition.wait()
+                if not self.pending:
+                    break
+                batch = list(self.pending)
+                self.pending.clear()
+            for frame_segment, frame in batch:
+                if frame is None:
+                    frame = last_frame
+                if frame is None:
+                    # nothing has been written yet, so there's nothing to repeat
+                    continue
+                try:
+                    if frame_segment != segment:
+                        if video is not None:
+                            video.release()
+                            video = None
+                        segment = frame_segment
+                        video = self.open_segment(frame_segment, frame)
+                        with self.condition:
+                            self.segments_written += 1
+                    if video is None:
+                        # the segment failed, so skip the rest of it
+                        continue
+                    video.write(frame)
+                    last_frame = frame
+                    with self.condition:
+                        self.frames_written += 1
+                except Exception as e:
+                    self.writer.report(e)
+                    if video is not None:
+                        # finishes the file, so what was written before the error can still be played
+                        video.release()
+                        video = None
+        if video is not None:
+            video.release()
+
+
+def open_archive(
+    directory: str,
+    fps: float,
+    writer: AsyncWriter,
+    segment_duration: float | None = None,
+    decimation: int | None = None,
+    codec: str | None = None,
+):
+    return VideoArchive(
+        directory,
+        fps,
+        writer,
+        segment_duration=segment_duration or DEFAULT_SEGMENT_DURATION,
+        decimation=decimation or 1,
+        codec=codec or DEFAULT_CODEC,
+    ).start()
@@ -0,0 +1,114 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from detection.backgrounds import BACKGROUND_MODELS
+from detection.grids import GridDetector
+from detection.motion import MotionDetector
+from pipeline.headless import RNG_SEED, HeadlessRunner
+from utils.app_settings import AppSettings
+
+# benchmarks each background model (see detection/backgrounds.py) on a video
+# run it with: python -m pipeline.benchmark tests/fixtures/video.mp4
+# each model runs in its own process, so that memory usage can be attributed to it
+
+DEFAULT_SOURCE = "tests/fixtures/video.mp4"
+
+
+# resident memory of the current process in bytes, or None if we can't tell
+def get_memory():
+    try:
+        # current usage, only available on Linux
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        # not available on Windows
+        return None
+    # fall back to peak usage, which is less accurate
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in bytes on macOS and in kilobytes everywhere else
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def load_frames(settings: AppSettings, source: str):
+    runner = HeadlessRunner(settings, source=source, output_file="unused")
+    runner.open()
+    try:
+        frames = []
+        frame = runner.read_frame()
+        while frame is not None:
+            frames.append(frame)
+            frame = runner.read_frame()
+    finally:
+        runner.close()
+    return frames
+
+
+def benchmark_model(method: str, source: str, keep_defaults: bool):
+    settings = AppSettings(keep_defaults=keep_defaults)
+    settings.set("motion.method", method)
+    frames = load_frames(settings, source)
+    if len(frames) == 0:
+        raise Exception(f"Could not read frames from {source}")
+    grid = GridDetector(frames[0]).detect()
+
+    frame_count = 0
+    detector = MotionDetector(
+        settings, clock=lambda: frame_count / 30, grid=grid, seed=RNG_SEED
+    )
+    # frames are already loaded, so anything above this is used by the model
+    baseline = get_memory()
+    contours = 0
+    started = time.perf_counter()
+    for frame in frames:
+        frame_count += 1
+        contours += len(detector.detect(frame))
+    duration = time.perf_counter() - started
+    # measured while the detector is still alive
+    peak = get_memory()
+    detector.close()
+
+    return {
+        "method": method,
+        "frames": len(frames),
+        "fps": len(frames) / duration if duration > 0 else 0,
+        "memory": None if peak is None else max(0, peak - baseline),
+        "contours": contours,
+    }
+
+
+def format_result(result):
+    memory = result["memory"]
+    memory = "n/a" if memory is None else f"{memory / 1024 / 1024:.1f} MB"
+    return (
+        f"{result['method']:<16}{result['fps']:>10.1f}{memory:>12}"
+        f"{result['contours'] / result['frames']:>16.1f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source", nargs="?", default=DEFAULT_SOURCE)
+    parser.add_argument(
+        "--methods", nargs="+", choices=list(BACKGROUND_MODELS), help="Methods to run"
+    )
+    parser.add_argument("--use-settings", help="Use settings.json", action="store_true")
+    args = parser.parse_args()
+
+    print(f"{'method':<16}{'fps':>10}{'memory':>12}{'contours/frame':>16}")
+    for method in args.methods or BACKGROUND_MODELS:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            result = executor.submit(
+                benchmark_model, method, args.source, not args.use_settings
+            ).result()
+        print(format_result(result))
+
+
+if __name__ == "__main__":
+    main()
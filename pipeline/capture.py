@@ -0,0 +1,164 @@
+import threading
+from collections import deque
+
+import cv2
+import numpy as np
+
+# this class reads frames from a cv2.VideoCapture on a background thread,
+# so the next frame is decoded (or waited on, for a webcam) while the current one is processed
+# frames are decoded straight into a fixed ring of preallocated buffers, so reading doesn't allocate
+
+# there are two policies for when the consumer falls behind:
+# "latest": drop old frames and always return the newest one (best for live webcams)
+# "block": pause the producer until a buffer frees up, so no frame is ever lost (best for video files)
+LATEST = "latest"
+BLOCK = "block"
+POLICIES = [LATEST, BLOCK]
+
+DEFAULT_BUFFER_SIZE = 4
+# how long to wait for the producer thread when stopping
+JOIN_TIMEOUT = 2
+
+
+def is_webcam_source(source: str | int):
+    return isinstance(source, int) or (isinstance(source, str) and source.isdigit())
+
+
+def resolve_policy(policy: str | None, source: str | int):
+    if policy is None or policy == "auto":
+        return LATEST if is_webcam_source(source) else BLOCK
+    if policy not in POLICIES:
+        raise ValueError(f"Invalid capture policy: {policy}")
+    return policy
+
+
+class ThreadedCapture:
+    def __init__(self, cap, policy=BLOCK, buffer_size=DEFAULT_BUFFER_SIZE):
+        if policy not in POLICIES:
+            raise ValueError(f"Invalid capture policy: {policy}")
+        # we always need one buffer for the consumer and one for the producer
+        if buffer_size < 2:
+            raise ValueError("Buffer size must be at least 2")
+        self.cap = cap
+        self.policy = policy
+        self.buffer_size = buffer_size
+
+        # allocated from the first frame, since we don't know the shape until then
+        self.buffers: list[np.ndarray | None] = [None] * buffer_size
+        self.free = deque(range(buffer_size))
+        self.ready = deque()
+        # buffer currently held by the consumer, returned to the pool on the next read
+        self.leased = None
+
+        self.condition = threading.Condition()
+        self.thread = None
+        self.running = False
+        self.finished = False
+
+        # counters
+        self.frames_read = 0
+        self.frames_dropped = 0
+
+    @property
+    def depth(self):
+        # number of decoded frames waiting to be consumed
+        with self.condition:
+            return len(self.ready)
+
+    def stats(self):
+        with self.condition:
+            return {
+                "depth": len(self.ready),
+                "read": self.frames_read,
+                "dropped": self.frames_dropped,
+            }
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.produce, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(JOIN_TIMEOUT)
+            self.thread = None
+
+    def release(self):
+        self.stop()
+        self.cap.release()
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+    def take_free_buffer(self):
+        with self.condition:
+            while not self.free and self.running:
+                if self.policy == LATEST:
+                    # overwrite the oldest frame that hasn't been read yet
+                    self.frames_dropped += 1
+                    return self.ready.popleft()
+                self.condition.wait()
+            if not self.running:
+                return None
+            return self.free.popleft()
+
+    def produce(self):
+        while self.running:
+            index = self.take_free_buffer()
+            if index is None:
+                break
+            buffer = self.buffers[index]
+            # decode outside the lock so the consumer isn't blocked
+            ok, frame = self.cap.read(buffer) if buffer is not None else self.cap.read()
+            with self.condition:
+                if not ok:
+                    self.free.append(index)
+                    self.finished = True
+                    self.condition.notify_all()
+                    break
+                # read() reallocates if the source changed shape, so keep whatever it returned
+                self.buffers[index] = frame
+                self.ready.append(index)
+                self.frames_read += 1
+                self.condition.notify_all()
+
+    # same interface as cv2.VideoCapture.read()
+    # the returned frame is only valid until the next call, since its buffer is then reused
+    def read(self):
+        with self.condition:
+            if self.leased is not None:
+                self.free.append(self.leased)
+                self.leased = None
+                self.condition.notify_all()
+            while not self.ready and not self.finished and self.running:
+                self.condition.wait()
+            if not self.ready:
+                return False, None
+            if self.policy == LATEST:
+                while len(self.ready) > 1:
+                    self.free.append(self.ready.popleft())
+                    self.frames_dropped += 1
+                self.condition.notify_all()
+            self.leased = self.ready.popleft()
+            return True, self.buffers[self.leased]
+
+
+def open_capture(source: str | int, policy: str | None = None, buffer_size=None):
+    if isinstance(source, str) and source.isdigit():
+        # sources from environment variables are always strings
+        source = int(source)
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise IOError(f"Unable to open video source: {source}")
+    return ThreadedCapture(
+        cap,
+        policy=resolve_policy(policy, source),
+        buffer_size=buffer_size or DEFAULT_BUFFER_SIZE,
+    ).start()
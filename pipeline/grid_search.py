@@ -0,0 +1,131 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Callable
+
+from detection.grids import DetectionCancelled, GridDetector
+
+# this class runs grid detection on background threads, so that the window stays responsive while it runs
+# several parameter sets (see CANDIDATES) are tried at the same time, and the grid with the best score wins
+# (see GridDetector.get_score), which catches frames where the default thresholds find too many or too few circles
+# OpenCV releases the GIL, so the candidates really do run in parallel
+
+# progress is reported by each detector as it goes (see GridDetector.advance) and summed over all candidates
+# cancelling only takes effect between steps, since a single HoughCircles call can't be interrupted
+
+# keyword arguments for GridDetector, the defaults come first so that they win ties
+CANDIDATES = [
+    {},
+    # stricter, for noisy frames where spurious circles end up on the lattice
+    {"final_param_2": 30},
+    # looser, for faint wells that would otherwise have to be filled in
+    {"final_param_2": 15},
+]
+
+
+class GridSearch:
+    def __init__(
+        self,
+        frame,
+        candidates: list[dict] | None = None,
+        on_done: Callable[["GridSearch"], None] | None = None,
+    ):
+        self.frame = frame
+        self.candidates = candidates if candidates is not None else CANDIDATES
+        if len(self.candidates) == 0:
+            raise ValueError("At least one candidate is required")
+        # called from a worker thread once every candidate has finished, unless the search was cancelled
+        self.on_done = on_done
+
+        self.lock = threading.Lock()
+        self.cancel_event = threading.Event()
+        self.done_event = threading.Event()
+        self.detectors: list[GridDetector] = []
+        self.futures: list[Future] = []
+        # (steps done, total steps) of each candidate
+        self.steps = [(0, 0)] * len(self.candidates)
+        self.remaining = len(self.candidates)
+
+        # results
+        self.detector: GridDetector | None = None
+        self.grid = None
+        self.error: Exception | None = None
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    @property
+    def done(self):
+        return self.done_event.is_set()
+
+    # from 0 to 1
+    def get_progress(self):
+        with self.lock:
+            done = sum(step[0] for step in self.steps)
+            total = sum(step[1] for step in self.steps)
+        return done / total if total > 0 else 0.0
+
+    def start(self):
+        executor = ThreadPoolExecutor(
+            max_workers=len(self.candidates), thread_name_prefix="grid-search"
+        )
+        for index, params in enumerate(self.candidates):
+            detector = GridDetector(
+                self.frame,
+                progress=partial(self.report, index),
+                cancelled=self.cancel_event.is_set,
+                **params,
+            )
+            self.detectors.append(detector)
+        # submitted after every detector exists, so that finish always sees all of them
+        for detector in self.detectors:
+            future = executor.submit(detector.detect)
+            self.futures.append(future)
+            future.add_done_callback(self.finish_candidate)
+        # threads exit once their candidate is done
+        executor.shutdown(wait=False)
+        return self
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    # returns False if the search is still running after `timeout` seconds
+    # once it returns True, on_done has been called (unless the search was cancelled)
+    def wait(self, timeout: float | None = None):
+        return self.done_event.wait(timeout)
+
+    def report(self, index: int, done: int, total: int):
+        with self.lock:
+            self.steps[index] = (done, total)
+
+    def finish_candidate(self, _):
+        with self.lock:
+            self.remaining -= 1
+            if self.remaining > 0:
+                return
+        self.finish()
+
+    def finish(self):
+        for detector, future in zip(self.detectors, self.futures):
+            error = future.exception()
+            if error is not None:
+                # the first real error is the most useful one to show
+                if self.error is None or isinstance(self.error, DetectionCancelled):
+                    self.error = error
+                continue
+            if self.detector is None or detector.score > self.detector.score:
+                self.detector = detector
+        if self.detector is not None:
+            self.grid = self.detector.grid
+            self.error = None
+        try:
+            if self.on_done is not None and not self.cancelled:
+                self.on_done(self)
+        finally:
+            # set last, so that once wait returns, on_done has already run
+            self.done_event.set()
+
+
+def open_grid_search(frame, on_done: Callable[[GridSearch], None] | None = None):
+    return GridSearch(frame, on_done=on_done).start()
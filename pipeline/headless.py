@@ -0,0 +1,207 @@
+import datetime
+import time
+
+import cv2
+
+from detection.border import BorderDetector
+from detection.drift import open_drift_tracker
+from detection.grids import GridDetector
+from detection.median import MedianFrame
+from handlers.event_log import EventLogHandler, get_event_log_dir
+from handlers.file_interval import FileIntervalHandler
+from handlers.frame import FrameHandler
+from pipeline.capture import BLOCK, open_capture
+from pipeline.writer import open_writer
+from utils.app_settings import AppSettings
+from utils.frame import get_processing_size, to_processing_resolution
+
+# this class runs the recording pipeline without Tkinter
+# the UI reads one frame every video.frame_delay ms and flushes intervals on a wall-clock timer,
+# which is slow for video files and makes the output depend on how busy the machine is
+# here, we read frames as fast as the source can decode them
+# and time intervals by each frame's position in the video (see get_video_time),
+# so the same video and settings always produce the same totals
+
+# the KNN background subtractor samples from OpenCV's RNG,
+# so we reseed it on every run (including on worker threads) to make results reproducible
+RNG_SEED = 0
+
+
+class HeadlessRunner:
+    def __init__(
+        self,
+        settings: AppSettings,
+        source: str | int | None = None,
+        output_file: str | None = None,
+        start_time: datetime.datetime | None = None,
+    ):
+        self.settings = settings
+        self.source = source if source is not None else settings.get("video.source")
+        self.output_file = output_file or settings.get("recording.output_file")
+        if not self.output_file:
+            raise ValueError("No output file specified")
+        self.interval = int(settings.get("recording.interval"))
+        # used as the base for interval timestamps, which are offset by the video time
+        self.start_time = start_time or datetime.datetime.now()
+
+        self.processing_size = get_processing_size(settings)
+
+        self.cap = None
+        self.fps = None
+        self.border = None
+        self.grid = None
+        self.frame_count = 0
+
+    def open(self):
+        # decode on a separate thread, but never drop frames
+        cap = open_capture(
+            self.source,
+            policy=BLOCK,
+            buffer_size=self.settings.get("video.buffer_size"),
+        )
+        self.cap = cap
+        self.fps = cap.get(cv2.CAP_PROP_FPS)
+        if not self.fps or self.fps <= 0:
+            # some sources don't report a frame rate, so fall back to the UI's rate
+            self.fps = 1000 / self.settings.get("video.frame_delay")
+
+    def close(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+    # mirrors ScanCanvas / RecordCanvas: crop to the border, then scale to the processing resolution
+    def read_frame(self):
+        ok, frame = self.cap.read()
+        if not ok:
+            return None
+        if self.border is None:
+            self.border = BorderDetector().get_border(frame)
+        (x, y, w, h) = self.border
+        frame = to_processing_resolution(
+            frame[y : y + h, x : x + w], self.processing_size
+        )
+        self.frame_count += 1
+        return frame
+
+    # like the scan state, detects the border and grid on the median of the first scan.frames frames
+    # returns the frame to detect the grid on, or None to use the first frame
+    def scan(self):
+        scan_frames = int(self.settings.get("scan.frames") or 1)
+        if scan_frames <= 1:
+            return None
+        median_frame = MedianFrame(scan_frames)
+        while not median_frame.is_full:
+            ok, frame = self.cap.read()
+            if not ok:
+                break
+            median_frame.add(frame)
+        if len(median_frame) == 0:
+            raise Exception("Could not read frame")
+        frame = median_frame.get()
+        self.border = BorderDetector().get_border(frame)
+        (x, y, w, h) = self.border
+        # start over, so that the scanned frames are processed too
+        self.close()
+        self.open()
+        return to_processing_resolution(
+            frame[y : y + h, x : x + w], self.processing_size
+        )
+
+    # presentation time of the current frame in seconds, so the first frame is at 0
+    # derived from the frame count so that it's stable across runs
+    def get_video_time(self):
+        return (self.frame_count - 1) / self.fps
+
+    def run(self):
+        self.open()
+        try:
+            return self.process()
+        finally:
+            self.close()
+
+    def process(self):
+        started = time.perf_counter()
+        scan_frame = self.scan()
+        frame = self.read_frame()
+        if frame is None:
+            raise Exception("Could not read frame")
+        # the first frame is used for grid detection, like in the scan state
+        reference = scan_frame if scan_frame is not None else frame
+        self.grid = GridDetector(reference).detect()
+
+        handler = FileIntervalHandler(
+            self.grid,
+            self.output_file,
+            interval=self.interval,
+            base_interval=self.settings.get("recording.base_interval"),
+            activity_interval=self.settings.get("recording.activity_interval"),
+            start_time=self.start_time,
+            writer=self.make_writer(),
+        )
+        event_log = None
+        if self.settings.get("recording.event_log"):
+            event_log = EventLogHandler(
+                get_event_log_dir(self.output_file),
+                handler,
+                grid=self.grid,
+                start_time=self.start_time,
+                max_bytes=self.settings.get("recording.event_log_max_bytes"),
+                max_duration=self.settings.get("recording.event_log_max_duration"),
+                writer=self.make_writer(),
+            )
+        frame_handler = FrameHandler(
+            self.grid,
+            self.settings,
+            event_log or handler,
+            clock=self.get_video_time,
+            seed=RNG_SEED,
+            drift=self.make_drift_tracker(reference),
+        )
+
+        try:
+            while frame is not None:
+                frame_handler.handle(frame, self.frame_count)
+                frame = self.read_frame()
+        finally:
+            frame_handler.close()
+            # waits for the writers to catch up, and raises anything they failed to write
+            try:
+                if event_log is not None:
+                    event_log.close()
+            finally:
+                handler.close()
+
+        duration = time.perf_counter() - started
+        return {
+            "frames": self.frame_count,
+            "intervals": handler.index,
+            "seconds": duration,
+            "fps": self.frame_count / duration if duration > 0 else 0,
+            "writer": handler.writer.stats(),
+            "events": event_log.records_written if event_log is not None else None,
+            "drift": (
+                frame_handler.drift.stats() if frame_handler.drift is not None else None
+            ),
+        }
+
+    # checks run on this thread at video time, so corrections land on the same frame every run
+    def make_drift_tracker(self, reference):
+        if not self.settings.get("drift.interval"):
+            return None
+        return open_drift_tracker(
+            reference,
+            self.grid,
+            interval=self.settings.get("drift.interval"),
+            min_shift=self.settings.get("drift.min_shift"),
+            max_shift=self.settings.get("drift.max_shift"),
+            clock=self.get_video_time,
+            background=False,
+        )
+
+    def make_writer(self):
+        return open_writer(
+            fsync=self.settings.get("recording.fsync"),
+            fsync_interval=self.settings.get("recording.fsync_interval"),
+            image_workers=self.settings.get("recording.image_workers"),
+        )
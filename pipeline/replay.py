@@ -0,0 +1,225 @@
+import argparse
+import time
+
+import numpy as np
+
+from custom_types.grid import Grid
+from custom_types.motion import MotionBatch, MotionEventHandler
+from handlers.event_log import (
+    NO_WELL,
+    get_session,
+    get_start_time,
+    list_event_logs,
+    read_event_log,
+    read_grid,
+)
+from handlers.file_interval import FileIntervalHandler
+from utils.app_settings import AppSettings
+from utils.arg_parser import positive_int
+
+# regenerates interval outputs from event logs (see handlers/event_log.py), without running detection again
+# run it with: python -m pipeline.replay events --output output.txt --interval 60
+
+# events are grouped into the base bins of handlers/intervals.py with NumPy,
+# and each bin is passed to the handlers as a single MotionBatch, so there's no per-frame work
+# distances are added up in the same order as in the live run,
+# so given the same intervals, the output is byte-identical
+
+# records are processed in chunks, so that large log files don't have to fit in memory
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+
+# base bin of each time, computed exactly like IntervalBins.advance does
+def get_bins(times, origin: float, base_interval: float):
+    elapsed = times - origin
+    bins = np.floor(elapsed / base_interval)
+    # the division can be off by one near a boundary, so check against the same products as IntervalBins
+    bins[(bins + 1) * base_interval <= elapsed] += 1
+    bins[bins * base_interval > elapsed] -= 1
+    return bins.astype(np.int64)
+
+
+class EventReplay:
+    def __init__(
+        self,
+        handler: MotionEventHandler,
+        grid: Grid,
+        base_interval: float,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+    ):
+        self.handler = handler
+        self.items = grid.items
+        self.base_interval = base_interval
+        self.chunk_size = chunk_size
+        self.origin = None
+        self.last_time = None
+        self.last_frame = None
+
+        # counters
+        self.records = 0
+        self.events = 0
+        self.batches = 0
+
+    def replay(self, records):
+        for start in range(0, len(records), self.chunk_size):
+            # copied out of the memory map one chunk at a time
+            self.replay_chunk(np.array(records[start : start + self.chunk_size]))
+
+    def replay_chunk(self, records):
+        if len(records) == 0:
+            return
+        times = records["time"]
+        if self.origin is None:
+            self.origin = times[0]
+        bins = get_bins(times, self.origin, self.base_interval)
+        # records are in time order, so each bin is a contiguous run
+        starts = np.flatnonzero(bins[1:] != bins[:-1]) + 1
+        starts = np.concatenate(([0], starts))
+        ends = np.append(starts[1:], len(records))
+
+        # columns of the actual events, so each bin is just a slice of them
+        is_event = records["well"] != NO_WELL
+        events = records[is_event]
+        indices = events["well"].astype(np.intp)
+        centers = np.column_stack((events["x"], events["y"])).astype(np.float64)
+        areas = events["area"].astype(np.int64)
+        frame_counts = events["frame"].astype(np.int64)
+        distances = events["distance"]
+        # not logged, so these are left empty
+        bounds = np.zeros((len(events), 4), np.int32)
+        event_starts = np.cumsum(is_event) - is_event
+        event_ends = np.append(event_starts[starts[1:]], len(events))
+        event_starts = event_starts[starts]
+
+        for start, event_start, event_end in zip(starts, event_starts, event_ends):
+            events_slice = slice(event_start, event_end)
+            self.handler.handle_frame(
+                MotionBatch(
+                    self.items,
+                    int(records["frame"][start]),
+                    float(times[start]),
+                    None,
+                    None,
+                    indices[events_slice],
+                    centers[events_slice],
+                    areas[events_slice],
+                    bounds[events_slice],
+                    # the last point isn't logged either, only the distance to it
+                    centers[events_slice],
+                    areas[events_slice],
+                    bounds[events_slice],
+                    frame_counts[events_slice],
+                    distances=distances[events_slice],
+                )
+            )
+
+        self.last_time = float(times[-1])
+        self.last_frame = int(records["frame"][-1])
+        self.records += len(records)
+        self.events += len(events)
+        self.batches += len(starts)
+
+    # the live run writes every interval that ended before its last frame, so do the same here
+    def finish(self):
+        if self.last_time is None:
+            return
+        self.handler.handle_frame(
+            MotionBatch(
+                self.items,
+                self.last_frame,
+                self.last_time,
+                None,
+                None,
+                np.zeros(0, np.intp),
+                np.zeros((0, 2), np.float64),
+                np.zeros(0, np.int64),
+                np.zeros((0, 4), np.int32),
+                np.zeros((0, 2), np.float64),
+                np.zeros(0, np.int64),
+                np.zeros((0, 4), np.int32),
+                np.zeros(0, np.int64),
+            )
+        )
+
+
+def replay(
+    directory: str,
+    output_file: str,
+    interval,
+    base_interval=1,
+    activity_interval=None,
+    session: str | None = None,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+):
+    started = time.perf_counter()
+    paths = list_event_logs(directory, session or "*")
+    if len(paths) == 0:
+        raise ValueError(f"No event logs found in {directory}")
+    sessions = sorted(set(get_session(path) for path in paths))
+    if len(sessions) > 1:
+        raise ValueError(
+            f"Found multiple sessions, pick one with --session: {', '.join(sessions)}"
+        )
+    grid = read_grid(directory, sessions[0])
+    header, _ = read_event_log(paths[0])
+
+    handler = FileIntervalHandler(
+        grid,
+        output_file,
+        interval=interval,
+        base_interval=base_interval,
+        activity_interval=activity_interval,
+        start_time=get_start_time(header),
+    )
+    event_replay = EventReplay(handler, grid, base_interval, chunk_size=chunk_size)
+    try:
+        for path in paths:
+            _, records = read_event_log(path)
+            event_replay.replay(records)
+        event_replay.finish()
+    finally:
+        handler.close()
+
+    duration = time.perf_counter() - started
+    return {
+        "records": event_replay.records,
+        "events": event_replay.events,
+        "intervals": handler.index,
+        "seconds": duration,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directory", help="Directory with event logs")
+    parser.add_argument("--output", required=True, help="Output file")
+    parser.add_argument(
+        "--interval", type=positive_int, help="Output interval in whole seconds"
+    )
+    parser.add_argument("--base-interval", type=float, help="Base interval in seconds")
+    parser.add_argument(
+        "--activity-interval", type=float, help="Activity interval in seconds"
+    )
+    parser.add_argument("--session", help="Session to replay, if there are several")
+    parser.add_argument("--use-settings", help="Use settings.json", action="store_true")
+    args = parser.parse_args()
+
+    settings = AppSettings(keep_defaults=not args.use_settings)
+    stats = replay(
+        args.directory,
+        args.output,
+        interval=args.interval or settings.get("recording.interval"),
+        base_interval=args.base_interval or settings.get("recording.base_interval"),
+        activity_interval=(
+            args.activity_interval or settings.get("recording.activity_interval")
+        ),
+        session=args.session,
+    )
+    print(
+        f"Replayed {stats['events']} events into {stats['intervals']} intervals "
+        f"in {stats['seconds']:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+# this class does the file writes of a recording on background threads, for storage with slow or uneven writes
+# (e.g. a network share or an SD card)
+# text and binary data are queued and appended in batches to files that are kept open, and images are encoded on a small pool of threads
+
+# there are three policies for how often files are synced to disk with fsync:
+# "always": after every batch (safest, but slow on some storage)
+# "interval": at most once every fsync_interval seconds
+# "never": leave it to the OS
+ALWAYS = "always"
+INTERVAL = "interval"
+NEVER = "never"
+FSYNC_POLICIES = [ALWAYS, INTERVAL, NEVER]
+
+DEFAULT_FSYNC_INTERVAL = 60
+DEFAULT_IMAGE_WORKERS = 2
+# images that can wait to be encoded before new ones are dropped,
+# since unlike rows, each one holds a whole frame in memory
+DEFAULT_MAX_PENDING_IMAGES = 8
+# queued in place of data to empty a file, see create
+TRUNCATE = object()
+
+
+class AsyncWriter:
+    def __init__(
+        self,
+        fsync=INTERVAL,
+        fsync_interval=DEFAULT_FSYNC_INTERVAL,
+        image_workers=DEFAULT_IMAGE_WORKERS,
+        max_pending_images=DEFAULT_MAX_PENDING_IMAGES,
+        error_queue=None,
+        clock=time.monotonic,
+    ):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Invalid fsync policy: {fsync}")
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.max_pending_images = max_pending_images
+        # errors are put on the queue when given (e.g. to be raised by the UI), and raised on close otherwise
+        self.error_queue = error_queue
+        self.error = None
+        self.clock = clock
+
+        # (filename, text or bytes, time queued), where None closes the file and TRUNCATE empties it
+        self.pending = deque()
+        # only used by the writer thread
+        self.files = {}
+        self.last_fsync = clock()
+        self.image_executor = ThreadPoolExecutor(
+            max_workers=max(image_workers, 1), thread_name_prefix="image-writer"
+        )
+
+        self.condition = threading.Condition()
+        self.thread = None
+        self.running = False
+
+        # counters
+        self.rows_written = 0
+        self.bytes_written = 0
+        self.max_backlog = 0
+        self.images_pending = 0
+        self.images_written = 0
+        self.images_dropped = 0
+        self.max_lag = 0
+
+    # how far behind the writer is, see README.md
+    def stats(self):
+        with self.condition:
+            return {
+                "backlog": len(self.pending),
+                "max_backlog": self.max_backlog,
+                # seconds since the oldest pending row was queued
+                "lag": self.clock() - self.pending[0][2] if self.pending else 0,
+                "max_lag": self.max_lag,
+                "rows": self.rows_written,
+                "bytes": self.bytes_written,
+                "images_pending": self.images_pending,
+                "images": self.images_written,
+                "images_dropped": self.images_dropped,
+            }
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    # writes everything that's still queued before returning
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.image_executor.shutdown(wait=True)
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def report(self, error: Exception):
+        if self.error_queue is not None:
+            self.error_queue.put(error)
+        elif self.error is None:
+            self.error = error
+
+    # appends text (or bytes, for binary files) to a file, never blocks
+    def write(self, filename: str, data: str | bytes):
+        self.queue(filename, data)
+
+    # replaces a file (e.g. one left over from an earlier run) with `data`, never blocks
+    def create(self, filename: str, data: str | bytes):
+        self.queue(filename, TRUNCATE)
+        self.queue(filename, data)
+
+    # closes a file once everything queued before it has been written, e.g. after rotating to a new one
+    def close_file(self, filename: str):
+        self.queue(filename, None)
+
+    def queue(self, filename: str, data: str | bytes | None):
+        with self.condition:
+            self.pending.append((filename, data, self.clock()))
+            self.max_backlog = max(self.max_backlog, len(self.pending))
+            self.condition.notify_all()
+
+    # encodes and saves an image, returns False if it was dropped because too many are pending
+    # the image is encoded later, so the caller must not modify it afterwards
+    def write_image(self, path: str, image):
+        with self.condition:
+            if self.images_pending >= self.max_pending_images:
+                self.images_dropped += 1
+                return False
+            self.images_pending += 1
+        self.image_executor.submit(self.encode_image, path, image)
+        return True
+
+    def encode_image(self, path: str, image):
+        try:
+            if not cv2.imwrite(path, image):
+                raise IOError(f"Unable to write image: {path}")
+            with self.condition:
+                self.images_written += 1
+        except Exception as e:
+            self.report(e)
+        finally:
+            with self.condition:
+                self.images_pending -= 1
+
+    def get_file(self, filename: str, binary: bool):
+        f = self.files.get(filename)
+        if f is None:
+            f = open(filename, "ab" if binary else "a")
+            self.files[filename] = f
+        return f
+
+    # writes consecutive parts at once, returns the number of bytes (or characters) written
+    def write_parts(self, filename: str, parts: list):
+        if not parts:
+            return 0
+        binary = isinstance(parts[0], bytes)
+        data = b"".join(parts) if binary else "".join(parts)
+        f = self.get_file(filename, binary)
+        f.write(data)
+        f.flush()
+        return len(data)
+
+    def release_file(self, f, sync: bool):
+        f.flush()
+        if sync:
+            os.fsync(f.fileno())
+        f.close()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and self.running:
+                    self.condition.wait()
+                if not self.pending:
+                    break
+                batch = list(self.pending)
+                self.pending.clear()
+            self.write_batch(batch)
+        # sync whatever's left, regardless of policy
+        self.close_files(sync=self.fsync != NEVER)
+
+    def write_batch(self, batch):
+        # group by file, so each one gets a single write per batch
+        parts_by_file = {}
+        for filename, data, _ in batch:
+            parts_by_file.setdefault(filename, []).append(data)
+        written = 0
+        try:
+            for filename, parts in parts_by_file.items():
+                run = []
+                for part in parts:
+                    if part is not None and part is not TRUNCATE:
+                        run.append(part)
+                        continue
+                    # everything before the close goes into the file first
+                    written += self.write_parts(filename, run)
+                    run = []
+                    f = self.files.pop(filename, None)
+                    if f is not None:
+                        self.release_file(f, sync=self.fsync != NEVER)
+                    if part is TRUNCATE:
+                        # the next part reopens it for appending
+                        open(filename, "w").close()
+                written += self.write_parts(filename, run)
+            if self.should_sync():
+                for f in self.files.values():
+                    os.fsync(f.fileno())
+                self.last_fsync = self.clock()
+        except Exception as e:
+            self.report(e)
+        with self.condition:
+            self.rows_written += len(batch)
+            self.bytes_written += written
+            self.max_lag = max(self.max_lag, self.clock() - batch[0][2])
+
+    def should_sync(self):
+        if self.fsync == ALWAYS:
+            return True
+        if self.fsync == INTERVAL:
+            return self.clock() - self.last_fsync >= self.fsync_interval
+        return False
+
+    def close_files(self, sync: bool):
+        for f in self.files.values():
+            try:
+                self.release_file(f, sync)
+            except Exception as e:
+                self.report(e)
+        self.files = {}
+
+
+def open_writer(
+    fsync: str | None = None,
+    fsync_interval: float | None = None,
+    image_workers: int | None = None,
+    error_queue=None,
+):
+    return AsyncWriter(
+        fsync=fsync or INTERVAL,
+        fsync_interval=(
+            fsync_interval if fsync_interval is not None else DEFAULT_FSYNC_INTERVAL
+        ),
+        image_workers=image_workers or DEFAULT_IMAGE_WORKERS,
+        error_queue=error_queue,
+    ).start()
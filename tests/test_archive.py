@@ -0,0 +1,229 @@
+import datetime
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+import cv2
+import numpy as np
+
+from pipeline.archive import (
+    INDEX_HEADER,
+    SEGMENTS_HEADER,
+    VideoArchive,
+    get_archive_dir,
+)
+from pipeline.writer import AsyncWriter
+
+
+class TestVideoArchive(unittest.TestCase):
+    fps = 10
+    shape = (48, 64, 3)
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.writer = AsyncWriter().start()
+
+    def tearDown(self):
+        self.writer.close()
+        self.directory.cleanup()
+
+    def make_archive(self, **kwargs):
+        return VideoArchive(
+            self.directory.name, self.fps, self.writer, **kwargs
+        ).start()
+
+    def make_frame(self, value):
+        return np.full(self.shape, value, np.uint8)
+
+    def read_segment(self, name):
+        cap = cv2.VideoCapture(os.path.join(self.directory.name, name))
+        frames = []
+        ok, frame = cap.read()
+        while ok:
+            frames.append(frame)
+            ok, frame = cap.read()
+        cap.release()
+        return frames
+
+    def read_index(self, name="index.txt"):
+        self.writer.close()
+        with open(os.path.join(self.directory.name, name), "r") as f:
+            return f.read()
+
+    def test_segments(self):
+        archive = self.make_archive(segment_duration=1)
+        for i in range(25):
+            if i % 5 == 0:
+                archive.mark(i // 5 + 1)
+            archive.add(self.make_frame(i * 10), i / self.fps)
+        archive.close()
+
+        # split by frame time, 1 second each
+        names = sorted(name for name in os.listdir(self.directory.name))
+        self.assertEqual(
+            names,
+            [
+                "index.txt",
+                "segment_00000.mp4",
+                "segment_00001.mp4",
+                "segment_00002.mp4",
+                "segments.txt",
+            ],
+        )
+        segments = [self.read_segment(name) for name in names[1:4]]
+        self.assertEqual([len(frames) for frames in segments], [10, 10, 5])
+        self.assertEqual(
+            archive.stats(), {"backlog": 0, "frames": 25, "repeated": 0, "segments": 3}
+        )
+        # intervals point at the segment and frame they start on
+        self.assertEqual(
+            self.read_index(),
+            INDEX_HEADER
+            + "1\tsegment_00000.mp4\t0\n"
+            + "2\tsegment_00000.mp4\t5\n"
+            + "3\tsegment_00001.mp4\t0\n"
+            + "4\tsegment_00001.mp4\t5\n"
+            + "5\tsegment_00002.mp4\t0\n",
+        )
+        # lossy, but close enough to tell frames apart
+        frame = segments[1][5]
+        self.assertAlmostEqual(frame.mean(), 150, delta=5)
+
+    def test_measured_fps(self):
+        # the loop only manages 4 frames per second, not the 10 it was asked for
+        archive = self.make_archive(segment_duration=5)
+        for i in range(30):
+            archive.add(self.make_frame(i * 5), i / 4)
+        archive.close()
+
+        fps = []
+        for name in ["segment_00000.mp4", "segment_00001.mp4"]:
+            cap = cv2.VideoCapture(os.path.join(self.directory.name, name))
+            fps.append(cap.get(cv2.CAP_PROP_FPS))
+            cap.release()
+        self.assertAlmostEqual(fps[0], 4, delta=0.1)
+        self.assertAlmostEqual(fps[1], 4, delta=0.1)
+        self.assertEqual(
+            self.read_index("segments.txt"),
+            SEGMENTS_HEADER
+            + "segment_00000.mp4\t0.000\t5.000\t20\n"
+            + "segment_00001.mp4\t5.000\t7.250\t10\n",
+        )
+
+    def test_decimation(self):
+        archive = self.make_archive(decimation=3)
+        archive.mark(1)
+        archive.add(self.make_frame(0), 0)
+        archive.add(self.make_frame(0), 0.1)
+        # the next interval starts on the next frame that's kept
+        archive.mark(2)
+        for i in range(2, 10):
+            archive.add(self.make_frame(0), i / self.fps)
+        archive.close()
+
+        self.assertEqual(archive.stats()["frames"], 4)
+        self.assertEqual(archive.fps, self.fps / 3)
+        self.assertEqual(
+            self.read_index(),
+            INDEX_HEADER + "1\tsegment_00000.mp4\t0\n2\tsegment_00000.mp4\t1\n",
+        )
+
+    def test_repeats_frames(self):
+        # nothing is encoded until the archive is started
+        archive = VideoArchive(
+            self.directory.name, self.fps, self.writer, max_pending_frames=2
+        )
+        for i in range(5):
+            archive.add(self.make_frame(i * 50), i / self.fps)
+        archive.start()
+        archive.close()
+
+        # frames that didn't fit repeat the last one, so offsets stay the same
+        self.assertEqual(archive.stats()["frames"], 5)
+        self.assertEqual(archive.stats()["repeated"], 3)
+        frames = self.read_segment("segment_00000.mp4")
+        self.assertEqual(len(frames), 5)
+        self.assertAlmostEqual(frames[4].mean(), 50, delta=5)
+
+    def test_copies_frames(self):
+        archive = VideoArchive(self.directory.name, self.fps, self.writer)
+        # e.g. a capture buffer that's reused for the next frame
+        frame = self.make_frame(200)
+        archive.add(frame, 0)
+        frame[:] = 0
+        archive.start()
+        archive.close()
+
+        frames = self.read_segment("segment_00000.mp4")
+        self.assertAlmostEqual(frames[0].mean(), 200, delta=5)
+
+    def test_error(self):
+        writer = MagicMock()
+        archive = VideoArchive(self.directory.name, self.fps, writer, codec="????")
+        archive.start()
+        archive.add(self.make_frame(0), 0)
+        archive.add(self.make_frame(0), 0.1)
+        archive.close()
+
+        writer.report.assert_called_once()
+        self.assertEqual(archive.stats()["frames"], 0)
+
+    def test_refuses_existing_archive(self):
+        archive = self.make_archive()
+        archive.add(self.make_frame(0), 0)
+        archive.close()
+
+        # a second recording into the same directory would overwrite the first one's segments
+        with self.assertRaises(FileExistsError):
+            self.make_archive()
+        self.assertEqual(len(self.read_segment("segment_00000.mp4")), 1)
+
+    def test_get_archive_dir(self):
+        start_time = datetime.datetime(2022, 1, 1, 12, 30, 15)
+
+        self.assertEqual(
+            get_archive_dir(os.path.join("data", "output.txt"), start_time),
+            os.path.join("data", "archive", "20220101123015"),
+        )
+
+    def test_write_error(self):
+        writer = MagicMock()
+        archive = VideoArchive(self.directory.name, self.fps, writer)
+        video = MagicMock()
+        video.write.side_effect = IOError("disk full")
+        archive.open_segment = MagicMock(return_value=video)
+        archive.start()
+        archive.add(self.make_frame(0), 0)
+        archive.add(self.make_frame(0), 0.1)
+        archive.close()
+
+        writer.report.assert_called_once()
+        # released once, and the rest of the segment is skipped
+        video.release.assert_called_once()
+        self.assertEqual(video.write.call_count, 1)
+
+    def test_repeat_without_frame(self):
+        writer = MagicMock()
+        archive = VideoArchive(
+            self.directory.name,
+            self.fps,
+            writer,
+            segment_duration=1,
+            codec="????",
+            max_pending_frames=1,
+        )
+        archive.add(self.make_frame(0), 0)
+        # doesn't fit, so it repeats a frame that's never written
+        archive.add(self.make_frame(0), 1.5)
+        archive.start()
+        archive.close()
+
+        # only the first segment failed to open
+        writer.report.assert_called_once()
+        self.assertEqual(archive.stats()["repeated"], 1)
+        self.assertEqual(archive.stats()["frames"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,7 @@
 import argparse
 import unittest
 
-from utils.arg_parser import tuning_type
+from utils.arg_parser import positive_int, tuning_type
 
 
 class TestArgParser(unittest.TestCase):
@@ -14,3 +14,14 @@ class TestArgParser(unittest.TestCase):
             "Invalid tuning type: invalid. Valid types are: .*",
         ):
             tuning_type("invalid")
+
+    def test_positive_int(self):
+        self.assertEqual(positive_int("60"), 60)
+
+    def test_positive_int_invalid(self):
+        for value in ["0", "-1", "0.5", "1.5", "abc"]:
+            with self.subTest(value=value):
+                with self.assertRaisesRegex(
+                    argparse.ArgumentTypeError, f"Invalid value: {value}.*"
+                ):
+                    positive_int(value)
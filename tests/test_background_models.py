@@ -0,0 +1,64 @@
+import unittest
+
+import cv2
+import numpy as np
+
+from detection.backgrounds import BACKGROUND_MODELS, make_background_model
+from detection.motion import MotionDetector
+from utils.app_settings import AppSettings
+
+
+def make_frame(x):
+    # gray background with a dark square at x
+    frame = np.full((120, 160), 200, np.uint8)
+    frame[50:60, x : x + 10] = 20
+    return frame
+
+
+class TestBackgroundModels(unittest.TestCase):
+    def setUp(self):
+        self.settings = AppSettings(keep_defaults=True)
+        self.detector = MotionDetector(self.settings)
+
+    def test_masks(self):
+        for method in BACKGROUND_MODELS:
+            with self.subTest(method=method):
+                model = make_background_model(method, self.detector)
+                for i in range(5):
+                    mask = model.apply(make_frame(20))
+                self.assertEqual(mask.shape, (120, 160))
+                self.assertEqual(mask.dtype, np.uint8)
+
+    def test_detect_moving_square(self):
+        for method in ["running_average", "diff"]:
+            with self.subTest(method=method):
+                model = make_background_model(method, self.detector)
+                for i in range(10):
+                    model.apply(make_frame(20))
+                mask = model.apply(make_frame(100))
+
+                # the square is picked up at its new position, and nothing above or below it
+                self.assertTrue(mask[50:60, 100:110].all())
+                self.assertFalse(mask[:40].any())
+                self.assertFalse(mask[70:].any())
+
+    def test_invalid_method(self):
+        with self.assertRaises(ValueError):
+            make_background_model("invalid", self.detector)
+
+        self.settings.set("motion.method", "invalid")
+        with self.assertRaises(ValueError):
+            MotionDetector(self.settings)
+
+    def test_detect_with_diff(self):
+        self.settings.set("motion.method", "diff")
+        detector = MotionDetector(self.settings)
+        for i in range(20):
+            frame = cv2.imread(f"tests/fixtures/frames/{i + 1}.jpg")
+            contours = detector.detect(frame)
+
+        self.assertGreater(len(contours), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+from detection.border import BorderDetector
+from detection.calibration import (
+    MAX_CALIBRATIONS,
+    Calibration,
+    CalibrationStore,
+    apply_motion_settings,
+    get_motion_settings,
+    make_fingerprint,
+)
+from detection.grids import GridDetector
+from utils.app_settings import AppSettings
+from utils.frame import to_processing_resolution
+
+
+class TestCalibration(unittest.TestCase):
+    processing_size = (640, 480)
+
+    @classmethod
+    def setUpClass(cls):
+        # the first frame, and one 5 seconds later
+        capture = cv2.VideoCapture("tests/fixtures/video.mp4")
+        cls.frames = []
+        for i in range(150):
+            _, frame = capture.read()
+            if i in (0, 149):
+                cls.frames.append(frame)
+        capture.release()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = CalibrationStore(self.directory, 0)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def calibrate(self, frame):
+        border = BorderDetector().get_border(frame)
+        (x, y, w, h) = border
+        scan_frame = to_processing_resolution(
+            frame[y : y + h, x : x + w], self.processing_size
+        )
+        return Calibration(
+            border,
+            GridDetector(scan_frame).detect(),
+            make_fingerprint(scan_frame),
+            frame.shape,
+            self.processing_size,
+            motion={"method": "mog2"},
+        )
+
+    def test_find(self):
+        calibration = self.calibrate(self.frames[0])
+        self.store.save(calibration)
+
+        # flies have moved, but the box hasn't
+        found = self.store.find(self.frames[-1], self.processing_size)
+
+        self.assertIsNotNone(found)
+        self.assertEqual(found.border, calibration.border)
+        self.assertEqual(found.grid.to_dict(), calibration.grid.to_dict())
+        self.assertEqual(found.motion, {"method": "mog2"})
+
+    def test_find_moved(self):
+        self.store.save(self.calibrate(self.frames[0]))
+
+        for shift in [(2, 0), (0, 2), (3, 0), (0, 3), (4, 4)]:
+            with self.subTest(shift=shift):
+                moved = np.roll(self.frames[-1], shift, axis=(0, 1))
+                self.assertIsNone(self.store.find(moved, self.processing_size))
+
+    def test_find_other_setup(self):
+        self.store.save(self.calibrate(self.frames[0]))
+
+        # the grid would be in the wrong coordinates
+        self.assertIsNone(self.store.find(self.frames[-1], (320, 240)))
+        self.assertIsNone(
+            self.store.find(cv2.resize(self.frames[-1], (640, 360)), (640, 480))
+        )
+        # calibrations are per source
+        other = CalibrationStore(self.directory, "video.mp4")
+        self.assertFalse(other.exists())
+        self.assertIsNone(other.find(self.frames[-1], self.processing_size))
+
+    def test_save_replaces_same_box(self):
+        self.store.save(self.calibrate(self.frames[0]))
+        self.store.save(self.calibrate(self.frames[-1]))
+
+        self.assertEqual(len(self.store.load()), 1)
+
+    def test_save_limit(self):
+        rng = np.random.default_rng(0)
+        for _ in range(MAX_CALIBRATIONS + 2):
+            calibration = self.calibrate(self.frames[0])
+            # a different box every time
+            calibration.fingerprint = rng.integers(0, 255, (64, 64), np.uint8)
+            self.store.save(calibration)
+
+        self.assertEqual(len(self.store.load()), MAX_CALIBRATIONS)
+
+    def test_invalid_file(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.store.file, "w") as f:
+            f.write("{")
+
+        self.assertEqual(self.store.load(), [])
+        self.assertIsNone(self.store.find(self.frames[0], self.processing_size))
+
+    def test_motion_settings(self):
+        settings = AppSettings(keep_defaults=True)
+        settings.set("motion.method", "mog2")
+
+        motion = get_motion_settings(settings)
+        settings.set("motion.method", "knn")
+        apply_motion_settings(settings, motion)
+
+        self.assertEqual(settings.get("motion.method"), "mog2")
+        # belongs to the machine, not the box
+        self.assertNotIn("workers", motion)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+import threading
+import unittest
+
+import numpy as np
+
+from pipeline.capture import BLOCK, LATEST, ThreadedCapture, resolve_policy
+
+
+class MockCapture:
+    def __init__(self, total_frames: int, shape=(4, 4, 3)):
+        self.total_frames = total_frames
+        self.shape = shape
+        self.count = 0
+        self.released = False
+        # lets tests hold the producer until they're ready
+        self.gate = threading.Semaphore(total_frames + 1)
+
+    def read(self, image=None):
+        self.gate.acquire()
+        if self.count >= self.total_frames:
+            return False, None
+        self.count += 1
+        if image is None or image.shape != self.shape:
+            image = np.empty(self.shape, np.uint8)
+        image.fill(self.count)
+        return True, image
+
+    def release(self):
+        self.released = True
+
+    def isOpened(self):
+        return True
+
+    def get(self, prop):
+        return 30
+
+
+class TestThreadedCapture(unittest.TestCase):
+    def read_all(self, capture):
+        values = []
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            values.append(int(frame[0, 0, 0]))
+        return values
+
+    def test_block_keeps_every_frame(self):
+        capture = ThreadedCapture(MockCapture(20), policy=BLOCK, buffer_size=3).start()
+
+        values = self.read_all(capture)
+        capture.release()
+
+        self.assertEqual(values, list(range(1, 21)))
+        self.assertEqual(capture.stats(), {"depth": 0, "read": 20, "dropped": 0})
+        self.assertTrue(capture.cap.released)
+
+    def test_block_reuses_buffers(self):
+        capture = ThreadedCapture(MockCapture(20), policy=BLOCK, buffer_size=3).start()
+
+        buffers = set()
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            buffers.add(frame.ctypes.data)
+        capture.release()
+
+        self.assertLessEqual(len(buffers), 3)
+
+    def test_latest_drops_old_frames(self):
+        cap = MockCapture(10)
+        capture = ThreadedCapture(cap, policy=LATEST, buffer_size=3).start()
+        # wait for the producer to decode everything
+        capture.thread.join(2)
+
+        ok, frame = capture.read()
+        self.assertTrue(ok)
+        self.assertEqual(frame[0, 0, 0], 10)
+        ok, _ = capture.read()
+        self.assertFalse(ok)
+        capture.release()
+
+        self.assertEqual(capture.stats()["read"], 10)
+        self.assertEqual(capture.stats()["dropped"], 9)
+
+    def test_depth(self):
+        cap = MockCapture(10)
+        cap.gate = threading.Semaphore(2)
+        capture = ThreadedCapture(cap, policy=BLOCK, buffer_size=4).start()
+
+        with capture.condition:
+            while capture.frames_read < 2:
+                capture.condition.wait()
+        self.assertEqual(capture.depth, 2)
+        # let the producer run again so that it can stop
+        cap.gate.release()
+        capture.release()
+
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            ThreadedCapture(MockCapture(1), policy="invalid")
+
+    def test_resolve_policy(self):
+        self.assertEqual(resolve_policy("auto", 0), LATEST)
+        self.assertEqual(resolve_policy("auto", "1"), LATEST)
+        self.assertEqual(resolve_policy(None, "video.mp4"), BLOCK)
+        self.assertEqual(resolve_policy(BLOCK, 0), BLOCK)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+
+from detection.checkpoint import BackgroundCheckpoint, make_checkpoint_key
+from detection.grids import GridDetector
+from detection.motion import MotionDetector
+from utils.app_settings import AppSettings
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.settings = AppSettings(keep_defaults=True)
+        # so that recent frames are saved too
+        self.settings.set("motion.bg_reinit_mode", "reseed")
+        self.directory = tempfile.mkdtemp()
+        self.frames = [
+            cv2.imread(f"tests/fixtures/frames/{i + 1}.jpg") for i in range(20)
+        ]
+        self.grid = GridDetector(self.frames[0]).detect()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make_detector(self, key="key"):
+        return MotionDetector(
+            self.settings,
+            grid=self.grid,
+            checkpoint=BackgroundCheckpoint(self.directory, key),
+        )
+
+    def test_restore(self):
+        detector = self.make_detector()
+        for frame in self.frames[:19]:
+            detector.detect(frame)
+        contours = detector.detect(self.frames[19])
+        detector.close()
+
+        restored = self.make_detector()
+        restored_contours = restored.detect(self.frames[19])
+        cold = MotionDetector(self.settings, grid=self.grid)
+        cold_contours = cold.detect(self.frames[19])
+
+        self.assertEqual(restored.bands[0].last_mean, detector.bands[0].last_mean)
+        self.assertEqual(len(list(restored.bands[0].recent_frames())), 5)
+        # a cold model treats everything as foreground, so it can't pick up individual flies
+        self.assertLessEqual(len(cold_contours), 1)
+        self.assertAlmostEqual(len(restored_contours), len(contours), delta=10)
+
+    def test_restore_other_key(self):
+        detector = self.make_detector()
+        for frame in self.frames:
+            detector.detect(frame)
+        detector.close()
+
+        other = self.make_detector(key="other")
+        self.assertIsNone(other.checkpoint.load())
+        other.detect(self.frames[0])
+        # only the frame that was just detected, nothing restored
+        self.assertEqual(len(list(other.bands[0].recent_frames())), 1)
+
+    def test_load_invalid(self):
+        checkpoint = BackgroundCheckpoint(self.directory, "key")
+        self.assertIsNone(checkpoint.load())
+
+        detector = self.make_detector()
+        detector.detect(self.frames[0])
+        detector.close()
+        with open(checkpoint.metadata_file, "w") as f:
+            json.dump({"version": 0, "key": "key"}, f)
+        self.assertIsNone(checkpoint.load())
+
+    def test_save_on_interval(self):
+        time = 0
+        self.settings.set("motion.checkpoint_interval", 10)
+        checkpoint = BackgroundCheckpoint(self.directory, "key")
+        detector = MotionDetector(
+            self.settings, clock=lambda: time, grid=self.grid, checkpoint=checkpoint
+        )
+
+        detector.detect(self.frames[0])
+        time = 5
+        detector.detect(self.frames[1])
+        self.assertIsNone(checkpoint.load())
+
+        time = 10
+        detector.detect(self.frames[2])
+        self.assertIsNotNone(checkpoint.load())
+        self.assertEqual(detector.stats()["checkpoints"], 1)
+
+    def test_save_error(self):
+        detector = self.make_detector()
+        detector.detect(self.frames[0])
+        # the checkpoint directory can't be written to anymore
+        shutil.rmtree(self.directory)
+        with open(self.directory, "w"):
+            pass
+
+        detector.close()
+
+        # counted instead of stopping the recording
+        self.assertEqual(detector.stats(), {"checkpoints": 0, "checkpoints_failed": 1})
+        self.assertIsInstance(detector.checkpoint_error, OSError)
+        os.remove(self.directory)
+        os.makedirs(self.directory)
+
+    def test_make_checkpoint_key(self):
+        key = make_checkpoint_key(0, (10, 10, 600, 400), self.grid, (640, 480), "knn")
+
+        self.assertEqual(
+            key,
+            make_checkpoint_key(0, (10, 10, 600, 400), self.grid, (640, 480), "knn"),
+        )
+        self.assertNotEqual(
+            key,
+            make_checkpoint_key(1, (10, 10, 600, 400), self.grid, (640, 480), "knn"),
+        )
+        self.assertNotEqual(
+            key,
+            make_checkpoint_key(0, (10, 10, 600, 400), self.grid, (640, 480), "mog2"),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
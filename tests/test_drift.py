@@ -0,0 +1,166 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from detection.drift import DriftEstimator, DriftTracker, fit_rigid
+from detection.grids import GridDetector
+
+
+def move(frame, matrix):
+    (height, width) = frame.shape[:2]
+    return cv2.warpAffine(
+        frame, matrix, (width, height), borderMode=cv2.BORDER_REPLICATE
+    )
+
+
+def make_matrix(dx, dy, angle=0, center=(320, 205)):
+    matrix = cv2.getRotationMatrix2D(center, angle, 1)
+    matrix[:, 2] += (dx, dy)
+    return matrix
+
+
+class FakeClock:
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self):
+        return self.time
+
+
+class TestDriftEstimator(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.reference = cv2.imread("tests/fixtures/frames/1.jpg")
+        # a later frame, so that flies have moved around
+        cls.frame = cv2.imread("tests/fixtures/frames/20.jpg")
+        cls.grid = GridDetector(cls.reference).detect()
+
+    def setUp(self):
+        self.estimator = DriftEstimator(self.reference, self.grid)
+
+    def estimate(self, matrix):
+        gray = cv2.cvtColor(move(self.frame, matrix), cv2.COLOR_BGR2GRAY)
+        return self.estimator.estimate(gray)
+
+    def assert_close(self, matrix, expected):
+        # compared by where they put the corners of the plate
+        ((x1, y1), (x2, y2)) = self.grid.bounds
+        corners = np.array([(x1, y1, 1), (x2, y1, 1), (x1, y2, 1), (x2, y2, 1)])
+        np.testing.assert_allclose(corners @ matrix.T, corners @ expected.T, atol=1)
+
+    def test_still(self):
+        (matrix, response) = self.estimate(make_matrix(0, 0))
+
+        self.assert_close(matrix, make_matrix(0, 0))
+        self.assertGreater(response, 0.5)
+
+    def test_shift(self):
+        expected = make_matrix(3, -2)
+
+        (matrix, _) = self.estimate(expected)
+
+        self.assert_close(matrix, expected)
+
+    def test_rotation(self):
+        expected = make_matrix(1, 1, angle=0.5)
+
+        (matrix, _) = self.estimate(expected)
+
+        self.assert_close(matrix, expected)
+
+    def test_unrelated(self):
+        gray = cv2.cvtColor(cv2.flip(self.frame, 1), cv2.COLOR_BGR2GRAY)
+
+        (matrix, response) = self.estimator.estimate(gray)
+
+        self.assertIsNone(matrix)
+        self.assertLess(response, 0.2)
+
+    def test_fit_rigid(self):
+        points = [(0, 0), (10, 0), (0, 10), (10, 10)]
+        expected = make_matrix(2, 3, angle=10, center=(5, 5))
+        moved = np.column_stack((points, np.ones(4))) @ expected.T
+
+        np.testing.assert_allclose(fit_rigid(points, moved), expected, atol=1e-9)
+
+
+class TestDriftTracker(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.reference = cv2.imread("tests/fixtures/frames/1.jpg")
+        cls.frame = cv2.imread("tests/fixtures/frames/20.jpg")
+        cls.grid = GridDetector(cls.reference).detect()
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.tracker = DriftTracker(
+            self.reference,
+            self.grid,
+            interval=10,
+            min_shift=1,
+            max_shift=10,
+            clock=self.clock,
+        )
+
+    def update(self, matrix, time):
+        self.clock.time = time
+        return self.tracker.update(move(self.frame, matrix))
+
+    def test_interval(self):
+        self.assertIsNone(self.update(make_matrix(3, 0), 5))
+        self.assertEqual(self.tracker.checks, 0)
+
+        correction = self.update(make_matrix(3, 0), 10)
+
+        self.assertEqual(self.tracker.checks, 1)
+        np.testing.assert_allclose(correction, make_matrix(3, 0), atol=0.5)
+
+    def test_small_shift(self):
+        correction = self.update(make_matrix(0.3, 0), 10)
+
+        self.assertIsNone(correction)
+        self.assertEqual(self.tracker.stats()["corrections"], 0)
+
+    def test_corrections_add_up(self):
+        first = self.update(make_matrix(3, 0), 10)
+        # the grid is already where it needs to be
+        self.assertIsNone(self.update(make_matrix(3, 0), 20))
+
+        second = self.update(make_matrix(3, 4), 30)
+
+        self.assertEqual(self.tracker.corrections, 2)
+        np.testing.assert_allclose(first[:, 2], (3, 0), atol=0.5)
+        np.testing.assert_allclose(second[:, 2], (0, 4), atol=0.5)
+
+    def test_large_shift(self):
+        correction = self.update(make_matrix(15, 0), 10)
+
+        self.assertIsNone(correction)
+        stats = self.tracker.stats()
+        self.assertTrue(stats["moved"])
+        self.assertAlmostEqual(stats["shift"], 15, delta=0.5)
+
+    def test_background(self):
+        tracker = DriftTracker(
+            self.reference,
+            self.grid,
+            interval=10,
+            clock=self.clock,
+            executor=ThreadPoolExecutor(max_workers=1),
+        )
+        frame = move(self.frame, make_matrix(3, 0))
+        self.clock.time = 10
+
+        # the check is started, but its result only comes back on a later frame
+        self.assertIsNone(tracker.update(frame))
+        tracker.future.result()
+        correction = tracker.update(frame)
+        tracker.close()
+
+        np.testing.assert_allclose(correction, make_matrix(3, 0), atol=0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
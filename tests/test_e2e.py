@@ -21,7 +21,7 @@ class TestE2E(unittest.TestCase):
     expected_dimensions = (8, 12)
     # there is a distressingly high level of non-determinism in our totals,
     # most likely because we're going through Tkinter
-    # until we have a better method that skips the UI, keep this high
+    # see test_headless for a deterministic version of this test that skips the UI
     delta = 100
 
     def setUp(self):
@@ -29,6 +29,10 @@ class TestE2E(unittest.TestCase):
         os.environ["OUTPUT_FILE"] = self.output_file
         os.environ["INTERVAL"] = str(self.interval)
         self.root_window = RootWindow(args=MagicMock(silent=True, keep_defaults=True))
+        # a calibration saved by an earlier run would skip the scan
+        self.root_window.settings.set("calibration.directory", None)
+        # and a checkpoint would restore an old background instead of warming up
+        self.root_window.settings.set("motion.checkpoint_dir", None)
 
     def tearDown(self):
         try:
@@ -52,6 +56,12 @@ class TestE2E(unittest.TestCase):
         scan_button = idle_canvas.button_frame.children["!button"]
         scan_button.invoke()
         scan_canvas = self.root_window.children["!scancanvas"]
+        # the grid is detected in the background, and Record is enabled once it's done
+        self.assertTrue(scan_canvas.grid_search.wait(timeout=60))
+        # the result is handed to the Tk thread with after_idle, see ScanCanvas.schedule_finish
+        self.root_window.update()
+        self.assertIsNone(scan_canvas.grid_search)
+        self.assertIsNotNone(scan_canvas.grid)
         record_button = scan_canvas.record_button
         record_button.invoke()
 
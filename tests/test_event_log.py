@@ -0,0 +1,178 @@
+import datetime
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from custom_types.motion import MotionBatch, MotionEventHandler
+from handlers.event_log import (
+    EVENT_DTYPE,
+    HEADER_DTYPE,
+    NO_WELL,
+    EventLogHandler,
+    get_start_time,
+    list_event_logs,
+    read_event_log,
+)
+from pipeline.writer import AsyncWriter
+
+
+class BatchRecorder(MotionEventHandler):
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def handle_frame(self, batch):
+        self.batches.append(batch)
+
+
+def make_batch(frame_count, time, indices=()):
+    n = len(indices)
+    centers = np.arange(n * 2, dtype=np.float64).reshape(n, 2) + 0.25
+    return MotionBatch(
+        [None] * 4,
+        frame_count,
+        time,
+        None,
+        None,
+        np.array(indices, np.intp),
+        centers,
+        np.full(n, 12, np.int64),
+        np.zeros((n, 4), np.int32),
+        centers + 1 / 3,
+        np.full(n, 10, np.int64),
+        np.zeros((n, 4), np.int32),
+        np.full(n, frame_count - 1, np.int64),
+    )
+
+
+class TestEventLog(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.start_time = datetime.datetime(2022, 1, 1, 12, 30, 15, 123456)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def make_handler(self, **kwargs):
+        return EventLogHandler(
+            self.directory.name,
+            BatchRecorder(),
+            start_time=self.start_time,
+            writer=AsyncWriter().start(),
+            **kwargs,
+        )
+
+    def read_all(self):
+        return [read_event_log(path) for path in list_event_logs(self.directory.name)]
+
+    def test_log(self):
+        handler = self.make_handler()
+        batches = [
+            make_batch(1, 10.0),
+            make_batch(2, 10.5, [0, 3]),
+            make_batch(3, 11.0, [2]),
+        ]
+        for batch in batches:
+            handler.handle_frame(batch)
+        handler.close()
+
+        # the wrapped handler still gets every batch
+        self.assertEqual(handler.handler.batches, batches)
+        [(header, records)] = self.read_all()
+        self.assertEqual(header["start"], 10.0)
+        self.assertEqual(get_start_time(header), self.start_time)
+        self.assertIsInstance(records, np.memmap)
+        self.assertEqual(records.dtype, EVENT_DTYPE)
+        self.assertEqual(handler.records_written, 4)
+
+        # frames without events get a record without a well
+        np.testing.assert_array_equal(records["frame"], [1, 2, 2, 3])
+        np.testing.assert_array_equal(records["time"], [10.0, 10.5, 10.5, 11.0])
+        np.testing.assert_array_equal(records["well"], [NO_WELL, 0, 3, 2])
+        events = records[records["well"] != NO_WELL]
+        distances = np.concatenate([batch.distances for batch in batches])
+        # distances are stored exactly
+        np.testing.assert_array_equal(events["distance"], distances)
+        np.testing.assert_array_equal(events["x"], [0.25, 2.25, 0.25])
+        np.testing.assert_array_equal(events["area"], [12, 12, 12])
+
+    def test_rotate_by_size(self):
+        record_size = EVENT_DTYPE.itemsize
+        handler = self.make_handler(max_bytes=HEADER_DTYPE.itemsize + 3 * record_size)
+        for i in range(10):
+            handler.handle_frame(make_batch(i + 1, i, [0]))
+        handler.close()
+
+        logs = self.read_all()
+        self.assertEqual([len(records) for _, records in logs], [3, 3, 3, 1])
+        # every file has the same header, so each one can be read on its own
+        for header, _ in logs:
+            self.assertEqual(header["start"], 0)
+        frames = np.concatenate([records["frame"] for _, records in logs])
+        np.testing.assert_array_equal(frames, np.arange(1, 11))
+
+    def test_rotate_by_time(self):
+        handler = self.make_handler(max_duration=4)
+        for i in range(10):
+            handler.handle_frame(make_batch(i + 1, i))
+        handler.close()
+
+        logs = self.read_all()
+        self.assertEqual([len(records) for _, records in logs], [4, 4, 2])
+
+    def test_replaces_old_files(self):
+        for _ in range(2):
+            handler = self.make_handler()
+            handler.handle_frame(make_batch(1, 0, [0]))
+            handler.close()
+
+        [(_, records)] = self.read_all()
+        self.assertEqual(len(records), 1)
+
+    def test_rotate_without_blocking(self):
+        # not started yet, so everything stays queued
+        writer = AsyncWriter()
+        handler = EventLogHandler(
+            self.directory.name,
+            BatchRecorder(),
+            start_time=self.start_time,
+            writer=writer,
+            max_duration=4,
+        )
+
+        # files are only created by the writer, not on the thread that handles frames
+        with patch("builtins.open", side_effect=AssertionError("blocked on open")):
+            for i in range(10):
+                handler.handle_frame(make_batch(i + 1, i))
+        writer.start()
+        handler.close()
+
+        self.assertEqual(len(self.read_all()), 3)
+
+    def test_partial_record(self):
+        handler = self.make_handler()
+        handler.handle_frame(make_batch(1, 0, [0, 1]))
+        handler.close()
+        [path] = list_event_logs(self.directory.name)
+        # e.g. after a crash
+        with open(path, "ab") as f:
+            f.write(b"\0" * 5)
+
+        _, records = read_event_log(path)
+
+        self.assertEqual(len(records), 2)
+
+    def test_invalid(self):
+        path = os.path.join(self.directory.name, "events_invalid.bin")
+        with open(path, "wb") as f:
+            f.write(b"not an event log, but long enough for a header")
+
+        with self.assertRaises(ValueError):
+            read_event_log(path)
+
+
+if __name__ == "__main__":
+    unittest.main()
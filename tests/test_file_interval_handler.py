@@ -1,9 +1,10 @@
 import datetime
 import unittest
 from queue import SimpleQueue
-from threading import Timer
 from unittest.mock import MagicMock, mock_open, patch
 
+import numpy as np
+
 from handlers.file_interval import DELIMITER, FileIntervalHandler
 
 
@@ -22,6 +23,8 @@ class TestFileInterval(unittest.TestCase):
             for j in range(self.mock_grid_y):
                 mock_item = MagicMock()
                 mock_item.coords = (i, j)
+                # go down each column, then over to the next one
+                mock_item.index = j * self.mock_grid_x + i
                 mock_row.items.append(mock_item)
             mock_grid.rows.append(mock_row)
         return mock_grid
@@ -32,49 +35,42 @@ class TestFileInterval(unittest.TestCase):
         self.patcher.start()
 
         self.cleanup_queue = SimpleQueue()
-        self.error_queue = SimpleQueue()
         self.grid = self.make_mock_grid()
+        self.start_time = datetime.datetime(2022, 1, 1, 0, 0, 0)
+        self.writer = MagicMock()
         self.handler = FileIntervalHandler(
             self.grid,
             self.output_path,
             interval=self.interval,
+            start_time=self.start_time,
+            writer=self.writer,
             cleanup_queue=self.cleanup_queue,
-            error_queue=self.error_queue,
         )
 
-        # replace with mock to be safe,
-        # since real timers are potentially nasty
-        self.real_start = self.handler.start
-        self.handler.start = MagicMock()
-
     def tearDown(self):
         self.patcher.stop()
         self.mock_open.reset_mock()
 
+    def make_batch(self, time, indices=(), distances=()):
+        batch = MagicMock()
+        batch.time = time
+        batch.__len__.return_value = len(indices)
+        batch.indices = np.array(indices, np.intp)
+        batch.distances = np.array(distances, np.float64)
+        return batch
+
     def test_initial_state(self):
         # should set default values
-        self.assertEqual(self.handler.timer, None)
         self.assertEqual(self.handler.filename, self.output_path)
         self.assertEqual(self.handler.interval, self.interval)
         self.assertEqual(self.handler.index, 0)
-        self.assertLessEqual(self.handler.last_flush, datetime.datetime.now())
+        self.assertEqual(len(self.handler.outputs), 1)
+        self.assertEqual(self.handler.bins.ratios, [self.interval])
         self.assertEqual(self.cleanup_queue.qsize(), 1)
 
         # should set distances from grid dimensions, initialized to 0
-        expected_distances = {
-            (0, 0): 0,
-            (0, 1): 0,
-            (1, 0): 0,
-            (1, 1): 0,
-            (2, 0): 0,
-            (2, 1): 0,
-            (0, 2): 0,
-            (1, 2): 0,
-            (2, 2): 0,
-        }
-        self.assertEqual(self.handler.distances, expected_distances)
-        self.assertEqual(self.handler.max_x, 2)
-        self.assertEqual(self.handler.max_y, 2)
+        np.testing.assert_array_equal(self.handler.distances, np.zeros(9))
+        np.testing.assert_array_equal(self.handler.order, np.arange(9))
 
         self.mock_open.assert_called_once_with(self.output_path, "w")
         self.mock_open().write.assert_called_once_with("")
@@ -82,21 +78,37 @@ class TestFileInterval(unittest.TestCase):
     def test_handle(self):
         # should update distance for item at event coords
         event = MagicMock()
-        event.item.coords = (0, 0)
+        event.item.index = 0
         event.distance = 10
 
         self.handler.handle(event)
 
-        self.assertEqual(self.handler.distances[(0, 0)], 10)
+        self.assertEqual(self.handler.distances[0], 10)
+
+    def test_handle_frame(self):
+        # should add up distances by well index, including repeated wells
+        self.handler.handle_frame(self.make_batch(0, [4, 0, 4], [1.5, 2.0, 3.0]))
+
+        self.assertEqual(self.handler.distances[0], 2)
+        self.assertEqual(self.handler.distances[4], 4.5)
+        self.assertEqual(self.handler.distances.sum(), 6.5)
+
+    def test_invalid_interval(self):
+        for interval in [0, 0.5, 1.5]:
+            with self.subTest(interval=interval):
+                with self.assertRaises(ValueError):
+                    FileIntervalHandler(self.grid, self.output_path, interval=interval)
 
     def test_make_row(self):
         # should return a row string of metadata followed by distances
-        self.handler.index = 1
-        self.handler.last_flush = datetime.datetime(2022, 1, 1, 0, 0, 0)
+        output = self.handler.outputs[0]
+        output.index = 1
+        output.last_flush = datetime.datetime(2022, 1, 1, 0, 0, 0)
+        distances = np.zeros(9)
         index = 1
-        for i in range(3):
-            for j in range(3):
-                self.handler.distances[(i, j)] = index
+        for row in self.grid.rows:
+            for item in row.items:
+                distances[item.index] = index
                 index += 1
         # distances should now look like this:
         # 1 2 3
@@ -118,7 +130,7 @@ class TestFileInterval(unittest.TestCase):
         expected_row_parts += expected_distances
         expected_row = DELIMITER.join(map(str, expected_row_parts))
 
-        row = self.handler.make_row()
+        row = self.handler.make_row(output, distances)
 
         self.assertEqual(row, expected_row)
 
@@ -128,48 +140,112 @@ class TestFileInterval(unittest.TestCase):
         self.handler.make_row = MagicMock()
         self.handler.make_row.return_value = "test_row"
 
-        self.handler.write_data()
+        self.handler.write_data(self.handler.outputs[0], np.zeros(9))
 
-        self.mock_open.assert_called_once_with(self.output_path, "a")
-        self.mock_open().write.assert_called_once_with("test_row\n")
+        # rows are handed off to the writer instead of being written here
+        self.mock_open.assert_not_called()
+        self.writer.write.assert_called_once_with(self.output_path, "test_row\n")
 
-    def test_flush(self):
-        self.handler.index = 1
-        self.handler.distances[(0, 0)] = 100
-        self.handler.write_data = MagicMock()
-        self.handler.start = MagicMock()
+    def test_close(self):
+        self.cleanup_queue.get()()
 
-        self.handler.flush()
+        self.writer.close.assert_called_once()
 
-        self.assertEqual(self.handler.index, 2)
-        self.assertLessEqual(self.handler.last_flush, datetime.datetime.now())
-        self.handler.write_data.assert_called_once()
-        self.handler.start.assert_called_once()
-        # should be reset back to 0
-        self.assertEqual(self.handler.distances[(0, 0)], 0)
+    def test_write_intervals(self):
+        written = []
+        self.handler.write_data = MagicMock(
+            side_effect=lambda output, distances: written.append(
+                (output.index, output.last_flush, distances.copy())
+            )
+        )
 
-    def test_flush_error(self):
-        self.handler.write_data = MagicMock(side_effect=Exception)
-        self.handler.start = MagicMock()
+        self.handler.handle_frame(self.make_batch(100, [0], [10]))
+        self.handler.handle_frame(self.make_batch(109.9, [0], [5]))
+        # nothing is written until a frame falls after the end of the interval
+        self.handler.write_data.assert_not_called()
+        self.handler.handle_frame(self.make_batch(110, [0], [1]))
+
+        self.assertEqual(len(written), 1)
+        index, last_flush, distances = written[0]
+        self.assertEqual(index, 1)
+        # timestamped with the end of the interval
+        self.assertEqual(
+            last_flush, self.start_time + datetime.timedelta(seconds=self.interval)
+        )
+        self.assertEqual(distances[0], 15)
+        # the frame that closed the interval starts the next one
+        self.assertEqual(self.handler.distances[0], 1)
 
-        self.handler.flush()
-        self.handler.flush()
-        self.handler.flush()
+    def test_write_intervals_gap(self):
+        self.handler.write_data = MagicMock()
 
-        self.assertEqual(self.error_queue.qsize(), 3)
+        # frames that skip whole intervals still produce a row for each one
+        self.handler.handle_frame(self.make_batch(0))
+        self.handler.handle_frame(self.make_batch(35))
 
-    # do *not* use real timers unless you hate yourself
-    @patch.object(Timer, "start")
-    @patch.object(Timer, "__init__", return_value=None)
-    def test_start(self, Timer_init, Timer_start):
-        self.real_start()
+        self.assertEqual(self.handler.write_data.call_count, 3)
+        self.assertEqual(self.handler.index, 3)
 
-        Timer_init.assert_called_once_with(self.handler.interval, self.handler.flush)
-        Timer_start.assert_called_once()
+    def test_activity_output(self):
+        handler = FileIntervalHandler(
+            self.grid,
+            self.output_path,
+            interval=self.interval,
+            activity_interval=2,
+            start_time=self.start_time,
+            writer=self.writer,
+        )
+        handler.write_data = MagicMock()
+        self.mock_open.assert_any_call("tests/fixtures/test_output_activity.txt", "w")
+
+        for time in range(self.interval + 1):
+            handler.handle_frame(self.make_batch(time, [0], [1]))
+
+        main, activity = handler.outputs
+        self.assertEqual(main.index, 1)
+        self.assertEqual(activity.index, self.interval / 2)
+        self.assertEqual(activity.time_format, "%H:%M:%S")
+        calls = handler.write_data.call_args_list
+        # both outputs get the same motion, split differently
+        self.assertEqual(
+            sum(args[1][0] for args, _ in calls if args[0] is activity), 10
+        )
+        self.assertEqual(sum(args[1][0] for args, _ in calls if args[0] is main), 10)
 
-    def test_cancel(self):
-        self.handler.timer = MagicMock()
+    def test_archive(self):
+        archive = MagicMock()
+        handler = FileIntervalHandler(
+            self.grid,
+            self.output_path,
+            interval=self.interval,
+            start_time=self.start_time,
+            writer=self.writer,
+            archive=archive,
+        )
+        self.assertTrue(handler.needs_raw_frame)
 
-        self.handler.cancel()
+        batches = [self.make_batch(time) for time in [0, 5, 10, 15]]
+        for batch in batches:
+            handler.handle_frame(batch)
 
-        self.handler.timer.cancel.assert_called_once()
+        # every frame is archived, and each interval is marked once on its first frame
+        self.assertEqual(
+            [call.args for call in archive.add.call_args_list],
+            [(batch.raw_frame, batch.time) for batch in batches],
+        )
+        self.assertEqual(
+            [call.args for call in archive.mark.call_args_list], [(1,), (2,)]
+        )
+        handler.close()
+        archive.close.assert_called_once()
+        self.writer.close.assert_called_once()
+
+    def test_invalid_interval(self):
+        with self.assertRaises(ValueError):
+            FileIntervalHandler(
+                self.grid,
+                self.output_path,
+                interval=self.interval,
+                base_interval=3,
+                writer=self.writer,
+            )
@@ -2,32 +2,147 @@ import unittest
 from unittest.mock import MagicMock
 
 import cv2
+import numpy as np
 
+from custom_types.motion import MotionEventHandler
+from detection.grids import GridDetector
+from handlers.debug import DebugHandler
 from handlers.frame import FrameHandler
 from utils.app_settings import AppSettings
 
 
+class EventCounter(MotionEventHandler):
+    def __init__(self):
+        super().__init__()
+        self.events = []
+
+    def handle(self, event):
+        self.events.append(event)
+
+
+class RawFrameHandler(MotionEventHandler):
+    needs_raw_frame = True
+
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def handle_frame(self, batch):
+        self.batches.append(batch)
+
+
 class TestFrameHandler(unittest.TestCase):
     def setUp(self):
-        self.grid = MagicMock()
+        # the KNN subtractor is randomized, so make each test start from the same state
+        cv2.setRNGSeed(0)
+        self.grid = GridDetector(cv2.imread("tests/fixtures/frames/1.jpg")).detect()
         self.settings = AppSettings(keep_defaults=True)
         self.handler = MagicMock()
         self.frame_handler = FrameHandler(self.grid, self.settings, self.handler)
 
-    def test_handle(self):
+    def handle_frames(self, frame_handler):
         for i in range(20):
             frame = cv2.imread(f"tests/fixtures/frames/{i + 1}.jpg")
             self.assertIsNotNone(frame)
-            self.frame_handler.handle(frame, i + 1)
+            frame_handler.handle(frame, i + 1)
+
+    def test_handle(self):
+        self.handle_frames(self.frame_handler)
 
         # should get called once per frame
         self.assertEqual(self.handler.on_frame.call_count, 20)
-        # should get called once per motion event
-        self.assertEqual(self.handler.handle.call_count, 84)
+        self.assertEqual(self.handler.handle_frame.call_count, 20)
+        # each batch holds the motion events of one frame
+        batches = [args[0] for args, _ in self.handler.handle_frame.call_args_list]
+        self.assertEqual(sum(len(batch) for batch in batches), 544)
 
         # check first event
-        args, _ = self.handler.handle.call_args_list[0]
-        event = args[0]
-        # emitted on 2nd frame, since the 1st frame can't produce an event
-        self.assertEqual(event.point.frame_count, 2)
-        self.assertEqual(event.last_point.frame_count, 1)
+        batch = next(batch for batch in batches if len(batch) > 0)
+        # while the model warms up, the whole frame is foreground, so there's no blob inside a well
+        # the first blobs show up on the 5th frame, so the first events come on the 6th
+        self.assertEqual(batch.frame_count, 6)
+        self.assertEqual(batch.last_frame_counts[0], 5)
+        self.assertAlmostEqual(
+            batch.distances[0],
+            np.linalg.norm(batch.centers[0] - batch.last_centers[0]),
+        )
+
+    def test_handle_events(self):
+        # handlers that only implement handle should still get every event
+        handler = EventCounter()
+        self.handle_frames(FrameHandler(self.grid, self.settings, handler))
+
+        self.assertEqual(len(handler.events), 544)
+        event = handler.events[0]
+        self.assertEqual(event.point.frame_count, 6)
+        self.assertEqual(event.last_point.frame_count, 5)
+        self.assertIs(event.item, self.grid.items[event.item.index])
+        self.assertEqual(
+            event.distance,
+            np.hypot(
+                event.point.center[0] - event.last_point.center[0],
+                event.point.center[1] - event.last_point.center[1],
+            ),
+        )
+
+    def test_handle_does_not_modify_frame(self):
+        handler = DebugHandler(self.grid, RawFrameHandler())
+        frame_handler = FrameHandler(self.grid, self.settings, handler)
+        frame = cv2.imread("tests/fixtures/frames/1.jpg")
+        original = frame.copy()
+
+        display_frame = frame_handler.handle(frame, 1)
+
+        # indices are drawn on a separate copy
+        np.testing.assert_array_equal(frame, original)
+        self.assertFalse(np.array_equal(display_frame, original))
+        self.assertFalse(np.shares_memory(display_frame, frame))
+
+    def test_move_grid(self):
+        self.handle_frames(self.frame_handler)
+        seen = self.frame_handler.last_frame_counts >= 0
+        last_centers = self.frame_handler.last_centers[seen].copy()
+        last_bounds = self.frame_handler.last_bounds[seen].copy()
+        item_bounds = self.grid.items[0].bounds
+        frame = cv2.imread("tests/fixtures/frames/20.jpg")
+
+        self.frame_handler.move_grid(
+            np.array([[1, 0, 3], [0, 1, -2]], np.float64), frame
+        )
+
+        ((x1, y1), (x2, y2)) = item_bounds
+        np.testing.assert_allclose(
+            self.grid.items[0].bounds, ((x1 + 3, y1 - 2), (x2 + 3, y2 - 2)), rtol=1e-6
+        )
+        # last points moved with the plate, so they don't add to the next distance
+        np.testing.assert_allclose(
+            self.frame_handler.last_centers[seen], last_centers + (3, -2)
+        )
+        np.testing.assert_array_equal(
+            self.frame_handler.last_bounds[seen], last_bounds + (3, -2, 0, 0)
+        )
+
+    def test_raw_frame(self):
+        handler = RawFrameHandler()
+        frame_handler = FrameHandler(self.grid, self.settings, handler)
+        frame = cv2.imread("tests/fixtures/frames/1.jpg")
+
+        display_frame = frame_handler.handle(frame, 1)
+
+        # nothing draws on the frame, so there's nothing to copy
+        self.assertIs(display_frame, frame)
+        batch = handler.batches[0]
+        self.assertIsNone(batch.frame)
+        self.assertTrue(np.shares_memory(batch.raw_frame, frame))
+        self.assertFalse(batch.raw_frame.flags.writeable)
+
+    def test_raw_frame_not_needed(self):
+        handler = DebugHandler(self.grid, MotionEventHandler())
+        frame_handler = FrameHandler(self.grid, self.settings, handler)
+        batches = []
+        handler.handler.handle_frame = batches.append
+
+        frame_handler.handle(cv2.imread("tests/fixtures/frames/1.jpg"), 1)
+
+        self.assertIsNone(batches[0].raw_frame)
+        self.assertIsNotNone(batches[0].frame)
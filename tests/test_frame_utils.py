@@ -0,0 +1,63 @@
+import unittest
+
+import numpy as np
+
+from utils.app_settings import AppSettings
+from utils.frame import (
+    fit_frame,
+    fit_size,
+    get_processing_size,
+    to_processing_resolution,
+)
+
+
+class TestFrameUtils(unittest.TestCase):
+    def test_fit_size_wide(self):
+        # limited by the width
+        self.assertEqual(fit_size(1280, 720, 640, 480), (640, 360))
+
+    def test_fit_size_tall(self):
+        # limited by the height
+        self.assertEqual(fit_size(720, 1280, 640, 480), (270, 480))
+
+    def test_fit_size_same_aspect_ratio(self):
+        self.assertEqual(fit_size(1280, 960, 640, 480), (640, 480))
+
+    def test_fit_size_rounds_down(self):
+        # 640 / (877 / 565) = 412.3
+        self.assertEqual(fit_size(877, 565, 640, 480), (640, 412))
+
+    def test_fit_frame(self):
+        frame = np.zeros((720, 1280, 3), np.uint8)
+
+        self.assertEqual(fit_frame(frame, 640, 480).shape, (360, 640, 3))
+
+    def test_get_processing_size(self):
+        settings = AppSettings(keep_defaults=True)
+        settings.set("processing.width", 320)
+        settings.set("processing.height", "240")
+
+        self.assertEqual(get_processing_size(settings), (320, 240))
+
+    def test_get_processing_size_disabled(self):
+        settings = AppSettings(keep_defaults=True)
+        settings.set("processing.width", None)
+
+        self.assertIsNone(get_processing_size(settings))
+
+    def test_to_processing_resolution(self):
+        frame = np.zeros((720, 1280, 3), np.uint8)
+
+        resized = to_processing_resolution(frame, (640, 480))
+
+        self.assertEqual(resized.shape, (360, 640, 3))
+
+    def test_to_processing_resolution_native(self):
+        frame = np.zeros((48, 64, 3), np.uint8)
+
+        # nothing to resize, so no copy either
+        self.assertIs(to_processing_resolution(frame, None), frame)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import threading
+import unittest
+
+import cv2
+
+from detection.grids import DetectionCancelled
+from pipeline.grid_search import GridSearch
+
+# long enough for any detection to finish, so a hung search fails instead of blocking the suite
+TIMEOUT = 30
+
+
+class TestGridSearch(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.frame = cv2.imread("tests/fixtures/grid.jpg")
+
+    def test_search(self):
+        done = []
+        search = GridSearch(self.frame, on_done=done.append).start()
+
+        self.assertTrue(search.wait(TIMEOUT))
+        self.assertEqual(search.grid.dimensions, (8, 12))
+        self.assertIsNone(search.error)
+        self.assertEqual(search.get_progress(), 1)
+        self.assertEqual(done, [search])
+
+    def test_best_candidate(self):
+        # the first candidate finds few circles, if any, so it can't beat a full plate
+        candidates = [{"final_param_2": 200}, {}]
+        search = GridSearch(self.frame, candidates=candidates).start()
+
+        self.assertTrue(search.wait(TIMEOUT))
+        self.assertIs(search.detector, search.detectors[1])
+        self.assertEqual(search.grid.dimensions, (8, 12))
+
+    def test_failed(self):
+        blank = self.frame * 0
+        search = GridSearch(blank).start()
+
+        self.assertTrue(search.wait(TIMEOUT))
+        self.assertIsNone(search.grid)
+        self.assertEqual(str(search.error), "No circles detected")
+
+    def test_cancel(self):
+        done = []
+        # blocks the first step of each candidate until the search is cancelled
+        started = threading.Barrier(2)
+        search = GridSearch(self.frame, candidates=[{}], on_done=done.append)
+        search.report = lambda *_: started.wait(TIMEOUT)
+        search.start()
+
+        started.wait(TIMEOUT)
+        search.cancel()
+
+        self.assertTrue(search.wait(TIMEOUT))
+        self.assertIsNone(search.grid)
+        self.assertIsInstance(search.error, DetectionCancelled)
+        self.assertEqual(done, [])
+
+    def test_no_candidates(self):
+        with self.assertRaises(ValueError):
+            GridSearch(self.frame, candidates=[])
+
+
+if __name__ == "__main__":
+    unittest.main()
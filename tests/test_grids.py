@@ -1,8 +1,11 @@
+import json
 import unittest
 
 import cv2
+import numpy as np
 
-from detection.grids import GridDetector
+from custom_types.grid import Grid, Item, Row
+from detection.grids import DetectionCancelled, GridDetector
 
 
 class TestGridDetector(unittest.TestCase):
@@ -51,6 +54,181 @@ class TestGridDetector(unittest.TestCase):
         self.assertIsNotNone(radius)
         self.assertAlmostEqual(radius, self.expected_radius, places=0)
 
+    def test_detect_rotated(self):
+        (height, width) = self.test_image.shape[:2]
+        rotation = cv2.getRotationMatrix2D((width / 2, height / 2), 5, 1)
+        detector = GridDetector(
+            cv2.warpAffine(
+                self.test_image,
+                rotation,
+                (width, height),
+                borderMode=cv2.BORDER_REPLICATE,
+            )
+        )
+
+        grid = detector.detect()
+
+        self.assertEqual(grid.dimensions, (self.expected_rows, self.expected_columns))
+
+    def test_detect_missing_well(self):
+        expected = self.detector.detect().items[20]
+        ((x1, y1), (x2, y2)) = expected.bounds
+        # paint over the well with the background color
+        image = self.test_image.copy()
+        background = np.median(image.reshape(-1, 3), axis=0)
+        image[int(y1) - 4 : int(y2) + 4, int(x1) - 4 : int(x2) + 4] = background
+        detector = GridDetector(image)
+
+        grid = detector.detect()
+
+        self.assertEqual(len(detector.circles), self.expected_circles - 1)
+        self.assertEqual(grid.dimensions, (self.expected_rows, self.expected_columns))
+        item = grid.items[20]
+        self.assertEqual(item.coords, expected.coords)
+        np.testing.assert_allclose(item.bounds, expected.bounds, atol=2)
+
+    def test_score(self):
+        self.detector.detect()
+
+        # every well was found, and nothing else
+        self.assertEqual(self.detector.score, 96)
+
+    def test_progress(self):
+        steps = []
+        detector = GridDetector(
+            self.test_image, progress=lambda done, total: steps.append((done, total))
+        )
+
+        detector.detect()
+
+        self.assertGreater(len(steps), 2)
+        self.assertEqual(steps[-1][0], steps[-1][1])
+        self.assertEqual([done for done, _ in steps], sorted(done for done, _ in steps))
+
+    def test_cancel(self):
+        detector = GridDetector(self.test_image, cancelled=lambda: True)
+
+        with self.assertRaises(DetectionCancelled):
+            detector.detect()
+
+    def test_make_pyramid(self):
+        self.detector.processed_frame = self.detector.process_frame()
+        # too small to be downsampled
+        self.assertEqual(len(self.detector.make_pyramid()), 1)
+
+        self.detector.processed_frame = cv2.resize(
+            self.detector.processed_frame, None, fx=2, fy=2
+        )
+        pyramid = self.detector.make_pyramid()
+
+        self.assertEqual(len(pyramid), 2)
+        self.assertEqual(pyramid[1].shape, (411, 640))
+
+    def test_detect_downsampled(self):
+        # 1280x720, so the radius is estimated at half the size
+        capture = cv2.VideoCapture("tests/fixtures/video.mp4")
+        _, frame = capture.read()
+        capture.release()
+        detector = GridDetector(frame)
+
+        grid = detector.detect()
+
+        self.assertEqual(grid.dimensions, (self.expected_rows, self.expected_columns))
+        self.assertAlmostEqual(detector.average_radius, 27, delta=1)
+
+
+class TestGrid(unittest.TestCase):
+    def setUp(self):
+        # 2 x 2 grid of 10 x 10 items with a gap of 10 between them
+        rows = []
+        for row_index in range(2):
+            items = []
+            for col_index in range(2):
+                (x, y) = (10 + col_index * 20, 10 + row_index * 20)
+                items.append(
+                    Item(
+                        ((x, y), (x + 10, y + 10)),
+                        col_index * 2 + row_index,
+                        (row_index, col_index),
+                    )
+                )
+            rows.append(Row(items))
+        self.grid = Grid(rows)
+
+    def test_items(self):
+        for index, item in enumerate(self.grid.items):
+            self.assertEqual(item.index, index)
+        self.assertEqual(self.grid.items[1].coords, (1, 0))
+
+    def test_get_labels(self):
+        labels = self.grid.get_labels((50, 50, 3))
+
+        self.assertEqual(labels.shape, (50, 50))
+        self.assertEqual(labels[10, 10], 0)
+        self.assertEqual(labels[19, 19], 0)
+        self.assertEqual(labels[20, 20], -1)
+        self.assertEqual(labels[10, 30], 2)
+        self.assertEqual(labels[30, 10], 1)
+        self.assertEqual(np.count_nonzero(labels >= 0), 4 * 10 * 10)
+        # cached until the shape changes
+        self.assertIs(self.grid.get_labels((50, 50)), labels)
+
+    def test_find_items(self):
+        indices = self.grid.find_items(
+            [(15, 15), (35.5, 35.5), (19.9, 10), (20, 10), (-5, 15), (100, 100)],
+            (50, 50),
+        )
+
+        np.testing.assert_array_equal(indices, [0, 3, 0, -1, -1, -1])
+
+    def test_to_dict(self):
+        data = json.loads(json.dumps(self.grid.to_dict()))
+
+        grid = Grid.from_dict(data)
+
+        self.assertEqual(grid.dimensions, self.grid.dimensions)
+        for item, expected in zip(grid.items, self.grid.items):
+            self.assertEqual(item.index, expected.index)
+            self.assertEqual(item.coords, expected.coords)
+            self.assertEqual(item.bounds, expected.bounds)
+        np.testing.assert_array_equal(
+            grid.get_labels((50, 50)), self.grid.get_labels((50, 50))
+        )
+
+    def test_transform(self):
+        labels = self.grid.get_labels((50, 50))
+
+        self.grid.transform([[1, 0, 2.5], [0, 1, -1]])
+
+        self.assertEqual(self.grid.items[0].bounds, ((12.5, 9), (22.5, 19)))
+        self.assertEqual(self.grid.rows[1].bounds, ((12.5, 29), (42.5, 39)))
+        self.assertEqual(self.grid.bounds, ((12.5, 9), (42.5, 39)))
+        self.assertEqual(self.grid.version, 1)
+        # labels are rebuilt for the new bounds
+        self.assertIsNot(self.grid.get_labels((50, 50)), labels)
+        np.testing.assert_array_equal(
+            self.grid.find_items([(13, 9), (12, 9)], (50, 50)), [0, -1]
+        )
+
+    def test_transform_rotation(self):
+        bounds = [item.bounds for item in self.grid.items]
+
+        # a quarter turn around the center of the grid
+        self.grid.transform(cv2.getRotationMatrix2D((25, 25), 90, 1))
+
+        # each item ends up where its neighbor was
+        for index, other in ((0, 1), (1, 3), (3, 2), (2, 0)):
+            np.testing.assert_allclose(self.grid.items[index].bounds, bounds[other])
+
+    def test_contains(self):
+        item = self.grid.rows[0].items[1]
+
+        self.assertTrue(item.contains((30, 10, 10, 10)))
+        self.assertTrue(item.contains((32, 12, 4, 4)))
+        self.assertFalse(item.contains((25, 10, 10, 10)))
+        self.assertFalse(item.contains((32, 12, 10, 4)))
+        self.assertEqual(self.grid.find_row((12, 32, 4, 4)), self.grid.rows[1])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,83 @@
+import datetime
+import os
+import unittest
+
+from pipeline.headless import HeadlessRunner
+from utils.app_settings import AppSettings
+
+
+class TestHeadless(unittest.TestCase):
+    source_file = "tests/fixtures/video.mp4"
+    output_file = "tests/test_headless_output.txt"
+    totals_file = "tests/fixtures/headless_totals.txt"
+    # same as in test_e2e: only update when detection changes on purpose
+    should_update_totals = False
+
+    target_lines = 10
+    interval = 1
+    expected_dimensions = (8, 12)
+    # headless runs are deterministic, so this only needs to absorb
+    # differences between video decoders on different platforms
+    delta = 5
+
+    def setUp(self):
+        self.settings = AppSettings(keep_defaults=True)
+        self.settings.set("recording.interval", self.interval)
+        self.start_time = datetime.datetime(2022, 1, 1, 0, 0, 0)
+
+    def tearDown(self):
+        try:
+            os.remove(self.output_file)
+        except FileNotFoundError:
+            pass
+
+    def run_pipeline(self):
+        runner = HeadlessRunner(
+            self.settings,
+            source=self.source_file,
+            output_file=self.output_file,
+            start_time=self.start_time,
+        )
+        stats = runner.run()
+        self.assertEqual(runner.grid.dimensions, self.expected_dimensions)
+        self.assertEqual(stats["intervals"], self.target_lines)
+        with open(self.output_file, "r") as f:
+            return f.readlines()
+
+    def test_headless(self):
+        lines = self.run_pipeline()
+        self.assertEqual(len(lines), self.target_lines)
+        actual_totals = [
+            sum(int(part) for part in line.split("\t")[8:]) for line in lines
+        ]
+
+        if self.should_update_totals:
+            with open(self.totals_file, "w") as f:
+                for total in actual_totals:
+                    f.write(f"{total}\n")
+            return
+
+        with open(self.totals_file, "r") as f:
+            totals = [int(line) for line in f.readlines()]
+        for i in range(self.target_lines):
+            self.assertAlmostEqual(totals[i], actual_totals[i], delta=self.delta)
+
+    def test_headless_is_deterministic(self):
+        first = self.run_pipeline()
+        second = self.run_pipeline()
+
+        self.assertEqual(first, second)
+        # timestamps come from video time, not from the wall clock
+        self.assertEqual(first[0].split("\t")[1:3], ["01 Jan 22", "00:00:00"])
+
+    def test_headless_median_scan(self):
+        self.settings.set("scan.frames", 15)
+
+        # the scanned frames are processed too, so there are just as many intervals
+        lines = self.run_pipeline()
+
+        self.assertEqual(len(lines), self.target_lines)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+
+import numpy as np
+
+from handlers.intervals import IntervalBins
+
+
+class TestIntervalBins(unittest.TestCase):
+    def test_advance(self):
+        bins = IntervalBins(2, 1, [3])
+
+        # the first frame sets the origin
+        self.assertEqual(bins.advance(5), [])
+        bins.add(np.array([0]), np.array([1.0]))
+        self.assertEqual(bins.advance(7.5), [])
+        bins.add(np.array([1]), np.array([2.0]))
+
+        finished = bins.advance(8)
+        self.assertEqual(len(finished), 1)
+        output, end, distances = finished[0]
+        self.assertEqual(output, 0)
+        self.assertEqual(end, 3)
+        np.testing.assert_array_equal(distances, [1, 2])
+        np.testing.assert_array_equal(bins.current, [0, 0])
+
+    def test_multiple_intervals(self):
+        bins = IntervalBins(1, 1, [6, 2])
+        bins.advance(0)
+
+        finished = []
+        for time in range(1, 13):
+            bins.add(np.array([0]), np.array([1.0]))
+            finished.extend(bins.advance(time))
+
+        self.assertEqual([end for output, end, _ in finished if output == 0], [6, 12])
+        self.assertEqual(
+            [end for output, end, _ in finished if output == 1], [2, 4, 6, 8, 10, 12]
+        )
+        # every base bin ends up in exactly one interval of each output
+        for i in range(2):
+            self.assertEqual(sum(d[0] for output, _, d in finished if output == i), 12)
+
+    def test_no_drift(self):
+        # frames at 29.97 fps shouldn't shift interval boundaries over time
+        bins = IntervalBins(1, 1, [60])
+        fps = 30000 / 1001
+        ends = []
+        # the last frame is just past the hour
+        for frame in range(round(fps * 3600) + 2):
+            ends.extend(end for _, end, _ in bins.advance(frame / fps))
+
+        self.assertEqual(ends, [60 * (i + 1) for i in range(60)])
+
+    def test_invalid_interval(self):
+        with self.assertRaises(ValueError):
+            IntervalBins(1, 1, [2.5])
+        with self.assertRaises(ValueError):
+            IntervalBins(1, 0, [60])
+
+
+if __name__ == "__main__":
+    unittest.main()
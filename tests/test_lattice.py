@@ -0,0 +1,92 @@
+import math
+import unittest
+
+import numpy as np
+
+from detection.lattice import Lattice, fit_lattice
+
+
+def make_centers(rows: int, cols: int, pitch: float, angle: float, origin=(50, 40)):
+    angle = math.radians(angle)
+    col_step = pitch * np.array([math.cos(angle), math.sin(angle)])
+    row_step = pitch * np.array([-math.sin(angle), math.cos(angle)])
+    lattice = Lattice(origin, col_step, row_step, rows, cols)
+    return np.array(
+        [lattice.get_center(row, col) for row in range(rows) for col in range(cols)]
+    )
+
+
+class TestFitLattice(unittest.TestCase):
+    radius = 10
+
+    def test_fit(self):
+        centers = make_centers(8, 12, 30, 0)
+        # detected circles are never exactly on the lattice
+        centers += np.random.default_rng(0).uniform(-1, 1, centers.shape)
+
+        (lattice, coords) = fit_lattice(centers, self.radius)
+
+        self.assertEqual(lattice.dimensions, (8, 12))
+        np.testing.assert_allclose(lattice.origin, (50, 40), atol=1)
+        np.testing.assert_allclose(lattice.col_step, (30, 0), atol=0.1)
+        np.testing.assert_allclose(lattice.row_step, (0, 30), atol=0.1)
+        np.testing.assert_array_equal(coords[13], (1, 1))
+        np.testing.assert_array_equal(coords[-1], (7, 11))
+
+    def test_fit_rotated(self):
+        centers = make_centers(8, 12, 30, 10)
+
+        (lattice, coords) = fit_lattice(centers[::-1], self.radius)
+
+        self.assertEqual(lattice.dimensions, (8, 12))
+        np.testing.assert_allclose(lattice.get_center(7, 11), centers[-1])
+        np.testing.assert_array_equal(coords[0], (7, 11))
+
+    def test_missing(self):
+        centers = make_centers(8, 12, 30, 0)
+        # a missing corner, and a missing well in the middle
+        centers = np.delete(centers, [0, 50], axis=0)
+
+        (lattice, coords) = fit_lattice(centers, self.radius)
+
+        self.assertEqual(lattice.dimensions, (8, 12))
+        np.testing.assert_allclose(lattice.get_center(0, 0), (50, 40))
+        np.testing.assert_array_equal(coords[0], (0, 1))
+
+    def test_spurious(self):
+        centers = make_centers(8, 12, 30, 0)
+        spurious = [
+            # between two wells
+            (65, 40),
+            # a whole step outside of the plate
+            (50 + 12 * 30, 40),
+            # on top of another well
+            (51, 41),
+        ]
+        centers = np.concatenate((centers, spurious))
+
+        (lattice, coords) = fit_lattice(centers, self.radius)
+
+        self.assertEqual(lattice.dimensions, (8, 12))
+        np.testing.assert_array_equal(coords[0], (0, 0))
+        np.testing.assert_array_equal(coords[96:], -1)
+
+    def test_single_row(self):
+        centers = make_centers(1, 12, 30, 0)
+
+        (lattice, coords) = fit_lattice(centers, self.radius)
+
+        self.assertEqual(lattice.dimensions, (1, 12))
+        np.testing.assert_array_equal(coords[:, 1], np.arange(12))
+
+    def test_get_coords(self):
+        lattice = Lattice((10, 10), (20, 0), (0, 30), 2, 2)
+
+        np.testing.assert_allclose(
+            lattice.get_coords([(10, 10), (30, 40), (20, 25)]),
+            [(0, 0), (1, 1), (0.5, 0.5)],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+
+import numpy as np
+
+from detection.median import MedianFrame
+
+
+class TestMedianFrame(unittest.TestCase):
+    def setUp(self):
+        self.median_frame = MedianFrame(5)
+
+    def make_frame(self, value: int):
+        return np.full((4, 6, 3), value, np.uint8)
+
+    def test_median(self):
+        for value in [10, 12, 11, 13, 10]:
+            frame = self.make_frame(value)
+            # something that's only there for a frame
+            if value == 12:
+                frame[1, 2] = 255
+            self.median_frame.add(frame)
+
+        self.assertTrue(self.median_frame.is_full)
+        np.testing.assert_array_equal(self.median_frame.get(), self.make_frame(11))
+
+    def test_bounded(self):
+        for value in range(20):
+            self.median_frame.add(self.make_frame(value))
+
+        # only the last 5 frames (15-19) are kept
+        self.assertEqual(len(self.median_frame), 5)
+        self.assertEqual(self.median_frame.frames.shape, (5, 4, 6, 3))
+        np.testing.assert_array_equal(self.median_frame.get(), self.make_frame(17))
+
+    def test_partial(self):
+        self.median_frame.add(self.make_frame(1))
+        self.median_frame.add(self.make_frame(3))
+
+        self.assertFalse(self.median_frame.is_full)
+        # the upper of the two middle values
+        np.testing.assert_array_equal(self.median_frame.get(), self.make_frame(3))
+
+    def test_copies_frames(self):
+        frame = self.make_frame(1)
+        self.median_frame.add(frame)
+        frame[:] = 2
+
+        np.testing.assert_array_equal(self.median_frame.get(), self.make_frame(1))
+
+    def test_resolution_change(self):
+        self.median_frame.add(self.make_frame(1))
+        self.median_frame.add(np.zeros((2, 2, 3), np.uint8))
+
+        self.assertEqual(len(self.median_frame), 1)
+        self.assertEqual(self.median_frame.get().shape, (2, 2, 3))
+
+    def test_empty(self):
+        with self.assertRaises(Exception):
+            self.median_frame.get()
+        with self.assertRaises(ValueError):
+            MedianFrame(0)
+
+
+if __name__ == "__main__":
+    unittest.main()
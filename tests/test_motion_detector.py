@@ -1,13 +1,18 @@
 import unittest
 
 import cv2
+import numpy as np
 
+from detection.grids import GridDetector
 from detection.motion import MotionDetector
 from utils.app_settings import AppSettings
+from utils.geometry import get_contour_center
 
 
 class TestMotionDetector(unittest.TestCase):
     def setUp(self):
+        # KNN draws from OpenCV's RNG, which other tests may have used already
+        cv2.setRNGSeed(0)
         self.settings = AppSettings(keep_defaults=True)
         self.detector = MotionDetector(self.settings)
 
@@ -19,3 +24,161 @@ class TestMotionDetector(unittest.TestCase):
 
         contours = self.detector.detect_with_bg_subtractor(frame)
         self.assertEqual(len(contours), 39)
+
+    def test_detect_with_wells(self):
+        frame = cv2.imread("tests/fixtures/frames/1.jpg")
+        grid = GridDetector(frame).detect()
+        self.settings.set("motion.mask_wells", True)
+        detector = MotionDetector(self.settings, grid=grid)
+
+        for i in range(20):
+            frame = cv2.imread(f"tests/fixtures/frames/{i + 1}.jpg")
+            contours = detector.detect(frame)
+
+        self.assertEqual(len(detector.bands), 1)
+        self.assertGreater(len(contours), 0)
+        self.assert_inside_wells(detector, contours)
+
+    def test_detect_with_workers(self):
+        frame = cv2.imread("tests/fixtures/frames/1.jpg")
+        grid = GridDetector(frame).detect()
+        self.settings.set("motion.mask_wells", True)
+        self.settings.set("motion.workers", 4)
+        detector = MotionDetector(self.settings, grid=grid, seed=0)
+        other_detector = MotionDetector(self.settings, grid=grid, seed=0)
+
+        for i in range(20):
+            frame = cv2.imread(f"tests/fixtures/frames/{i + 1}.jpg")
+            contours = detector.detect(frame)
+            other_contours = other_detector.detect(frame)
+        detector.close()
+        other_detector.close()
+
+        # each band covers 2 of the 8 rows
+        self.assertEqual(len(detector.bands), 4)
+        self.assertGreater(len(contours), 0)
+        self.assert_inside_wells(detector, contours)
+        # seeded detectors should be deterministic, even across threads
+        self.assertEqual(len(contours), len(other_contours))
+        for contour, other_contour in zip(contours, other_contours):
+            np.testing.assert_array_equal(contour, other_contour)
+
+    def test_workers_without_wells(self):
+        frame = cv2.imread("tests/fixtures/frames/1.jpg")
+        grid = GridDetector(frame).detect()
+        self.settings.set("motion.workers", 4)
+
+        with self.assertWarns(UserWarning):
+            detector = MotionDetector(self.settings, grid=grid)
+        detector.detect(frame)
+
+        # the whole frame is a single band
+        self.assertEqual(len(detector.bands), 1)
+        self.assertIsNone(detector.bands[0].wells)
+
+    def test_reinit_with_gain(self):
+        self.settings.set("motion.bg_reinit_mode", "gain")
+        detector = MotionDetector(self.settings)
+        frame = self.build_model(detector)
+        bg_model = detector.bands[0].bg_model
+
+        # simulate the lights getting brighter
+        detector.detect(cv2.convertScaleAbs(frame, alpha=1.2))
+
+        band = detector.bands[0]
+        self.assertIs(band.bg_model, bg_model)
+        self.assertAlmostEqual(band.gain, 1 / 1.2, delta=0.02)
+
+    def test_reinit_mode_default(self):
+        # e.g. a settings file from before the mode existed
+        self.settings.set("motion.bg_reinit_mode", None)
+        detector = MotionDetector(self.settings)
+
+        self.assertEqual(detector.bg_reinit_mode, "reset")
+
+    def test_reinit_from_black(self):
+        self.settings.set("motion.bg_reinit_throttle", 0)
+        detector = MotionDetector(self.settings)
+        frame = cv2.imread("tests/fixtures/frames/1.jpg")
+        detector.detect(np.zeros_like(frame))
+        bg_model = detector.bands[0].bg_model
+
+        # the lights turning on, from a mean of 0
+        detector.detect(frame)
+
+        self.assertIsNot(detector.bands[0].bg_model, bg_model)
+
+    def test_reinit_with_large_change(self):
+        self.settings.set("motion.bg_reinit_mode", "gain")
+        # otherwise the new model would be throttled
+        self.settings.set("motion.bg_reinit_throttle", 0)
+        detector = MotionDetector(self.settings)
+        frame = self.build_model(detector)
+        bg_model = detector.bands[0].bg_model
+
+        # simulate the lights turning off, which is too much to compensate for
+        detector.detect(cv2.convertScaleAbs(frame, alpha=0.2))
+
+        band = detector.bands[0]
+        self.assertIsNot(band.bg_model, bg_model)
+        self.assertEqual(band.gain, 1)
+
+    def test_reinit_with_reseed(self):
+        self.settings.set("motion.bg_reinit_mode", "reseed")
+        self.settings.set("motion.bg_reseed_frames", 5)
+        self.settings.set("motion.bg_reinit_throttle", 0)
+        detector = MotionDetector(self.settings)
+        frame = self.build_model(detector)
+        bg_model = detector.bands[0].bg_model
+
+        detector.detect(cv2.convertScaleAbs(frame, alpha=1.2))
+
+        band = detector.bands[0]
+        self.assertIsNot(band.bg_model, bg_model)
+        self.assertEqual(len(list(band.recent_frames())), 5)
+
+    def test_move_grid(self):
+        self.settings.set("motion.method", "running_average")
+        frames = [cv2.imread(f"tests/fixtures/frames/{i + 1}.jpg") for i in range(16)]
+        blobs = []
+        for move in (False, True):
+            grid = GridDetector(frames[0]).detect()
+            detector = MotionDetector(self.settings, grid=grid)
+            for frame in frames[:15]:
+                detector.detect_blobs(frame)
+            frame = frames[15]
+            if move:
+                (height, width) = frame.shape[:2]
+                matrix = np.array([[1, 0, 3], [0, 1, 2]], np.float64)
+                frame = cv2.warpAffine(
+                    frame, matrix, (width, height), borderMode=cv2.BORDER_REPLICATE
+                )
+                grid.transform(matrix)
+                detector.move_grid(matrix, frame)
+            blobs.append(detector.detect_blobs(frame))
+
+        # the background moved along with the plate, so the same flies are found in the same places
+        self.assertGreater(len(blobs[0].areas), 0)
+        np.testing.assert_array_equal(blobs[1].areas, blobs[0].areas)
+        np.testing.assert_allclose(blobs[1].centers, blobs[0].centers + (3, 2))
+
+    def test_invalid_reinit_mode(self):
+        self.settings.set("motion.bg_reinit_mode", "invalid")
+        with self.assertRaises(ValueError):
+            MotionDetector(self.settings)
+
+    def build_model(self, detector):
+        for i in range(20):
+            frame = cv2.imread(f"tests/fixtures/frames/{i + 1}.jpg")
+            detector.detect(frame)
+        return frame
+
+    def assert_inside_wells(self, detector, contours):
+        # every contour should come from inside a well
+        wells_mask = np.zeros(detector.frame_shape, np.uint8)
+        for band in detector.bands:
+            packed = np.full(band.wells.packed_shape, 255, np.uint8)
+            wells_mask |= band.wells.unpack(packed)
+        for contour in contours:
+            (x, y) = get_contour_center(contour)
+            self.assertEqual(wells_mask[int(y), int(x)], 255)
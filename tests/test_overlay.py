@@ -0,0 +1,98 @@
+import unittest
+
+import cv2
+import numpy as np
+
+from utils.overlay import Overlay
+
+
+class TestOverlay(unittest.TestCase):
+    def setUp(self):
+        self.draws = 0
+        self.overlay = Overlay(self.draw_static)
+
+    def draw_static(self, image):
+        self.draws += 1
+        cv2.rectangle(image, (10, 10), (40, 30), (0, 255, 0), 1)
+        cv2.putText(
+            image, "2x3", (5, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255)
+        )
+
+    def make_frame(self, value=50):
+        return np.full((80, 100, 3), value, np.uint8)
+
+    def test_static_matches_drawing(self):
+        frame = self.make_frame()
+        expected = frame.copy()
+        self.draw_static(expected)
+
+        self.overlay.apply(frame)
+
+        np.testing.assert_array_equal(frame, expected)
+
+    def test_static_cached(self):
+        for _ in range(5):
+            self.overlay.apply(self.make_frame(), key=1)
+        self.assertEqual(self.draws, 1)
+
+        # e.g. the grid was moved
+        self.overlay.apply(self.make_frame(), key=2)
+        self.assertEqual(self.draws, 2)
+
+        self.overlay.apply(np.zeros((60, 90, 3), np.uint8), key=2)
+        self.assertEqual(self.draws, 3)
+
+    def test_empty(self):
+        frame = self.make_frame()
+
+        Overlay().apply(frame)
+
+        np.testing.assert_array_equal(frame, self.make_frame())
+
+    def test_events(self):
+        frame = self.make_frame()
+        expected = frame.copy()
+        self.draw_static(expected)
+        cv2.rectangle(expected, (20, 20), (50, 40), (255, 0, 0), 2)
+        cv2.line(expected, (0, 0), (30, 5), (0, 0, 255), 1)
+
+        self.overlay.clear(frame.shape)
+        self.overlay.rectangle((20, 20), (50, 40), (255, 0, 0), 2)
+        self.overlay.line((0, 0), (30, 5), (0, 0, 255), 1)
+        self.overlay.apply(frame)
+
+        # drawn over the static layer
+        np.testing.assert_array_equal(frame, expected)
+
+    def test_events_cleared(self):
+        self.overlay.clear(self.make_frame().shape)
+        self.overlay.rectangle((20, 20), (50, 40), (255, 0, 0), 2)
+        self.overlay.apply(self.make_frame())
+
+        frame = self.make_frame()
+        expected = frame.copy()
+        self.draw_static(expected)
+        self.overlay.clear(frame.shape)
+        self.overlay.apply(frame)
+
+        np.testing.assert_array_equal(frame, expected)
+        self.assertFalse(self.overlay.events.any())
+        self.assertFalse(self.overlay.events_mask.any())
+
+    def test_events_outside_frame(self):
+        frame = self.make_frame()
+        expected = frame.copy()
+        cv2.rectangle(expected, (90, 70), (120, 100), (255, 0, 0), 2)
+        overlay = Overlay()
+
+        overlay.clear(frame.shape)
+        overlay.rectangle((90, 70), (120, 100), (255, 0, 0), 2)
+        overlay.rectangle((200, 200), (220, 220), (255, 0, 0), 2)
+        overlay.apply(frame)
+
+        np.testing.assert_array_equal(frame, expected)
+        self.assertEqual(overlay.regions, [(88, 68, 100, 80)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from custom_types.grid import Grid, Item, Row
+from custom_types.motion import MotionBatch, MotionEventHandler
+from handlers.event_log import EventLogHandler, get_event_log_dir
+from handlers.file_interval import FileIntervalHandler, get_activity_file
+from pipeline.headless import HeadlessRunner
+from pipeline.replay import get_bins, replay
+from utils.app_settings import AppSettings
+
+
+class FanOut(MotionEventHandler):
+    def __init__(self, handlers):
+        super().__init__()
+        self.handlers = handlers
+
+    def handle_frame(self, batch):
+        for handler in self.handlers:
+            handler.handle_frame(batch)
+
+
+def make_grid():
+    rows = []
+    for row_index in range(2):
+        items = []
+        for col_index in range(3):
+            (x, y) = (col_index * 20, row_index * 20)
+            items.append(
+                Item(
+                    ((x, y), (x + 10, y + 10)),
+                    col_index * 2 + row_index,
+                    (row_index, col_index),
+                )
+            )
+        rows.append(Row(items))
+    return Grid(rows)
+
+
+def read(path):
+    with open(path, "r") as f:
+        return f.read()
+
+
+class TestReplay(unittest.TestCase):
+    fps = 30000 / 1001
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.start_time = datetime.datetime(2022, 1, 1, 0, 0, 59, 900000)
+        self.grid = make_grid()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    # simulates a live run with random motion, including a pause in frames
+    def record(self, outputs):
+        handlers = [
+            FileIntervalHandler(
+                self.grid,
+                self.path(name),
+                start_time=self.start_time,
+                **kwargs,
+            )
+            for name, kwargs in outputs
+        ]
+        event_log = EventLogHandler(
+            self.path("events"),
+            FanOut(handlers),
+            grid=self.grid,
+            start_time=self.start_time,
+        )
+        rng = np.random.default_rng(0)
+        times = np.arange(900) / self.fps + 1000
+        times[600:] += 7.3
+        for frame_count, frame_time in enumerate(times, 1):
+            n = rng.integers(0, 4)
+            indices = rng.choice(len(self.grid.items), n)
+            centers = rng.random((n, 2)) * 50
+            event_log.handle_frame(
+                MotionBatch(
+                    self.grid.items,
+                    frame_count,
+                    frame_time,
+                    None,
+                    None,
+                    indices,
+                    centers,
+                    rng.integers(1, 100, n),
+                    np.zeros((n, 4), np.int32),
+                    centers + rng.random((n, 2)) * 7,
+                    rng.integers(1, 100, n),
+                    np.zeros((n, 4), np.int32),
+                    np.full(n, frame_count - 1),
+                )
+            )
+        event_log.close()
+        for handler in handlers:
+            handler.close()
+
+    def test_replay(self):
+        outputs = [
+            ("live_2.txt", {"interval": 2, "activity_interval": 1}),
+            ("live_5.txt", {"interval": 5, "base_interval": 0.5}),
+        ]
+        self.record(outputs)
+
+        for name, kwargs in outputs:
+            with self.subTest(name=name):
+                output = self.path(f"replay_{name}")
+                stats = replay(
+                    self.path("events"),
+                    output,
+                    # small chunks, so bins get split across them
+                    chunk_size=100,
+                    **kwargs,
+                )
+
+                self.assertGreater(stats["intervals"], 0)
+                self.assertEqual(read(output), read(self.path(name)))
+                if "activity_interval" in kwargs:
+                    self.assertEqual(
+                        read(get_activity_file(output)),
+                        read(get_activity_file(self.path(name))),
+                    )
+
+    def test_no_logs(self):
+        with self.assertRaises(ValueError):
+            replay(self.directory.name, self.path("output.txt"), interval=1)
+
+    def test_get_bins(self):
+        times = np.array([10, 10.1, 10.999999, 11, 12.5, 30])
+
+        np.testing.assert_array_equal(get_bins(times, 10, 1), [0, 0, 0, 1, 2, 20])
+        # 1.7 / 0.1 is 17, but 17 * 0.1 > 1.7, so the live run puts it in bin 16
+        np.testing.assert_array_equal(get_bins(np.array([1.7]), 0, 0.1), [16])
+        # and the other way around
+        np.testing.assert_array_equal(
+            get_bins(np.array([2.0999999999999996]), 0, 0.7), [3]
+        )
+
+    def test_headless(self):
+        # replaying a headless run gives back the exact same output
+        settings = AppSettings(keep_defaults=True)
+        settings.set("recording.interval", 1)
+        settings.set("recording.event_log", True)
+        output_file = self.path("headless.txt")
+        HeadlessRunner(
+            settings,
+            source="tests/fixtures/video.mp4",
+            output_file=output_file,
+            start_time=self.start_time,
+        ).run()
+
+        replay_file = self.path("replay.txt")
+        stats = replay(get_event_log_dir(output_file), replay_file, interval=1)
+
+        self.assertEqual(stats["intervals"], 10)
+        self.assertEqual(read(replay_file), read(output_file))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+
+import numpy as np
+
+from custom_types.grid import Grid, Item, Row
+from detection.wells import WellTiles
+
+
+def make_grid(rows: int, columns: int, size: int, gap: int):
+    grid_rows = []
+    for row_index in range(rows):
+        items = []
+        for col_index in range(columns):
+            x = gap + col_index * (size + gap)
+            y = gap + row_index * (size + gap)
+            items.append(
+                Item(
+                    ((x, y), (x + size, y + size)),
+                    col_index * rows + row_index,
+                    (row_index, col_index),
+                )
+            )
+        grid_rows.append(Row(items))
+    return Grid(grid_rows)
+
+
+class TestWellTiles(unittest.TestCase):
+    def setUp(self):
+        # 2x3 wells of 10x10 pixels, with 5 pixels between them
+        self.grid = make_grid(2, 3, 10, 5)
+        self.frame_shape = (40, 60, 3)
+        self.tiles = WellTiles(self.grid, self.frame_shape)
+
+    def test_layout(self):
+        self.assertEqual(len(self.tiles), 6)
+        self.assertEqual(self.tiles.packed_shape, (20, 30))
+        self.assertAlmostEqual(self.tiles.coverage, 600 / 2400)
+
+    def test_pack(self):
+        frame = np.arange(40 * 60, dtype=np.uint32).reshape(40, 60)
+
+        packed = self.tiles.pack(frame)
+
+        # top left well
+        np.testing.assert_array_equal(packed[0:10, 0:10], frame[5:15, 5:15])
+        # bottom right well
+        np.testing.assert_array_equal(packed[10:20, 20:30], frame[20:30, 35:45])
+
+    def test_pack_color(self):
+        frame = np.random.randint(0, 255, self.frame_shape, np.uint8)
+
+        packed = self.tiles.pack(frame)
+
+        self.assertEqual(packed.shape, (20, 30, 3))
+        np.testing.assert_array_equal(packed[0:10, 10:20], frame[5:15, 20:30])
+
+    def test_unpack(self):
+        packed_mask = np.full(self.tiles.packed_shape, 255, np.uint8)
+
+        mask = self.tiles.unpack(packed_mask)
+
+        self.assertEqual(mask.shape, self.frame_shape[:2])
+        # only well pixels are set
+        self.assertEqual(np.count_nonzero(mask), 600)
+        self.assertEqual(mask[0, 0], 0)
+        self.assertEqual(mask[5, 5], 255)
+        self.assertEqual(mask[16, 16], 0)
+
+    def test_mean(self):
+        # wells of different sizes, so the packed image has padding
+        grid = Grid(
+            [
+                Row([Item(((0, 0), (10, 10)), 0, (0, 0))]),
+                Row(
+                    [
+                        Item(((0, 20), (4, 24)), 1, (1, 0)),
+                        Item(((10, 20), (14, 24)), 2, (1, 1)),
+                    ]
+                ),
+            ]
+        )
+        tiles = WellTiles(grid, self.frame_shape)
+        frame = np.full(self.frame_shape[:2], 100, np.uint8)
+
+        packed = tiles.pack(frame)
+
+        self.assertEqual(packed.shape, (14, 10))
+        self.assertEqual(tiles.area, 132)
+        self.assertEqual(tiles.mean(packed), 100)
+
+    def test_clips_to_frame(self):
+        tiles = WellTiles(self.grid, (12, 60, 3))
+
+        # the second row is outside of the frame
+        self.assertEqual(len(tiles), 3)
+        self.assertEqual(tiles.packed_shape, (7, 30))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+import os
+import tempfile
+import threading
+import unittest
+from queue import SimpleQueue
+from unittest.mock import patch
+
+import cv2
+import numpy as np
+
+from pipeline.writer import ALWAYS, INTERVAL, NEVER, AsyncWriter
+
+
+class TestAsyncWriter(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "output.txt")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read(self, filename=None):
+        with open(filename or self.filename, "r") as f:
+            return f.read()
+
+    def test_write(self):
+        writer = AsyncWriter().start()
+        other_file = os.path.join(self.directory.name, "other.txt")
+        for i in range(100):
+            writer.write(self.filename, f"{i}\n")
+        writer.write(other_file, "other\n")
+        writer.close()
+
+        # everything is written in order by the time close returns
+        self.assertEqual(self.read(), "".join(f"{i}\n" for i in range(100)))
+        self.assertEqual(self.read(other_file), "other\n")
+        stats = writer.stats()
+        self.assertEqual(stats["backlog"], 0)
+        self.assertEqual(stats["rows"], 101)
+        self.assertEqual(stats["bytes"], os.path.getsize(self.filename) + 6)
+
+    def test_keeps_files_open(self):
+        writer = AsyncWriter()
+        # queue everything up before starting, so it's written in a single batch
+        for i in range(10):
+            writer.write(self.filename, f"{i}\n")
+        self.assertEqual(writer.stats()["backlog"], 10)
+        self.assertEqual(writer.stats()["max_backlog"], 10)
+
+        with patch("builtins.open", wraps=open) as mock_open:
+            writer.start()
+            writer.write(self.filename, "10\n")
+            writer.close()
+
+        mock_open.assert_called_once_with(self.filename, "a")
+        self.assertEqual(len(self.read().splitlines()), 11)
+
+    def test_write_bytes(self):
+        writer = AsyncWriter().start()
+        filename = os.path.join(self.directory.name, "output.bin")
+        other_file = os.path.join(self.directory.name, "other.bin")
+
+        writer.write(filename, b"ab")
+        writer.write(filename, b"cd")
+        # closes the file once everything before it is written
+        writer.close_file(filename)
+        writer.write(other_file, b"ef")
+        writer.close()
+
+        with open(filename, "rb") as f:
+            self.assertEqual(f.read(), b"abcd")
+        with open(other_file, "rb") as f:
+            self.assertEqual(f.read(), b"ef")
+        self.assertEqual(writer.files, {})
+
+    def test_create(self):
+        with open(self.filename, "w") as f:
+            f.write("from an earlier run\n")
+        writer = AsyncWriter().start()
+
+        writer.write(self.filename, "old\n")
+        # replaces everything written before it
+        writer.create(self.filename, "header\n")
+        writer.write(self.filename, "row\n")
+        writer.close()
+
+        self.assertEqual(self.read(), "header\nrow\n")
+
+    def test_fsync_policy(self):
+        for policy, batches, expected in [
+            (ALWAYS, 3, 4),
+            # the interval hasn't passed, so only the final sync on close
+            (INTERVAL, 3, 1),
+            (NEVER, 3, 0),
+        ]:
+            with self.subTest(policy=policy), patch("os.fsync") as fsync:
+                writer = AsyncWriter(fsync=policy)
+                for i in range(batches):
+                    writer.write_batch([(self.filename, f"{i}\n", writer.clock())])
+                writer.start()
+                writer.close()
+
+                self.assertEqual(fsync.call_count, expected)
+
+    def test_fsync_interval(self):
+        time = 0
+        writer = AsyncWriter(fsync=INTERVAL, fsync_interval=10, clock=lambda: time)
+        with patch("os.fsync") as fsync:
+            writer.write_batch([(self.filename, "a\n", time)])
+            time = 10
+            writer.write_batch([(self.filename, "b\n", time)])
+            writer.write_batch([(self.filename, "c\n", time)])
+
+            self.assertEqual(fsync.call_count, 1)
+            writer.close()
+
+    def test_write_image(self):
+        writer = AsyncWriter().start()
+        path = os.path.join(self.directory.name, "image.png")
+        image = np.full((4, 4, 3), 127, np.uint8)
+
+        self.assertTrue(writer.write_image(path, image))
+        writer.close()
+
+        np.testing.assert_array_equal(cv2.imread(path), image)
+        self.assertEqual(writer.stats()["images"], 1)
+        self.assertEqual(writer.stats()["images_pending"], 0)
+
+    def test_drops_images(self):
+        writer = AsyncWriter(image_workers=1, max_pending_images=1).start()
+        # hold the only worker, so the first image stays pending
+        gate = threading.Event()
+        writer.image_executor.submit(gate.wait)
+        path = os.path.join(self.directory.name, "image.png")
+        image = np.zeros((4, 4, 3), np.uint8)
+
+        self.assertTrue(writer.write_image(path, image))
+        self.assertFalse(writer.write_image(path, image))
+        gate.set()
+        writer.close()
+
+        self.assertEqual(writer.stats()["images"], 1)
+        self.assertEqual(writer.stats()["images_dropped"], 1)
+
+    def test_error_queue(self):
+        errors = SimpleQueue()
+        writer = AsyncWriter(error_queue=errors).start()
+        missing = os.path.join(self.directory.name, "missing", "output.txt")
+
+        writer.write(missing, "row\n")
+        writer.write(self.filename, "row\n")
+        writer.close()
+
+        self.assertIsInstance(errors.get_nowait(), OSError)
+
+    def test_raises_on_close(self):
+        writer = AsyncWriter().start()
+        writer.write(os.path.join(self.directory.name, "missing", "output.txt"), "")
+
+        with self.assertRaises(OSError):
+            writer.close()
+
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            AsyncWriter(fsync="sometimes")
+
+
+if __name__ == "__main__":
+    unittest.main()
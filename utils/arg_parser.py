@@ -10,11 +10,27 @@ def tuning_type(value):
     return value
 
 
+# e.g. the output interval, which is a whole number of seconds
+def positive_int(value):
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number <= 0:
+        raise argparse.ArgumentTypeError(
+            f"Invalid value: {value}. Must be a positive whole number."
+        )
+    return number
+
+
 def arg_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument("--tuning", help="Tuning mode", type=tuning_type)
     parser.add_argument("--keep-defaults", help="Keep defaults", type=bool)
     parser.add_argument("--silent", help="Silent", type=bool)
+    parser.add_argument("--headless", help="Record without the UI", action="store_true")
+    parser.add_argument("--source", help="Video source (overrides settings)")
+    parser.add_argument("--output", help="Output file (overrides settings)")
 
     # return as dict
     return vars(parser.parse_args())
@@ -0,0 +1,33 @@
+import cv2
+
+
+def fit_size(width: int, height: int, max_width: int, max_height: int):
+    # scale (width, height) to fit inside (max_width, max_height), keeping the aspect ratio
+    aspect_ratio = width / height
+    if (max_width / aspect_ratio) > max_height:
+        return (int(max_height * aspect_ratio), max_height)
+    return (max_width, int(max_width / aspect_ratio))
+
+
+def fit_frame(frame, max_width: int, max_height: int):
+    height, width = frame.shape[:2]
+    new_width, new_height = fit_size(width, height, max_width, max_height)
+    return cv2.resize(frame, (new_width, new_height))
+
+
+# the resolution that detection runs at, independent of the preview window
+# returns None when frames should be processed at their native resolution
+def get_processing_size(settings):
+    width = settings.get("processing.width")
+    height = settings.get("processing.height")
+    if width is None or height is None:
+        return None
+    return (int(width), int(height))
+
+
+# returns the frame itself when there's nothing to resize, which can be a view of the capture buffer
+# so anything that keeps it beyond the current frame has to copy it (e.g. image recording, the video archive)
+def to_processing_resolution(frame, size):
+    if size is None:
+        return frame
+    return fit_frame(frame, size[0], size[1])
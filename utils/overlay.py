@@ -0,0 +1,108 @@
+from typing import Callable
+
+import cv2
+import numpy as np
+
+# this class draws overlays (wells, indices, fly boxes) on preview frames, without redrawing everything on every frame
+# it has two layers, which are blended onto the frame with masked copies, so what's drawn replaces the pixels under it
+
+# the static layer holds whatever only changes with the grid (wells, indices, the dimensions label)
+# it's drawn by `draw_static` onto a blank image, along with a mask of the pixels it covers,
+# and only drawn again when the key passed to apply or the frame size changes (e.g. Grid.version after a drift correction)
+# so a 96-well plate costs a single cv2.copyTo per frame, instead of a rectangle and a putText per well
+# (text is where this pays off, rasterizing it is several times slower than copying it)
+
+# the event layer holds what changes on every frame (fly boxes, distance lines), which only covers a few small regions
+# it's cleared and drawn again for each frame, and only those regions are copied, drawn over the static layer
+
+# black (0, 0, 0) isn't in the mask, so it can't be drawn on either layer
+
+
+# pixels of an image that aren't black, as a mask for cv2.copyTo
+def get_mask(image):
+    if len(image.shape) == 3:
+        return np.any(image != 0, axis=2).astype(np.uint8)
+    return (image != 0).astype(np.uint8)
+
+
+class Overlay:
+    def __init__(self, draw_static: Callable[[np.ndarray], None] | None = None):
+        self.draw_static = draw_static
+
+        # static layer
+        self.static = None
+        self.static_mask = None
+        self.static_key = None
+        # (x, y, w, h) of what's on the static layer, so the rest of the frame isn't copied
+        self.static_bounds = (0, 0, 0, 0)
+
+        # event layer
+        self.events = None
+        self.events_mask = None
+        # (x1, y1, x2, y2) of everything drawn on the event layer since it was last cleared
+        self.regions: list[tuple[int, int, int, int]] = []
+
+    # draws the static layer again if the key or the frame size changed since it was last drawn
+    def render_static(self, frame_shape, key=None):
+        if (
+            self.static is not None
+            and self.static.shape == frame_shape
+            and self.static_key == key
+        ):
+            return
+        self.static = np.zeros(frame_shape, np.uint8)
+        if self.draw_static is not None:
+            self.draw_static(self.static)
+        self.static_mask = get_mask(self.static)
+        self.static_bounds = cv2.boundingRect(self.static_mask)
+        self.static_key = key
+
+    # has to be called before drawing events for a new frame
+    # only the regions that were drawn on are erased, so it's cheap when there were few events
+    def clear(self, frame_shape):
+        if self.events is None or self.events.shape != frame_shape:
+            self.events = np.zeros(frame_shape, np.uint8)
+            self.events_mask = np.zeros(frame_shape[:2], np.uint8)
+        else:
+            for x1, y1, x2, y2 in self.regions:
+                self.events[y1:y2, x1:x2] = 0
+                self.events_mask[y1:y2, x1:x2] = 0
+        self.regions = []
+
+    def add_region(self, pt1, pt2, thickness: int):
+        (height, width) = self.events.shape[:2]
+        x1 = max(0, min(pt1[0], pt2[0]) - thickness)
+        y1 = max(0, min(pt1[1], pt2[1]) - thickness)
+        x2 = min(width, max(pt1[0], pt2[0]) + thickness + 1)
+        y2 = min(height, max(pt1[1], pt2[1]) + thickness + 1)
+        if x1 < x2 and y1 < y2:
+            self.regions.append((x1, y1, x2, y2))
+
+    def rectangle(self, pt1, pt2, color, thickness: int):
+        cv2.rectangle(self.events, pt1, pt2, color, thickness)
+        cv2.rectangle(self.events_mask, pt1, pt2, 1, thickness)
+        self.add_region(pt1, pt2, thickness)
+
+    def line(self, pt1, pt2, color, thickness: int):
+        cv2.line(self.events, pt1, pt2, color, thickness)
+        cv2.line(self.events_mask, pt1, pt2, 1, thickness)
+        self.add_region(pt1, pt2, thickness)
+
+    # draws both layers onto the frame, in place
+    def apply(self, frame, key=None):
+        self.render_static(frame.shape, key)
+        (x, y, w, h) = self.static_bounds
+        if w > 0 and h > 0:
+            cv2.copyTo(
+                self.static[y : y + h, x : x + w],
+                self.static_mask[y : y + h, x : x + w],
+                frame[y : y + h, x : x + w],
+            )
+        if self.events is None or self.events.shape != frame.shape:
+            return
+        for x1, y1, x2, y2 in self.regions:
+            cv2.copyTo(
+                self.events[y1:y2, x1:x2],
+                self.events_mask[y1:y2, x1:x2],
+                frame[y1:y2, x1:x2],
+            )